@@ -98,6 +98,9 @@ class State(object):
 
     _objectDictionary = dict()
 
+    # formatted value strings by (type, raw bytes), cleared on every stop
+    _valstrings = dict()
+
     # class FrameSelector(object):
     #     def __init__(self, frame):
     #         self.frame = frame
@@ -485,11 +488,33 @@ class State(object):
             self.arrays = oldArrays
             self.structs = oldStructs
 
+    @staticmethod
+    def _format_val(v):
+        text = v.format_string()
+        t = v.type.strip_typedefs()
+        # print puts the pointer type in front of everything but C strings.
+        # _true_type depends on that, so keep doing it.
+        if t.code == gdb.TYPE_CODE_PTR:
+            target = t.target().strip_typedefs()
+            textual = target.sizeof == 1 and \
+                    target.code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_CHAR)
+            if not textual:
+                text = "(" + str(v.type) + ") " + text
+        return text
+
     def name_to_valstring(self, name):
-        with FrameSelector(self.frame):
-            gdbPrint = gdb.execute("print " + name, False, True)
-            ansSections = gdbPrint[:-1].split(" = ")[1:]
-            return " ".join(ansSections)
+        v = self.name_to_val(name)
+        if v.address is None:
+            return State._format_val(v)
+        try:
+            raw = bytes(gdb.selected_inferior().read_memory(
+                int(v.address), v.type.sizeof))
+        except gdb.MemoryError:
+            return State._format_val(v)
+        key = (str(v.type), raw)
+        if key not in State._valstrings:
+            State._valstrings[key] = State._format_val(v)
+        return State._valstrings[key]
 
     def name_to_val(self, name):
         with FrameSelector(self.frame):
@@ -557,6 +582,7 @@ class StateSerializer(json.JSONEncoder):
         return json.JSONEncoder.default(self, StateSerializer.equal_fix(obj))
 
 def stopped(event):
+    State._valstrings.clear()
     state = State()
     state.serialize_locals()
     with open("arrays.json", "w") as outfile:
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to store the values of debugee objects as compressed raw bytes,
+formatting them only once a client looks at them.
+"""
+
+import collections
+import json
+import re
+import zlib
+
+import gdb
+
+import formatting
+import models
+import storage
+import writebuffer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TypeTable(object):
+    """
+    *Concrete* class to find the gdb types of blob values.
+
+    Blobs store the name of their type, which means the same thing in any
+    process debugging the same program.  Names are turned back into types
+    once per table.  gdb.lookup_type only knows plain type names, so
+    qualifiers, pointers and array dimensions are peeled off and put back
+    on by hand.
+    """
+
+    _arrayFinder = re.compile(r"^(.*?)\s*\[(\d*)\]$")
+    _qualifiers = ("const ", "volatile ")
+
+    def __init__(self):
+        self._types = dict()
+
+    def name(self, typ):
+        """
+        The name to store for typ.
+        """
+        name = str(typ)
+        self._types.setdefault(name, typ)
+        return name
+
+    def _lookup(self, name):
+        name = name.strip()
+        if name.endswith("*"):
+            return self._lookup(name[:-1]).pointer()
+        array = TypeTable._arrayFinder.match(name)
+        if array:
+            # NOTE: the innermost dimension is the last one written, so it
+            # is peeled off first and wrapped last.
+            dims = []
+            while array:
+                inner = array.group(1)
+                dims.append(int(array.group(2) or 0))
+                array = TypeTable._arrayFinder.match(inner)
+            typ = self._lookup(inner)
+            for dim in dims:
+                typ = typ.array(dim - 1)
+            return typ
+        for qualifier in TypeTable._qualifiers:
+            if name.startswith(qualifier):
+                typ = self._lookup(name[len(qualifier):])
+                return typ.const() if qualifier == "const " \
+                        else typ.volatile()
+            if name.endswith(" " + qualifier.strip()):
+                typ = self._lookup(name[:-len(qualifier)])
+                return typ.const() if qualifier == "const " \
+                        else typ.volatile()
+        return gdb.lookup_type(name)
+
+    def type(self, name):
+        """
+        The gdb type called name, or None if there is no such type.
+        """
+        if name is None:
+            return None
+        typ = self._types.get(name)
+        if typ is None:
+            try:
+                typ = self._lookup(name)
+            except (gdb.error, RuntimeError, ValueError):
+                return None
+            self._types[name] = typ
+        return typ
+
+
+class BlobStore(object):
+    """
+    *Concrete* class to compress the raw values of one execution.
+
+    zstd is used when the zstandard module is installed, zlib otherwise.
+    The first trainSamples values are kept as samples.  Once there are
+    enough, a dictionary is trained from them (a zstd dictionary, or for
+    zlib a preset dictionary of the most common values) and stored as a
+    models.CompressionDictionary.  Later values are compressed against it,
+    which is where most of the gain on small values comes from.
+
+    Values smaller than minBytes, or which do not shrink, are stored as
+    they are.
+    """
+
+    codec = "zstd" if zstandard is not None else "zlib"
+    level = 3
+    minBytes = 64
+    maxBytes = 15 * 1024 * 1024
+    trainSamples = 1000
+    dictionarySize = 32 * 1024
+
+    types = TypeTable()
+
+    def __init__(self, execution, codec=None):
+        self.execution = execution
+        self.codec = codec or BlobStore.codec
+        if self.codec == "zstd" and zstandard is None:
+            raise ValueError("zstd blobs need the zstandard module")
+        self.dictionary = None
+        self._samples = []
+        self._compressor = None
+        self._dictionaries = dict()
+        self.rawBytes = 0
+        self.storedBytes = 0
+
+    def _zlib_dictionary(self):
+        # NOTE: zlib favours the end of a preset dictionary, so the most
+        # common values go last.
+        counts = collections.Counter(self._samples)
+        data = b""
+        for sample, _ in counts.most_common():
+            if len(data) + len(sample) > BlobStore.dictionarySize:
+                break
+            data = sample + data
+        return data
+
+    def _train(self):
+        if self.codec == "zstd":
+            try:
+                data = zstandard.train_dictionary(
+                    BlobStore.dictionarySize, self._samples).as_bytes()
+            except zstandard.ZstdError:
+                data = self._zlib_dictionary()
+        else:
+            data = self._zlib_dictionary()
+        self._samples = []
+        if not data:
+            return
+        self.dictionary = models.CompressionDictionary(
+            execution=self.execution, codec=self.codec, data=data)
+        writebuffer.buffer.add(self.dictionary)
+        self._dictionaries[self.dictionary.id] = data
+
+    def _compress(self, raw):
+        data = self.dictionary.data if self.dictionary is not None else None
+        if self.codec == "zstd":
+            if self._compressor is None:
+                if data is not None:
+                    self._compressor = zstandard.ZstdCompressor(
+                        level=BlobStore.level,
+                        dict_data=zstandard.ZstdCompressionDict(data))
+                else:
+                    self._compressor = zstandard.ZstdCompressor(
+                        level=BlobStore.level)
+            return self._compressor.compress(raw)
+        if data is not None:
+            compressor = zlib.compressobj(BlobStore.level, zdict=data)
+        else:
+            compressor = zlib.compressobj(BlobStore.level)
+        return compressor.compress(raw) + compressor.flush()
+
+    def pack(self, raw, typ):
+        """
+        Return the fields storing raw (a value of type typ), or None if it
+        is too big to go in a document.
+        """
+        raw = bytes(raw)
+        if len(raw) > BlobStore.maxBytes:
+            return None
+        fields = {
+            "raw_size": len(raw),
+            "blob_type": BlobStore.types.name(typ),
+        }
+        self.rawBytes += len(raw)
+        if len(raw) < BlobStore.minBytes:
+            fields["codec"] = "raw"
+            fields["blob"] = raw
+            self.storedBytes += len(raw)
+            return fields
+
+        if self.dictionary is None:
+            self._samples.append(raw[:BlobStore.dictionarySize])
+            if len(self._samples) >= BlobStore.trainSamples:
+                self._train()
+                self._compressor = None
+
+        packed = self._compress(raw)
+        if len(packed) >= len(raw):
+            fields["codec"] = "raw"
+            fields["blob"] = raw
+        else:
+            fields["codec"] = self.codec
+            fields["blob"] = packed
+            if self.dictionary is not None:
+                fields["blob_dictionary"] = self.dictionary
+        self.storedBytes += len(fields["blob"])
+        return fields
+
+    def _dictionary_data(self, dictionaryId):
+        data = self._dictionaries.get(dictionaryId)
+        if data is None:
+            found = storage.backend.documents(
+                models.CompressionDictionary, limit=1, _id=dictionaryId)
+            if not found:
+                raise KeyError(dictionaryId)
+            data = found[0].data
+            self._dictionaries[dictionaryId] = data
+        return data
+
+    def unpack(self, codec, blob, dictionaryId=None):
+        """
+        Return the raw bytes a blob was packed from.
+        """
+        blob = bytes(blob)
+        if codec == "raw":
+            return blob
+        data = self._dictionary_data(dictionaryId) \
+                if dictionaryId is not None else None
+        if codec == "zstd":
+            if zstandard is None:
+                raise ValueError("zstd blobs need the zstandard module")
+            if data is not None:
+                decompressor = zstandard.ZstdDecompressor(
+                    dict_data=zstandard.ZstdCompressionDict(data))
+            else:
+                decompressor = zstandard.ZstdDecompressor()
+            return decompressor.decompress(blob)
+        if codec == "zlib":
+            if data is not None:
+                decompressor = zlib.decompressobj(zdict=data)
+            else:
+                decompressor = zlib.decompressobj()
+            return decompressor.decompress(blob) + decompressor.flush()
+        raise ValueError("Unknown blob codec: " + str(codec))
+
+    def render(self, doc):
+        """
+        Format the value of the Memory document doc.
+        """
+        if doc.value is not None or doc.blob is None:
+            return doc.value
+        son = doc.to_mongo()
+        raw = self.unpack(doc.codec, doc.blob, son.get("blob_dictionary"))
+        typ = BlobStore.types.type(doc.blob_type)
+        if typ is None:
+            return "?"
+        return formatting.ValueFormatter.format_bytes(raw, typ)
+
+    def view(self, doc):
+        """
+        Return doc as a JSON ready dict for a client, with its value
+        formatted and its blob left out.
+        """
+        viewed = json.loads(doc.to_json())
+        for field in ("blob", "codec", "blob_dictionary", "blob_type"):
+            viewed.pop(field, None)
+        viewed["value"] = self.render(doc)
+        return viewed
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to store a whole snapshot as a few large column oriented documents
+rather than one document per Memory node.
+"""
+
+import array
+import bisect
+import sys
+
+import bson
+
+import models
+import storage
+import writebuffer
+
+
+def _pack(typecode, values):
+    packed = array.array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(typecode, data):
+    unpacked = array.array(typecode)
+    unpacked.frombytes(data)
+    if sys.byteorder == "big":
+        unpacked.byteswap()
+    return unpacked
+
+
+def address_int(address):
+    """
+    Turn an address as printed by gdb ("0x601040 <global>") into an int.
+    Returns -1 if there is no address.
+    """
+    try:
+        return int(str(address).split(" ")[0], 16)
+    except ValueError:
+        return -1
+
+
+class TypeInterner(object):
+    """
+    *Concrete* class to map the type strings of a node onto a shared
+    models.Type document.
+    """
+
+    def __init__(self):
+        self._types = dict()
+
+    def intern(self, name, unaliased, dynamic, kind):
+        key = (name, unaliased, dynamic, kind)
+        typ = self._types.get(key)
+        if typ is None:
+            found = storage.backend.documents(
+                models.Type,
+                limit=1,
+                name=name,
+                unaliased_type=unaliased,
+                dynamic_type=dynamic,
+                kind=kind)
+            typ = found[0] if found else None
+            if typ is None:
+                typ = models.Type(
+                    name=name,
+                    unaliased_type=unaliased,
+                    dynamic_type=dynamic,
+                    kind=kind)
+                writebuffer.buffer.add(typ)
+            self._types[key] = typ
+        return typ
+
+
+class ColumnarWriter(object):
+    """
+    *Concrete* class to collect the nodes of one snapshot into
+    models.SnapshotChunk documents of at most chunkSize nodes and (roughly)
+    maxChunkBytes bytes each.  The byte cap keeps a chunk clear of the 16MB
+    document limit when nodes carry large extras (vectorized array data
+    can be up to ArrayPull.maxVectorBytes on its own).
+
+    Nodes are numbered in the order they are added.  Children are referred
+    to by number, so children must be added before their parents (which is
+    the order traversal.Traversal stores in).
+    """
+
+    chunkSize = 20000
+    maxChunkBytes = 8 * 1024 * 1024
+
+    # fields which get a column of their own; anything else a node has goes
+    # into the chunk's extras
+    _columns = {
+        "address", "name", "relative_name", "frame", "type",
+        "unaliased_type", "dynamic_type", "value", "range_start",
+        "range_end", "truncated", "children", "execution", "content_hash",
+    }
+
+    types = TypeInterner()
+
+    def __init__(self, execution, sequence, chunkSize=None):
+        self.execution = execution
+        self.sequence = sequence
+        self.chunkSize = chunkSize or ColumnarWriter.chunkSize
+        self.count = 0
+        self.chunks = 0
+        # number of the first node of every chunk
+        self.starts = []
+        self._reset()
+
+    def _reset(self):
+        self._addresses = []
+        self._typeIds = []
+        self._types = []
+        self._typeIndex = dict()
+        self._frameIds = []
+        self._frames = []
+        self._frameIndex = dict()
+        self._names = []
+        self._relativeNames = []
+        self._values = []
+        self._rangeStarts = []
+        self._rangeEnds = []
+        self._flags = []
+        self._childOffsets = [0]
+        self._childIndices = []
+        self._extras = dict()
+        self._bytes = 0
+
+    @staticmethod
+    def _local_id(table, index, key):
+        i = index.get(key)
+        if i is None:
+            i = len(table)
+            index[key] = i
+            table.append(key)
+        return i
+
+    @staticmethod
+    def _size(paramDict, children, extras):
+        """
+        About how many bytes a node adds to a chunk.
+        """
+        # NOTE: the fixed width columns and list entries come to less than
+        # 64 bytes a node.
+        size = 64 + 8 * len(children)
+        for field in ("name", "relative_name", "value"):
+            value = paramDict.get(field)
+            if value is not None:
+                size += len(str(value).encode("utf-8"))
+        if extras:
+            size += len(bson.BSON.encode(extras))
+        return size
+
+    def add(self, paramDict, children, kind="Memory"):
+        """
+        Add one node (the fields a Memory document would have) and the
+        numbers of its children.  Returns the node's number.
+        """
+        extras = {k: v for k, v in paramDict.items()
+                  if k not in ColumnarWriter._columns}
+        size = ColumnarWriter._size(paramDict, children, extras)
+        if self._names and self._bytes + size > ColumnarWriter.maxChunkBytes:
+            self._flush_chunk()
+        self._bytes += size
+        typ = ColumnarWriter.types.intern(
+            paramDict.get("type"),
+            paramDict.get("unaliased_type"),
+            paramDict.get("dynamic_type"),
+            kind)
+        self._typeIds.append(
+            self._local_id(self._types, self._typeIndex, typ))
+        self._frameIds.append(self._local_id(
+            self._frames, self._frameIndex, paramDict.get("frame")))
+        self._addresses.append(address_int(paramDict.get("address")))
+        self._names.append(paramDict.get("name"))
+        self._relativeNames.append(paramDict.get("relative_name"))
+        self._values.append(paramDict.get("value"))
+        self._rangeStarts.append(paramDict.get("range_start", 0))
+        self._rangeEnds.append(paramDict.get("range_end", 0))
+        self._flags.append(1 if paramDict.get("truncated") else 0)
+        self._childIndices.extend(children)
+        self._childOffsets.append(len(self._childIndices))
+        if extras:
+            self._extras[str(len(self._names) - 1)] = extras
+
+        index = self.count
+        self.count += 1
+        if len(self._names) >= self.chunkSize:
+            self._flush_chunk()
+        return index
+
+    def _flush_chunk(self):
+        if not self._names:
+            return
+        chunk = models.SnapshotChunk(
+            execution=self.execution,
+            sequence=self.sequence,
+            chunk=self.chunks,
+            start=self.count - len(self._names),
+            count=len(self._names),
+            addresses=_pack("q", self._addresses),
+            types=self._types,
+            type_ids=_pack("i", self._typeIds),
+            frames=self._frames,
+            frame_ids=_pack("i", self._frameIds),
+            names=self._names,
+            relative_names=self._relativeNames,
+            values=self._values,
+            range_starts=_pack("q", self._rangeStarts),
+            range_ends=_pack("q", self._rangeEnds),
+            flags=_pack("B", self._flags),
+            child_offsets=_pack("i", self._childOffsets),
+            child_indices=_pack("q", self._childIndices),
+            extras=self._extras)
+        writebuffer.buffer.add(chunk)
+        self.starts.append(chunk.start)
+        self.chunks += 1
+        self._reset()
+
+    def finish(self):
+        self._flush_chunk()
+
+
+class ColumnarSnapshot(object):
+    """
+    *Concrete* class to read the nodes of a columnar snapshot back.
+
+    Chunks are loaded the first time one of their nodes is asked for, and
+    nodes are rebuilt as dicts shaped like Memory documents (children are
+    node numbers).
+    """
+
+    def __init__(self, execution, sequence):
+        self.execution = execution
+        self.sequence = sequence
+        snapshots = storage.backend.documents(
+            models.Snapshot, limit=1, execution=execution.id,
+            sequence=sequence)
+        self.snapshot = snapshots[0] if snapshots else None
+        self._chunks = dict()
+        self._types = dict()
+
+    def __len__(self):
+        return self.snapshot.node_count if self.snapshot else 0
+
+    def _chunk_for(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        chunkNumber = bisect.bisect_right(
+            self.snapshot.chunk_starts, index) - 1
+        chunk = self._chunks.get(chunkNumber)
+        if chunk is None:
+            doc = storage.backend.documents(
+                models.SnapshotChunk,
+                limit=1,
+                execution=self.execution.id,
+                sequence=self.sequence,
+                chunk=chunkNumber)[0]
+            chunk = {
+                "doc": doc,
+                "addresses": _unpack("q", doc.addresses),
+                "type_ids": _unpack("i", doc.type_ids),
+                "frame_ids": _unpack("i", doc.frame_ids),
+                "range_starts": _unpack("q", doc.range_starts),
+                "range_ends": _unpack("q", doc.range_ends),
+                "flags": _unpack("B", doc.flags),
+                "child_offsets": _unpack("i", doc.child_offsets),
+                "child_indices": _unpack("q", doc.child_indices),
+            }
+            self._chunks[chunkNumber] = chunk
+        return chunk
+
+    def _type(self, typeId):
+        typ = self._types.get(typeId)
+        if typ is None:
+            typ = storage.backend.documents(models.Type, _id=typeId)[0]
+            self._types[typeId] = typ
+        return typ
+
+    def node(self, index):
+        chunk = self._chunk_for(index)
+        doc = chunk["doc"]
+        i = index - doc.start
+        if i >= doc.count:
+            raise IndexError(index)
+        typ = self._type(doc.to_mongo()["types"][chunk["type_ids"][i]])
+        first = chunk["child_offsets"][i]
+        last = chunk["child_offsets"][i + 1]
+        address = chunk["addresses"][i]
+        node = {
+            "index": index,
+            "address": hex(address) if address >= 0 else "?",
+            "name": doc.names[i],
+            "relative_name": doc.relative_names[i],
+            "frame": doc.frames[chunk["frame_ids"][i]],
+            "type": typ.name,
+            "unaliased_type": typ.unaliased_type,
+            "dynamic_type": typ.dynamic_type,
+            "value": doc.values[i],
+            "range_start": chunk["range_starts"][i],
+            "range_end": chunk["range_ends"][i],
+            "truncated": bool(chunk["flags"][i]),
+            "children": list(chunk["child_indices"][first:last]),
+        }
+        node.update(doc.extras.get(str(i), {}))
+        return node
+
+    def roots(self):
+        if self.snapshot is None:
+            return []
+        return [self.node(i) for i in self.snapshot.root_indices]
+
+    def children(self, index):
+        return [self.node(i) for i in self.node(index)["children"]]
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes and functions for content addressed (Merkle hashed) storage of
+Memory documents.
+"""
+
+import hashlib
+
+# fields which say where a document is stored rather than what is in it
+_unhashedFields = {"execution", "children", "content_hash", "snapshot"}
+
+
+def content_hash(paramDict, children):
+    """
+    Hash the fields of a (not yet saved) Memory document together with the
+    content hashes of its children.
+
+    Two nodes get the same hash exactly when they, and everything below
+    them, would be saved as identical documents.
+    """
+    h = hashlib.sha1()
+    for key in sorted(paramDict):
+        if key in _unhashedFields:
+            continue
+        value = paramDict[key]
+        h.update(key.encode("utf-8"))
+        h.update(b"\0")
+        if isinstance(value, bytes):
+            h.update(value)
+        else:
+            h.update(repr(value).encode("utf-8"))
+        h.update(b"\0")
+    for child in children:
+        h.update(str(child.content_hash).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ContentStore(object):
+    """
+    *Concrete* class to find the document already stored for some content
+    within an execution.
+
+    An execution is only ever written by the process capturing it, so the
+    in process map sees every document and never needs to ask the database.
+    """
+
+    def __init__(self, execution):
+        self.execution = execution
+        self._docs = dict()
+        self.hits = 0
+
+    def find(self, contentHash):
+        doc = self._docs.get(contentHash)
+        if doc is not None:
+            self.hits += 1
+        return doc
+
+    def add(self, doc):
+        self._docs[doc.content_hash] = doc
+
+    def clear(self):
+        self._docs.clear()
+
+
+def changed(old, new):
+    """
+    Yield (old, new) pairs of Memory documents which differ between two
+    snapshots' roots.
+
+    Only subtrees whose hashes differ are descended into, so the cost is
+    proportional to what changed rather than to the size of the snapshot.
+    Nodes present on one side only are paired with None.
+    """
+    stack = [(old, new)]
+    while stack:
+        a, b = stack.pop()
+        if isinstance(a, list) or isinstance(b, list):
+            stack.extend(_pair(a or [], b or [], roots=True))
+            continue
+        if a is not None and b is not None and \
+                a.content_hash == b.content_hash:
+            continue
+        yield (a, b)
+        if a is not None and b is not None:
+            stack.extend(_pair(a.children, b.children))
+
+
+def _pair(olds, news, roots=False):
+    key = (lambda d: (d.frame, d.name)) if roots else (lambda d: d.name)
+    oldByKey = {key(d): d for d in olds}
+    newByKey = {key(d): d for d in news}
+    for k in set(oldByKey) | set(newByKey):
+        yield (oldByKey.get(k), newByKey.get(k))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes and functions to work out what changed between two stops and to
+push just that to connected clients.
+"""
+
+import collections
+
+import contentstore
+
+
+# What changed going from stop base to stop sequence.  added and changed
+# hold the new Memory documents, removed the (frame, name) keys of nodes
+# which are gone (along with everything below them).
+Delta = collections.namedtuple(
+    "Delta", ["base", "sequence", "added", "removed", "changed"])
+
+# A Delta as kept by DeltaFeed.  revision counts the times truncated nodes
+# of stop sequence were filled in, up to this one.  entries holds the
+# subscriptions.Index entries of the nodes added and changed (None when
+# published without an index).  encoded maps a format name to its encoded
+# added nodes, changed nodes and the whole delta's wire.Frame.
+Stop = collections.namedtuple(
+    "Stop", ["base", "sequence", "revision", "removed", "entries", "encoded"])
+
+
+def nodes(roots):
+    """
+    Every Memory document reachable from roots, each once, parents first.
+    """
+    seen = set()
+    found = []
+    stack = list(reversed(roots))
+    while stack:
+        doc = stack.pop()
+        if doc is None or doc.id in seen:
+            continue
+        seen.add(doc.id)
+        found.append(doc)
+        stack.extend(reversed(doc.children))
+    return found
+
+
+def diff(oldRoots, newRoots, base, sequence):
+    """
+    Work out the Delta between two snapshots' roots.  Unchanged subtrees
+    are skipped by hash (see contentstore.changed).
+    """
+    added = []
+    removed = []
+    changed = []
+    for old, new in contentstore.changed(list(oldRoots), list(newRoots)):
+        if old is None:
+            added.extend(nodes([new]))
+        elif new is None:
+            removed.append([old.frame, old.name])
+        else:
+            changed.append(new)
+    return Delta(base, sequence, added, removed, changed)
+
+
+class DeltaFeed(object):
+    """
+    *Concrete* class to push the Delta of every stop to connected clients.
+
+    Each delta is encoded once per wire format in use (see wire.Format), as
+
+        {"delta": sequence, "base": base, "revision": r, "removed": [...],
+         "added": [...], "changed": [...]}
+
+    and kept for the last historySize deltas.  Truncated nodes filled in
+    after a stop was published go out as a delta from the stop to itself,
+    with the next revision, changing the filled nodes and adding what was
+    found below them.
+
+    A client is sent every delta from the stop (and revision) it is at
+    onward, cut down to the nodes it subscribed to (see
+    subscriptions.Subscriptions).  A client further behind than that (or
+    with more than historySize deltas waiting to go out) is sent the whole
+    current snapshot again instead.
+    """
+
+    historySize = 32
+
+    def __init__(self, snapshot=None, cache=None):
+        """
+        snapshot returns the subscriptions.Index of the current stop.
+        cache, if given, is where nodes are encoded (see wire.Cache).
+        """
+        self.snapshot = snapshot
+        self.cache = cache
+        self.clients = set()
+        self.history = collections.deque(maxlen=DeltaFeed.historySize)
+        self.sequence = None
+        self.revision = 0
+        self.loop = None
+
+    def subscribe(self, client):
+        """
+        client needs a format attribute (a wire.Format) and a
+        catch_up(feed) method.
+        """
+        self.clients.add(client)
+
+    def unsubscribe(self, client):
+        self.clients.discard(client)
+
+    @staticmethod
+    def _frame(stop, format, added, changed):
+        return format.frame(
+            {"delta": stop.sequence, "base": stop.base,
+             "revision": stop.revision, "removed": stop.removed},
+            added=added, changed=changed)
+
+    def _encode(self, stop, delta, format):
+        if self.cache is None:
+            encode = format.node
+        else:
+            def encode(doc):
+                return self.cache.node(format, doc, stop.sequence)
+        added = [encode(d) for d in delta.added]
+        changed = [encode(d) for d in delta.changed]
+        return added, changed, DeltaFeed._frame(stop, format, added, changed)
+
+    @staticmethod
+    def _follows(stop, sequence, revision):
+        if stop.base != sequence:
+            return False
+        return stop.sequence != sequence or stop.revision == revision + 1
+
+    def since(self, sequence, format, subscriptions=None, revision=0):
+        """
+        The deltas (as wire.Frames in format) taking a client from stop
+        sequence, as of revision, to the current one, or None if they are
+        no longer kept.  Only the nodes subscriptions wants are sent.
+        Removals always are: they are small, and the client ignores nodes
+        it does not have.
+        """
+        if (sequence, revision) == (self.sequence, self.revision):
+            return []
+        frames = []
+        for stop in self.history:
+            if not frames and \
+                    not DeltaFeed._follows(stop, sequence, revision):
+                continue
+            if format.name not in stop.encoded:
+                return None
+            added, changed, frame = stop.encoded[format.name]
+            if subscriptions and stop.entries is not None:
+                addedEntries, changedEntries = stop.entries
+                # NOTE: the nodes are spliced in as they were encoded.
+                frame = DeltaFeed._frame(
+                    stop, format,
+                    [n for n, e in zip(added, addedEntries)
+                     if subscriptions.wants(e)],
+                    [n for n, e in zip(changed, changedEntries)
+                     if subscriptions.wants(e)])
+            frames.append(frame)
+        return frames or None
+
+    def _distribute(self, stop):
+        self.history.append(stop)
+        self.sequence = stop.sequence
+        self.revision = stop.revision
+        for client in list(self.clients):
+            client.catch_up(self)
+
+    def publish(self, delta, index=None):
+        """
+        Push delta to every client.  index is the subscriptions.Index of
+        the stop (and revision) delta leads to.
+
+        NOTE: the delta is encoded by the caller's thread, since formatting
+        values may need gdb.  Only handing it out happens on the websocket
+        server's event loop (if it has one).
+        """
+        entries = None
+        revision = 0
+        if index is not None:
+            entries = ([index.entry(d) for d in delta.added],
+                       [index.entry(d) for d in delta.changed])
+            revision = index.revision
+        if delta.base == delta.sequence and self.cache is not None:
+            # NOTE: filling in changes the documents of the stop in place,
+            # so what was encoded of them before is out of date.
+            self.cache.forget(delta.sequence, delta.changed)
+        stop = Stop(delta.base, delta.sequence, revision, delta.removed,
+                    entries, {})
+        for client in list(self.clients):
+            format = client.format
+            if format.name not in stop.encoded:
+                stop.encoded[format.name] = self._encode(stop, delta, format)
+        if self.loop is None:
+            self._distribute(stop)
+        else:
+            self.loop.call_soon_threadsafe(self._distribute, stop)
@@ -142,9 +142,13 @@ class MemoryDescription(Description):
         # self._parent = kwargs.get("parent")
         self._symbol = kwargs.get("symbol")
         self._execution = kwargs.get("execution")
+        self._snapshot = kwargs.get("snapshot")
         self._relativeName = kwargs.get("relativeName")
         self._frame = kwargs.get("frame", gdb.selected_frame())
         self._address = kwargs.get("address")
+        self._object = kwargs.get("object")
+        self._raw = kwargs.get("raw")
+        self._location = kwargs.get("location")
 
     @property
     def dict(self):
@@ -169,6 +173,14 @@ class MemoryDescription(Description):
     def object(self):
         return self._object
 
+    @property
+    def raw(self):
+        return self._raw
+
+    @property
+    def location(self):
+        return self._location
+
     @property
     def frame(self):
         return self._frame
@@ -177,6 +189,10 @@ class MemoryDescription(Description):
     def execution(self):
         return self._execution
 
+    @property
+    def snapshot(self):
+        return self._snapshot
+
     @property
     def stripped_type(self):
         return self._stripped_type
@@ -5,17 +5,12 @@ import datetime
 
 # import gdb
 
-import pymongo
-
 import mongoengine
 # import instance
 
-# NOTE: The read_preference should not be needed.  This is a workaround for a
-# bug in pymongo.  (http://goo.gl/Somoeu)
-connection = mongoengine.connect('memoryoracle',
-                    read_preference=\
-                            pymongo.read_preferences.ReadPreference.PRIMARY)
-db = connection.memoryoracle
+import storage
+
+backend = storage.connect()
 
 if __name__ == "__main__":
     commit = Commit()
@@ -31,15 +26,14 @@ if __name__ == "__main__":
     instance.save()
     # execution.save()
     # executable.save()
-    execution.objects = [instance]
     executable.executions = [execution]
     commit.executables = [executable]
     commit.save()
 
-    print(db.commit.find({"vcs_hash": "shanumbers"}))
+    print(backend.find("commit", {"vcs_hash": "shanumbers"}))
 
     print(commit.to_json())
 
-    print(commit.executables[0].executions[0].objects[0].name)
+    print(commit.executables[0].executions[0].arguments)
 
     print("hello world")
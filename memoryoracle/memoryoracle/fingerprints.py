@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to remember what the debugee's memory looked like at the previous
+stop, so that unchanged objects need not be pulled again.
+"""
+
+import collections
+import hashlib
+
+
+Fingerprint = collections.namedtuple(
+    "Fingerprint", ["fingerprint", "doc", "children", "timeline"])
+
+
+class FingerprintCache(object):
+    """
+    *Concrete* class holding the fingerprint of the raw bytes of every
+    object saved at the current and previous stop.
+
+    Each entry also keeps the document the object was saved as, the ids
+    of its children's documents and the timeline keys recorded for it and
+    everything below it, so an object which has not changed since the
+    previous stop can carry all of them forward.
+    """
+
+    def __init__(self):
+        self._previous = dict()
+        self._current = dict()
+        self.carried = 0
+        self.decoded = 0
+
+    @staticmethod
+    def fingerprint(raw):
+        return hashlib.sha1(raw).digest()
+
+    def advance(self):
+        """
+        Start a new stop.  Objects not seen again are forgotten.
+        """
+        self._previous = self._current
+        self._current = dict()
+        self.carried = 0
+        self.decoded = 0
+
+    def previous(self, key):
+        return self._previous.get(key)
+
+    def record(self, key, fingerprint, doc, children, timeline=()):
+        self._current[key] = Fingerprint(
+            fingerprint, doc, tuple(children), tuple(timeline))
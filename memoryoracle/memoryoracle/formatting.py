@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes and functions for turning debugee values into display strings
+without going through the gdb print command.
+"""
+
+import gdb
+
+
+class ValueFormatter(object):
+    """
+    *Concrete* class to format debugee values for display.
+
+    Values are formatted straight from a gdb.Value (or from raw bytes plus
+    a type), so nothing is added to the $N value history.  Formatted
+    strings are cached per (type, raw bytes), which means values that turn
+    up again and again in a stop (0, 1, NULL and friends) are only
+    formatted once.  The cache must be cleared on every stop, since a
+    char * with the same bytes may point at a different string next time.
+    """
+
+    _cache = dict()
+
+    @classmethod
+    def clear(cls):
+        cls._cache.clear()
+
+    @staticmethod
+    def _render(value):
+        try:
+            return value.format_string()
+        except AttributeError:
+            # NOTE: gdb.Value.format_string only exists from gdb 9 onward.
+            return str(value)
+
+    @classmethod
+    def format_bytes(cls, raw, typ):
+        """
+        Format the value of type typ held in raw.
+        """
+        raw = bytes(raw)
+        key = (str(typ), raw)
+        text = cls._cache.get(key)
+        if text is None:
+            text = cls._render(gdb.Value(raw, typ))
+            cls._cache[key] = text
+        return text
+
+    @classmethod
+    def format_value(cls, value):
+        """
+        Format a gdb.Value, going through the cache if it lives in memory.
+        """
+        address = value.address
+        if address is None:
+            return cls._render(value)
+        try:
+            raw = gdb.selected_inferior().read_memory(
+                int(address), value.type.sizeof)
+        except gdb.MemoryError:
+            return cls._render(value)
+        return cls.format_bytes(raw, value.type)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to serve any number of websocket clients watching one debugging
+session.
+"""
+
+import asyncio
+
+import deltas
+import stream
+import wire
+
+
+class Hub(object):
+    """
+    *Concrete* class to serve every client of one session.
+
+    Each client keeps its own cursor (see stream.Stream), so a slow client
+    lags behind without holding anyone else up, while the nodes and deltas
+    they are sent are encoded once and shared (see wire.Cache and
+    deltas.DeltaFeed).
+
+    Clients connecting to /stream get the nodes streamed in batches, then
+    the deltas of every stop after.  Anyone else gets one node (as JSON)
+    per round trip, each message they send back being handed to handler.
+    """
+
+    def __init__(self, snapshot, store, handler=None, closed=None):
+        """
+        snapshot returns the subscriptions.Index of the latest stop.  store
+        formats values (see blobs.BlobStore).  handler(websocket, message)
+        answers client requests.  closed(websocket) is called once a client
+        has gone away.
+        """
+        self.snapshot = snapshot
+        self.store = store
+        self.handler = handler
+        self.closed = closed
+        self.active = True
+        self.cache = wire.Cache()
+        self.feed = deltas.DeltaFeed(snapshot, self.cache)
+
+    @property
+    def clients(self):
+        return self.feed.clients
+
+    def subprotocols(self):
+        return list(wire.formats())
+
+    def publish(self, delta, index=None):
+        """
+        Push delta to every streaming client (see deltas.DeltaFeed).
+        """
+        self.feed.publish(delta, index)
+
+    def reset(self):
+        """
+        Start over for a new execution: drop the encoded nodes, deltas and
+        string table of the last one, and send every streaming client the
+        current snapshot again.
+
+        NOTE: the cache is reset by the caller's thread, before anything of
+        the new execution is encoded.  The clients are only touched on the
+        event loop.
+        """
+        self.cache.reset()
+        if self.feed.loop is None:
+            self._restart()
+        else:
+            self.feed.loop.call_soon_threadsafe(self._restart)
+
+    def _restart(self):
+        self.feed.history.clear()
+        for client in list(self.clients):
+            client.stringsSent = 0
+            client.resync(self.snapshot())
+
+    @asyncio.coroutine
+    def serve(self, websocket, path):
+        self.feed.loop = asyncio.get_event_loop()
+        try:
+            if path.rstrip("/").endswith("/stream"):
+                yield from self.stream(websocket)
+            else:
+                yield from self.pingpong(websocket)
+        finally:
+            if self.closed is not None:
+                self.closed(websocket)
+
+    @asyncio.coroutine
+    def stream(self, websocket):
+        format = wire.negotiate(websocket.subprotocol, self.store,
+                                self.cache.strings)
+        client = stream.Stream(websocket, self.snapshot(), format,
+                               self.handler, self.snapshot, self.cache)
+        self.feed.subscribe(client)
+        try:
+            yield from client.run()
+        finally:
+            self.feed.unsubscribe(client)
+
+    @asyncio.coroutine
+    def pingpong(self, websocket):
+        format = wire.JSONFormat(self.store)
+        index = self.snapshot()
+        cursor = 0
+        while self.active and cursor < len(index.nodes):
+            if not websocket.open:
+                print("websocket closed")
+                break
+            yield from websocket.send(self.cache.node(
+                format, index.nodes[cursor], index.sequence))
+            cursor += 1
+            message = yield from websocket.recv()
+            if message is None:
+                break
+            if self.handler is not None:
+                yield from self.handler(websocket, message)
@@ -18,17 +18,12 @@ import traceback
 import json
 # from uuid import uuid4 as uuid
 
-import pymongo
-
 import mongoengine
 
-# NOTE: The read_preference should not be needed.  This is a workaround for a
-# bug in pymongo.  (http://goo.gl/Somoeu)
-connection = mongoengine.connect('memoryoracle',
-                    read_preference=\
-                            pymongo.read_preferences.ReadPreference.PRIMARY)
+import storage
+import writebuffer
 
-db = connection.memoryoracle
+storage.connect()
 
 class Instance(mongoengine.Document):
 
@@ -41,7 +36,11 @@ class Execution(mongoengine.Document):
     arguments = mongoengine.StringField()
     start_time = mongoengine.ComplexDateTimeField()
     end_time = mongoengine.ComplexDateTimeField()
-    objects = mongoengine.ListField(mongoengine.ReferenceField('Memory'))
+    # NOTE: the Memory documents of an execution are found through their
+    # (indexed) execution field.  These are kept up to date stop by stop.
+    node_count = mongoengine.IntField(default=0)
+    snapshot_count = mongoengine.IntField(default=0)
+    last_sequence = mongoengine.IntField()
 
     @staticmethod
     def set_execution(execution):
@@ -52,6 +51,122 @@ class Execution(mongoengine.Document):
         return cls._current
 
 
+class CompressionDictionary(mongoengine.Document):
+    """
+    *Concrete* class holding a dictionary trained on the values of one
+    execution (see blobs.BlobStore).
+    """
+    execution = mongoengine.ReferenceField(Execution)
+    codec = mongoengine.StringField()
+    data = mongoengine.BinaryField()
+
+
+class Snapshot(mongoengine.Document):
+    """
+    *Concrete* class representing the state of the debugee at one stop.
+
+    Root documents are shared with earlier snapshots wherever their content
+    did not change (see contentstore).
+    """
+    execution = mongoengine.ReferenceField(Execution)
+    sequence = mongoengine.IntField()
+    time = mongoengine.ComplexDateTimeField()
+    roots = mongoengine.ListField(mongoengine.ReferenceField('Memory'))
+    # False while truncated nodes are still waiting to be filled in
+    complete = mongoengine.BooleanField(default=True)
+    # set instead of roots when the snapshot is stored in columns (see
+    # SnapshotChunk)
+    node_count = mongoengine.IntField()
+    chunk_count = mongoengine.IntField()
+    # number of the first node of every chunk
+    chunk_starts = mongoengine.ListField(mongoengine.IntField())
+    root_indices = mongoengine.ListField(mongoengine.IntField())
+
+    meta = {
+        'indexes': [
+            ('execution', 'sequence')
+        ]
+    }
+
+
+class TimelineEntry(mongoengine.Document):
+    """
+    *Concrete* class representing one change of the bytes at an address
+    (see timeline.Timeline).
+    """
+    execution = mongoengine.ReferenceField(Execution)
+    address = mongoengine.IntField()
+    type = mongoengine.StringField()
+    sequence = mongoengine.IntField()
+    keyframe = mongoengine.BooleanField()
+    # the whole value for keyframes, a delta otherwise.  None once gone.
+    data = mongoengine.BinaryField()
+
+    meta = {
+        'indexes': [
+            ('execution', 'address', 'type', 'sequence')
+        ]
+    }
+
+
+class Type(mongoengine.Document):
+    """
+    *Concrete* class representing a type, shared by every columnar snapshot
+    node which has it.
+    """
+    name = mongoengine.StringField()
+    unaliased_type = mongoengine.StringField()
+    dynamic_type = mongoengine.StringField()
+    # name of the Memory subclass the node would have been saved as
+    kind = mongoengine.StringField()
+
+    meta = {
+        'indexes': [
+            ('name', 'unaliased_type', 'dynamic_type', 'kind')
+        ]
+    }
+
+
+class SnapshotChunk(mongoengine.Document):
+    """
+    *Concrete* class holding a run of nodes of a columnar snapshot.
+
+    Each node field is one column.  Numeric columns are packed little endian
+    arrays: addresses, range_starts, range_ends and child_indices are int64,
+    type_ids, frame_ids and child_offsets int32, flags uint8.  type_ids and
+    frame_ids index the chunk's own types and frames lists.  The children
+    of node i are child_indices[child_offsets[i]:child_offsets[i + 1]],
+    given as snapshot wide node numbers.  Fields without a column of their
+    own are kept in extras, by chunk local node number.
+    """
+    execution = mongoengine.ReferenceField(Execution)
+    sequence = mongoengine.IntField()
+    chunk = mongoengine.IntField()
+    # snapshot wide number of the first node in this chunk
+    start = mongoengine.IntField()
+    count = mongoengine.IntField()
+    addresses = mongoengine.BinaryField()
+    types = mongoengine.ListField(mongoengine.ReferenceField(Type))
+    type_ids = mongoengine.BinaryField()
+    frames = mongoengine.ListField(mongoengine.StringField())
+    frame_ids = mongoengine.BinaryField()
+    names = mongoengine.ListField(mongoengine.StringField())
+    relative_names = mongoengine.ListField(mongoengine.StringField())
+    values = mongoengine.ListField(mongoengine.StringField())
+    range_starts = mongoengine.BinaryField()
+    range_ends = mongoengine.BinaryField()
+    flags = mongoengine.BinaryField()
+    child_offsets = mongoengine.BinaryField()
+    child_indices = mongoengine.BinaryField()
+    extras = mongoengine.DictField()
+
+    meta = {
+        'indexes': [
+            ('execution', 'sequence', 'chunk')
+        ]
+    }
+
+
 class Executable(mongoengine.EmbeddedDocument):
     """
     *Concrete* class representing a executable file generated by running
@@ -95,15 +210,43 @@ class Memory(typed.Typed):
     range_end = mongoengine.IntField()
     children = mongoengine.ListField(mongoengine.ReferenceField('Memory'))
     value = mongoengine.StringField()
+    # set on frontier nodes left unexplored when a traversal ran out of budget
+    truncated = mongoengine.BooleanField(default=False)
+    # why the node could not be read, on nodes saved without their value
+    # (see traversal.Traversal)
+    error = mongoengine.StringField()
+    # hash of this node's content and its children's hashes
+    # (see contentstore.content_hash)
+    content_hash = mongoengine.StringField()
+    # sequence number of the stop this document was first written at
+    # (see Snapshot)
+    snapshot = mongoengine.IntField()
+    # set instead of value when the raw bytes are stored (see blobs)
+    blob = mongoengine.BinaryField()
+    codec = mongoengine.StringField()
+    blob_dictionary = mongoengine.ReferenceField(CompressionDictionary)
+    raw_size = mongoengine.IntField()
+    # name of the type the blob holds a value of
+    blob_type = mongoengine.StringField()
 
     meta = {
         'allow_inheritance': True,
         'indexes': [
             'address',
-            'frame'
+            'frame',
+            ('execution', 'content_hash'),
+            ('execution', 'snapshot', 'frame', 'address')
         ]
     }
 
+    # ids of the documents saved by this process for the latest snapshot,
+    # by (execution id, snapshot, frame, address).  _fetch looks documents
+    # up by id when this hits.  Keys carry the snapshot, so older snapshots'
+    # keys can never hit again and are dropped as soon as a newer one turns
+    # up.  That bounds the map by the size of one stop.
+    _known = dict()
+    _knownSnapshot = None
+
     class DuplicateAddress(Exception):
         pass
 
@@ -114,26 +257,79 @@ class Memory(typed.Typed):
     class NewObject(Exception):
         pass
 
+    @staticmethod
+    def _key(execution, snapshot, frame, address):
+        executionId = execution.id if execution is not None else None
+        return (executionId, snapshot, frame, address)
+
+    def subgraph(self, maxDepth=None, fields=None):
+        """
+        Fetch this document and everything below it (maxDepth levels down at
+        most) in one go, rather than dereferencing children one by one.
+        See storage.Storage.subgraph.
+        """
+        return storage.backend.subgraph(
+            self._get_collection_name(), self.id, maxDepth, fields)
+
+    @classmethod
+    def remember(cls, doc):
+        """
+        Make doc findable by _fetch (and factory) by id rather than by a
+        query on its address.  doc must have an id already.
+        """
+        if doc.id is None:
+            return
+        if doc.snapshot != Memory._knownSnapshot:
+            Memory._known.clear()
+            Memory._knownSnapshot = doc.snapshot
+        key = Memory._key(doc.execution, doc.snapshot, doc.frame, doc.address)
+        Memory._known[key] = doc.id
+
+    @classmethod
+    def forget(cls, execution=None):
+        """
+        Drop the ids known for execution (or for every execution).
+        """
+        if execution is None:
+            Memory._known.clear()
+            return
+        for key in [k for k in Memory._known if k[0] == execution.id]:
+            del Memory._known[key]
+
     @classmethod
     def _fetch(cls, description):
         if description is None:
             raise Exception("Description required to fetch object!")
 
         execution = description.execution
-        frameDescription = descriptions.MemoryDescription("myframe", address=str(gdb.selected_frame()))
-
-        # TODO: replace selected_frame call with something more flexible
-        frm = frame.Frame(gdb.selected_frame())
+        frm = str(description.frame)
         address = description.address
-        memories = cls.objects(
-            execution=execution,
-            frame=str(frm),
+        knownId = Memory._known.get(
+            Memory._key(execution, description.snapshot, frm, address))
+        if knownId is not None:
+            memories = storage.backend.documents(cls, limit=1, _id=knownId)
+            if not memories:
+                # NOTE: it may still be on its way out of the write buffer.
+                writebuffer.settle()
+                memories = storage.backend.documents(
+                    cls, limit=1, _id=knownId)
+            if not memories:
+                raise Memory.NewObject("New object found")
+            return memories[0]
+
+        memories = storage.backend.documents(
+            cls,
+            limit=2,
+            execution=execution.id if execution is not None else None,
+            snapshot=description.snapshot,
+            frame=frm,
             address=address
         )
         if len(memories) > 1:
             raise Memory.DuplicateAddress("Duplicate address for memory!")
         elif len(memories) == 0:
             raise Memory.NewObject("New object found")
+        cls.remember(memories[0])
         return memories[0]
 
     @classmethod
@@ -152,6 +348,8 @@ class Memory(typed.Typed):
         except Memory.NewObject:
             otherArgs = {k: v for k, v in kwargs.items() if k != "descript"}
             otherArgs.update(desc.dict)
+            otherArgs["execution"] = desc.execution
+            otherArgs["snapshot"] = desc.snapshot
             return cls(**otherArgs)
 
 
@@ -216,6 +414,22 @@ class Array(Memory):
     target_type = mongoengine.StringField() ## TODO: upgrade this to ref field
 
 
+class PrimitiveArray(Array):
+    """
+    *Concrete* class to represent an array of primitive elements.
+
+    The elements are stored as one packed blob (readable with
+    numpy.frombuffer(data, dtype).reshape(shape)) rather than as one
+    document per element.  minimum, maximum and nan_count are worked out
+    at pull time for display.
+    """
+    dtype = mongoengine.StringField()
+    shape = mongoengine.ListField(mongoengine.IntField())
+    data = mongoengine.BinaryField()
+    minimum = mongoengine.StringField()
+    maximum = mongoengine.StringField()
+    nan_count = mongoengine.IntField()
+
 
 
 
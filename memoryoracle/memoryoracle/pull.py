@@ -5,17 +5,36 @@ import gdb
 import re
 import descriptions
 import registry
+import formatting
 import models
 import typed
 import frame
+import traversal
+import deltas
+import hub
+import subscriptions
+import fingerprints
+import contentstore
+import blobs
+import timeline
+import writebuffer
+import columnar
+import storage
+import datetime
+import json
+import bson
+from bson import json_util
 import traceback
 import mongoengine
 from copy import deepcopy
 import asyncio
 import websockets
-import pymongo
 import logging
 import sys
+try:
+    import numpy
+except ImportError:
+    numpy = None
 logger = logging.getLogger('websockets.server')
 logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler())
@@ -29,9 +48,61 @@ class Pull(typed.Typed):
     _updatedNames = set()
     _watchers = dict()
     _childIsPointer = False
-
-    execution = models.Execution()
-    execution.save()
+    _docClass = models.Memory
+
+    # When set, objects whose raw bytes are unchanged since the previous stop
+    # are not decoded again.  Objects which can not lead anywhere outside of
+    # their own bytes carry their old document forward whole.  The rest are
+    # still walked, but keep their old document if none of their children
+    # changed either.
+    incremental = False
+    _history = fingerprints.FingerprintCache()
+
+    # NOTE: given an id straight away, so documents can refer to it.  It is
+    # written out at the end of every stop.
+    execution = models.Execution(
+        id=bson.ObjectId(), start_time=datetime.datetime.now())
+
+    # number of the stop being serialized (see models.Snapshot)
+    sequence = 0
+    # times truncated nodes of the stop were filled in since (see
+    # publish_filled)
+    revision = 0
+
+    # When set, a node whose content (including everything below it) was
+    # already stored in this execution refers to the stored document rather
+    # than writing a new one.
+    deduplicate = True
+    _contents = contentstore.ContentStore(execution)
+
+    # When set, values are stored as compressed raw bytes and only
+    # formatted once a client looks at them (see blobs).
+    blobValues = False
+    _blobs = blobs.BlobStore(execution)
+
+    # When set, the raw bytes of every object are recorded in a per address
+    # timeline, so they can be looked up at any earlier stop.
+    recordTimeline = False
+    timelines = timeline.TimelineIndex(
+        sink=lambda key, entry: writebuffer.buffer.add(models.TimelineEntry(
+            execution=Pull.execution,
+            address=key[0],
+            type=key[1],
+            sequence=entry.sequence,
+            keyframe=entry.keyframe,
+            data=entry.data)))
+
+    # the traversal and snapshot of the latest stop, kept around to expand
+    # (or finish filling in) on demand
+    walk = None
+    snapshot = None
+
+    # When set, each stop is stored as a few models.SnapshotChunk documents
+    # (see columnar) rather than one document per node.  Columnar snapshots
+    # are written whole: lazy expansion, deduplication and incremental reuse
+    # do not apply to them.
+    columnarStorage = False
+    columns = None
 
     @property
     def description(self):
@@ -53,6 +124,18 @@ class Pull(typed.Typed):
     def children(self):
         return self._children
 
+    @property
+    def child_pulls(self):
+        return self._childPulls
+
+    @property
+    def truncated(self):
+        return self._truncated
+
+    @property
+    def error(self):
+        return self._error
+
     @property
     def range(self):
         return self._range
@@ -87,6 +170,15 @@ class Pull(typed.Typed):
         self._index = None
         self._name = self.description.name
         self._children = []
+        self._childPulls = []
+        self._truncated = False
+        self._error = None
+        self._raw = None
+        self._location = None
+        self._fingerprint = None
+        self._carried = None
+        self._timelineKeys = ()
+        self._columnIndex = None
         self._range = (0, 1)
         self._target_type = None
         self._value = None
@@ -103,17 +195,8 @@ class Pull(typed.Typed):
         self._relativeName = self.description.relative_name
 
     @classmethod
-    def get_true_type_name(cls, t, nameDecorators = ""):
-        if t.code == gdb.TYPE_CODE_PTR:
-            return cls.get_true_type_name(t.target(), nameDecorators + "*")
-        elif t.code == gdb.TYPE_CODE_ARRAY:
-            length = str(t.range()[1] - t.range()[0] + 1)
-            return cls.get_true_type_name(t.target(), nameDecorators + "[" + length + "]")
-        else:
-            if isinstance(t.name, str):
-                return t.name + nameDecorators
-            else:
-                return "<## unknown type ##>"
+    def get_true_type_name(cls, t):
+        return registry.TypeRegistration.layout(t).name
 
     def extract_extra_type_info(self):
         strip = self.object.type.strip_typedefs()
@@ -121,7 +204,8 @@ class Pull(typed.Typed):
 
     def pull(self):
         if self._basic_pull():
-            self._pull()
+            if not self._carry_forward():
+                self._pull()
             Pull._parentWasPointer = False
             return True
             ## TODO: enable memory watchers
@@ -130,32 +214,230 @@ class Pull(typed.Typed):
             return False
 
     def save(self, update=True):
-        p = self.pull()
-        if not p:
-            print("PULL RETURNED: ", p, " FOR ", self.name)
-        if p:
-
-            self.paramDict = {
-                "address": str(self.index),
-                "name": str(self.name),
-                "execution": self.execution,
-                "type": self._type_name,
-                "dynamic_type": str(self.dynamic_type),
-                "unaliased_type": str(self.unaliased_type),
-                "range_start": int(self.range[0]),
-                "range_end": int(self.range[1]),
-                "value": str(self.object),
-                "relative_name": str(self._relativeName),
-                "frame": str(self.frame)
-            }
-            print("Saving ", self.name)
-            self._save()
-            self._doc = models.Memory(**self.paramDict)
-            self._doc.save()
-            return True
+        """
+        Pull and save this object and everything reachable from it.
+        """
+        traversal.Traversal([self]).run()
+        return self.doc is not None
+
+    def _history_key(self):
+        return (str(self.frame), self.name, self.index, self._type_name)
+
+    def _take_fingerprint(self):
+        """
+        Fingerprint the raw bytes of this object, reading them if a parent
+        has not already done so.
+        """
+        if self._raw_bytes() is None:
+            return None
+        return fingerprints.FingerprintCache.fingerprint(self._raw)
+
+    def _raw_bytes(self):
+        """
+        The raw bytes of this object, read now unless a parent (or an
+        earlier call) already did.  None if they can not be read.
+        """
+        if self.object is None or self.index == "?":
+            return None
+        if self._raw is None:
+            address = self.object.address
+            if address is None:
+                return None
+            layout = registry.TypeRegistration.layout(self.object.type)
+            try:
+                self._raw = bytes(gdb.selected_inferior().read_memory(
+                    int(address), layout.sizeof))
+            except gdb.MemoryError:
+                return None
+            self._location = int(address)
+        return self._raw
+
+    def _pack_value(self):
+        """
+        In blobValues mode, replace the printed value with the packed raw
+        bytes, if they can be read.
+        """
+        if "data" in self.paramDict:
+            # NOTE: vectorized arrays already store their bytes.
+            fields = None
         else:
-            print("Not saving ", self.name)
+            raw = self._raw_bytes()
+            fields = Pull._blobs.pack(raw, self.object.type) \
+                    if raw is not None else None
+        if fields is None:
+            self.paramDict["value"] = str(self.object)
+        else:
+            self.paramDict.update(fields)
+
+    def _carry_forward(self):
+        """
+        In incremental mode, check if this object can reuse the document it
+        was saved as at the previous stop without being pulled at all.
+        """
+        if not Pull.incremental or Pull.columns is not None:
+            return False
+        self._fingerprint = self._take_fingerprint()
+        if self._fingerprint is None:
+            return False
+        previous = Pull._history.previous(self._history_key())
+        if previous is None or previous.fingerprint != self._fingerprint:
             return False
+        if not registry.TypeRegistration.layout(
+                self.object.type).self_contained:
+            return False
+        self._carried = previous
+        return True
+
+    def _remember(self):
+        if Pull.incremental and self._fingerprint is not None:
+            Pull._history.record(
+                self._history_key(),
+                self._fingerprint,
+                self.doc,
+                [c.id for c in self.children])
+
+    def truncate(self, truncated=True):
+        """
+        Mark this object as part of the frontier left by a traversal which
+        ran out of budget.  It gets saved without being pulled.
+
+        truncate(False) reopens the object so it can be pulled on demand.
+        Storing it again then fills in its truncated document in place.
+        """
+        self._truncated = truncated
+
+    def fail(self, error):
+        """
+        Mark this object as unreadable.  It gets saved, with error set, but
+        without its value or anything below it.
+        """
+        self._error = str(error)
+        self._childPulls = []
+        self._fingerprint = None
+
+    def store(self):
+        """
+        Save this object.  Must be called after the children have been
+        stored.
+        """
+        if self._carried is not None:
+            self._doc = self._carried.doc
+            self._children = list(self._carried.doc.children)
+            Pull._history.carried += 1
+            if Pull.recordTimeline:
+                # NOTE: neither this object nor anything below it is read
+                # again, so their timelines are told they did not change.
+                self._timelineKeys = self._carried.timeline
+                Pull.timelines.carry(self._timelineKeys)
+            self._remember()
+            return
+        if Pull.columns is not None:
+            self._store_columnar()
+            return
+        self._children = [c.doc for c in self.child_pulls if c.doc is not None]
+        self.paramDict = {
+            "address": str(self.index),
+            "name": str(self.name),
+            "execution": self.execution,
+            "snapshot": Pull.sequence,
+            "type": self._type_name,
+            "dynamic_type": str(self.dynamic_type),
+            "unaliased_type": str(self.unaliased_type),
+            "range_start": int(self.range[0]),
+            "range_end": int(self.range[1]),
+            "value": None if Pull.blobValues or self.error is not None
+                     else str(self.object),
+            "relative_name": str(self._relativeName),
+            "frame": str(self.frame)
+        }
+        if self.truncated:
+            # NOTE: printing an unexplored object may drag in all of it.
+            self.paramDict["value"] = None
+            self.paramDict["truncated"] = True
+        elif self.error is not None:
+            self.paramDict["error"] = self.error
+        else:
+            self._save()
+            if Pull.blobValues:
+                self._pack_value()
+            if Pull.recordTimeline and self._raw_bytes() is not None:
+                key = (self._location, self._type_name)
+                Pull.timelines.record(key, self._raw)
+                self._timelineKeys = (key,)
+        if Pull.recordTimeline and Pull.incremental:
+            self._timelineKeys += tuple(
+                k for c in self.child_pulls for k in c._timelineKeys)
+        previous = None
+        if Pull.incremental and self._fingerprint is not None:
+            Pull._history.decoded += 1
+            previous = Pull._history.previous(self._history_key())
+        if previous is not None and \
+                previous.fingerprint == self._fingerprint and \
+                previous.children == tuple(c.id for c in self.children):
+            self._doc = previous.doc
+            self._remember()
+            return
+
+        self.paramDict["content_hash"] = contentstore.content_hash(
+            self.paramDict, self.children)
+        # NOTE: truncated documents are filled in later, so never share them.
+        # Parents already refer to them by id, so they keep it when they are.
+        stub = self._doc if self._doc is not None and self._doc.truncated \
+                else None
+        stored = None
+        if Pull.deduplicate and not self.truncated and stub is None:
+            stored = Pull._contents.find(self.paramDict["content_hash"])
+        if stored is not None:
+            self._doc = stored
+        else:
+            print("Saving ", self.name)
+            if stub is not None:
+                # NOTE: parents (and the snapshot) hold on to the stub, so it
+                # is filled in rather than replaced.
+                for key, value in self.paramDict.items():
+                    setattr(stub, key, value)
+                stub.truncated = self.paramDict.get("truncated", False)
+                self._doc = stub
+            else:
+                self._doc = self._docClass(**self.paramDict)
+            writebuffer.buffer.add(self._doc)
+            models.Memory.remember(self._doc)
+            if stub is None:
+                Pull.execution.node_count += 1
+            if not self.truncated:
+                Pull._contents.add(self._doc)
+        self._remember()
+
+    def _store_columnar(self):
+        """
+        Add this object to the columns of the current snapshot rather than
+        saving a document for it.
+        """
+        self._children = []
+        self.paramDict = {
+            "address": str(self.index),
+            "name": str(self.name),
+            "type": self._type_name,
+            "dynamic_type": str(self.dynamic_type),
+            "unaliased_type": str(self.unaliased_type),
+            "range_start": int(self.range[0]),
+            "range_end": int(self.range[1]),
+            "value": str(self.object) if self.error is None else None,
+            "relative_name": str(self._relativeName),
+            "frame": str(self.frame)
+        }
+        if self.truncated:
+            self.paramDict["value"] = None
+            self.paramDict["truncated"] = True
+        elif self.error is not None:
+            self.paramDict["error"] = self.error
+        else:
+            self._save()
+        self._columnIndex = Pull.columns.add(
+            self.paramDict,
+            [c._columnIndex for c in self.child_pulls
+                if c._columnIndex is not None],
+            self._docClass.__name__)
 
     def _basic_pull(self):
         newlyDiscoveredName = not (self.name in self._updatedNames)
@@ -184,11 +466,25 @@ class Pull(typed.Typed):
     def _clear_updated(self):
         self._updateTracker.discard(self.index)
 
+    @staticmethod
+    def clear_trackers():
+        """
+        Forget every address pulled so far, so the next stop pulls them all
+        again.  Each handler class keeps its own _updateTracker.
+        """
+        classes = [Pull]
+        while classes:
+            cls = classes.pop()
+            tracker = cls.__dict__.get("_updateTracker")
+            if tracker is not None:
+                tracker.clear()
+            classes.extend(cls.__subclasses__())
+
     @staticmethod
     def handler_factory(typ):
         # standardLib = Pull._stdLibChecker.match(
         #     Pull.get_true_type_name(typ))
-        return registry.handler_lookup(typ.strip_typedefs().code)
+        return registry.TypeRegistration.layout(typ).handler
 
 
 class MemoryPull(Pull):
@@ -199,34 +495,39 @@ class MemoryPull(Pull):
         super(MemoryPull, self).__init__(description)
         self._relativeName = description.relative_name
         self._frame = frame.Frame(description.frame)
-        self._object = None
+        self._object = description.object
+        self._raw = description.raw
+        self._location = description.location
 
-        with frame.Selector(self.frame.frame) as fs:
-            sym = self.description.symbol
-            if sym is not None:
-                typ = sym.type
-                if typ.code in {
-                        gdb.TYPE_CODE_PTR,
-                        gdb.TYPE_CODE_ARRAY,
-                        gdb.TYPE_CODE_STRUCT,
-                        gdb.TYPE_CODE_INT,
-                        gdb.TYPE_CODE_FUNC,
-                        }:
-                    try:
-                        self._object = gdb.parse_and_eval(self.name)
-                    except TypeError:
+        # Objects decoded from a parent's raw bytes arrive ready made, so we
+        # only need to go looking for the rest.
+        if self.object is None:
+            with frame.Selector(self.frame.frame) as fs:
+                sym = self.description.symbol
+                if sym is not None:
+                    typ = sym.type
+                    if typ.code in {
+                            gdb.TYPE_CODE_PTR,
+                            gdb.TYPE_CODE_ARRAY,
+                            gdb.TYPE_CODE_STRUCT,
+                            gdb.TYPE_CODE_INT,
+                            gdb.TYPE_CODE_FUNC,
+                            }:
                         try:
-                            self._object = sym.value(fs.frame.frame)
-                            self._value = str(self.object)
+                            self._object = gdb.parse_and_eval(self.name)
                         except TypeError:
-                            print("DEBUG: TypeError detected!")
-            else:
-                try:
-                    self._object = gdb.parse_and_eval(self.name)
-                except gdb.error as e:
-                    print("DEBUG:")
-                    traceback.print_exc()
-                    # pass
+                            try:
+                                self._object = sym.value(fs.frame.frame)
+                                self._value = str(self.object)
+                            except TypeError:
+                                print("DEBUG: TypeError detected!")
+                else:
+                    try:
+                        self._object = gdb.parse_and_eval(self.name)
+                    except gdb.error as e:
+                        print("DEBUG:")
+                        traceback.print_exc()
+                        # pass
 
         if self.description.symbol and self.description.symbol.type:
             self._type_name = str(self.description.symbol.type)
@@ -240,6 +541,11 @@ class MemoryPull(Pull):
         if self.index is None:
             if self.object is None:
                 self._index = "?"
+            elif self._location is not None:
+                # Values built from raw bytes have no address of their own.
+                # Cast the location so the index prints like a real address.
+                self._index = str(gdb.Value(self._location).cast(
+                    self.object.type.pointer()))
             else:
                 self._index = str(self.object.address)
 
@@ -304,6 +610,48 @@ class StructurePull(MemoryPull):
     _updateTracker = set()
     _watchers = dict()
 
+    # When set, read each structure out of the inferior in a single
+    # read_memory call and slice the fields out of the result, rather than
+    # evaluating one expression per field.
+    rawDecode = True
+
+    def _read_raw(self):
+        """
+        Get the raw bytes of this structure and the address they came from.
+
+        Returns (None, None) if the structure can not be read in one go.
+        """
+        if self._raw is not None:
+            return self._raw, self._location
+        address = self.object.address
+        if address is None:
+            return None, None
+        location = int(address)
+        try:
+            raw = gdb.selected_inferior().read_memory(
+                location, self.object.type.sizeof)
+        except gdb.MemoryError:
+            return None, None
+        return bytes(raw), location
+
+    @staticmethod
+    def _slice_field(raw, location, f):
+        """
+        Cut the bytes of field f (a registry.FieldLayout) out of the raw
+        bytes of its structure.
+
+        Returns None for fields which do not sit on a byte boundary of
+        their own (static members and bitfields).
+        """
+        if f.offset is None:
+            return None
+        fieldRaw = raw[f.offset:f.offset + f.sizeof]
+        return {
+            "object": gdb.Value(fieldRaw, f.type),
+            "raw": fieldRaw,
+            "location": location + f.offset,
+        }
+
     def _pull(self):
         name = deepcopy(str(self.name))
         if name == "myList":
@@ -316,27 +664,27 @@ class StructurePull(MemoryPull):
         name += marker
         if self.object is None:
             return
-        for f in self.object.type.fields():
+        raw, location = None, None
+        if StructurePull.rawDecode:
+            raw, location = self._read_raw()
+        layout = registry.TypeRegistration.layout(self.object.type)
+        for f in layout.fields:
+            decoded = None
+            if raw is not None:
+                decoded = StructurePull._slice_field(raw, location, f)
             childDescription= descriptions.MemoryDescription(
                 name + f.name,
-                relativeName=marker + f.name)
-            childHandler = Pull.handler_factory(f.type)
+                relativeName=marker + f.name,
+                **(decoded or {}))
+            childHandler = f.layout.handler
             childObj = childHandler(childDescription)
-            try:
-                childObj.save()
-            except Exception as e:
-                print(e)
-            self._children.append(childObj.doc)
+            self._childPulls.append(childObj)
 
 
     def _save(self, update=True):
         super(StructurePull, self)._save()
         if len(self.children) > 0:
             # TODO: This needs cyclic memory torture testing.
-            for child in self.children:
-                # TODO: find bug which makes this check necessary
-                if child is not None:
-                    child.save(update=update)
             self.paramDict["children"] = self.children
 
 
@@ -348,6 +696,116 @@ class ArrayPull(MemoryPull):
 
     _typeHandlerCode = gdb.TYPE_CODE_ARRAY
 
+    # When set (and numpy is available) arrays of int, float, char and bool
+    # elements are read in one go and stored as a single PrimitiveArray
+    # document rather than one document per element.
+    vectorize = True
+
+    # Arrays bigger than this won't fit in a single mongo document, so they
+    # take the per element path.
+    maxVectorBytes = 15 * 1024 * 1024
+
+    _byteOrder = None
+
+    _dtypeKinds = {
+        gdb.TYPE_CODE_INT: "i",
+        gdb.TYPE_CODE_CHAR: "i",
+        gdb.TYPE_CODE_FLT: "f",
+        gdb.TYPE_CODE_BOOL: "b",
+    }
+
+    def __init__(self, description):
+        super(ArrayPull, self).__init__(description)
+        self._vector = None
+
+    @classmethod
+    def byte_order(cls):
+        if cls._byteOrder is None:
+            endian = gdb.execute("show endian", False, True)
+            cls._byteOrder = ">" if "big endian" in endian else "<"
+        return cls._byteOrder
+
+    @classmethod
+    def element_dtype(cls, element):
+        """
+        Get the numpy dtype matching the (stripped) element type, or None if
+        there isn't one.
+        """
+        kind = cls._dtypeKinds.get(element.code)
+        size = element.sizeof
+        if kind is None:
+            return None
+        if kind == "b":
+            return numpy.dtype(numpy.bool_) if size == 1 else None
+        if kind == "f" and size not in {2, 4, 8}:
+            # NOTE: long double has no portable numpy equivalent.
+            return None
+        if kind == "i" and size not in {1, 2, 4, 8}:
+            return None
+        if kind == "i":
+            signed = getattr(element, "is_signed", None)
+            if signed is None:
+                signed = not str(element).startswith("unsigned")
+            if not signed:
+                kind = "u"
+        return numpy.dtype(cls.byte_order() + kind + str(size))
+
+    def _pull_vectorized(self):
+        """
+        Read a whole array of primitives as one numpy array.
+
+        Returns False if the array has to be pulled element by element.
+        """
+        if numpy is None or not ArrayPull.vectorize:
+            return False
+        shape = []
+        element = registry.TypeRegistration.layout(self.object.type).stripped
+        while element.code == gdb.TYPE_CODE_ARRAY:
+            low, high = element.range()
+            shape.append(high - low + 1)
+            element = element.target().strip_typedefs()
+        dtype = ArrayPull.element_dtype(element)
+        count = 1
+        for dim in shape:
+            count *= dim
+        if dtype is None or count <= 0:
+            return False
+        nbytes = count * dtype.itemsize
+        if nbytes > ArrayPull.maxVectorBytes:
+            return False
+
+        raw = self._raw
+        if raw is None:
+            address = self.object.address
+            if address is None:
+                return False
+            try:
+                raw = bytes(gdb.selected_inferior().read_memory(
+                    int(address), nbytes))
+            except gdb.MemoryError:
+                return False
+
+        data = numpy.frombuffer(raw, dtype=dtype, count=count)
+        vector = {
+            "dtype": dtype.str,
+            "shape": shape,
+            "data": data.tobytes(),
+            "nan_count": 0,
+            "minimum": None,
+            "maximum": None,
+        }
+        finite = data
+        if dtype.kind == "f":
+            nans = numpy.isnan(data)
+            vector["nan_count"] = int(nans.sum())
+            finite = data[~nans]
+        if finite.size > 0:
+            vector["minimum"] = str(finite.min().item())
+            vector["maximum"] = str(finite.max().item())
+        self._vector = vector
+        self._docClass = models.PrimitiveArray
+        return True
+
     def _pull(self):
         s = self.object
 
@@ -356,7 +814,10 @@ class ArrayPull(MemoryPull):
 
         # compute the type of data the array contains e.g. for float[2] the
         # answer is float for float[3][2][7] the answer is float
-        self._target_type = target_type_name(s.type)
+        self._target_type = registry.TypeRegistration.layout(s.type).target
+
+        if self._pull_vectorized():
+            return
 
         # compute the immediate type of data the array contains.  e.g. for
         # float[2] the answer is float.  for float[3][2][7] the answer is
@@ -388,11 +849,14 @@ class ArrayPull(MemoryPull):
                 childName,
                 relativeName=relativeName)
             childObj = childHandler(childDesc)
-            childObj.save()
-            self._children.append(childObj.doc)
+            self._childPulls.append(childObj)
 
     def _save(self, update=True):
 
+        if self._vector is not None:
+            self.paramDict.update(self._vector)
+            self.paramDict["target_type"] = self.target_type
+
         if len(self.children) > 0:
             # TODO: This needs cyclic memory torture testing.
             # for child in self.children:
@@ -416,14 +880,12 @@ class PrimitivePull(MemoryPull):
         """
         Get the printed value of a primitive object
         """
-        with frame.Selector(self.frame.frame) as s:
-            ## TODO: Find a way to print values without messing with the $# vars
-            # in the gdb interface.
-            gdbPrint = gdb.execute("print " + self.name, False, True)
-            ## TODO: If we can't fix the $# var, we may as well use it.
-            ## this is free information we may as well store for the user's use.
-            ansSections = gdbPrint[:-1].split(" = ")[1:]
-            return " ".join(ansSections)
+        if self.object is None:
+            return "?"
+        if self._raw is not None:
+            return formatting.ValueFormatter.format_bytes(
+                self._raw, self.object.type)
+        return formatting.ValueFormatter.format_value(self.object)
 
 
 class PointerPull(PrimitivePull):
@@ -437,7 +899,6 @@ class PointerPull(PrimitivePull):
     def __init__(self, description):
         super(PointerPull, self).__init__(description)
         self.target = None
-        self._validTarget = False
 
     def _pull(self):
         relativeName = "*"
@@ -452,23 +913,16 @@ class PointerPull(PrimitivePull):
             print("DEBUG: Unhandled obj type for ", str(self.object.type.target()))
             return
 
-        try:
-            Pull._parentWasPointer = True
-            self.target.save()
-            self._validTarget = True
-        except gdb.MemoryError as e:
-            # TODO: Decorate target as invalid in this case.
-            print("MEMORY ACCESS ERROR")
-            print(e)
-            pass
+        Pull._parentWasPointer = True
+        self._childPulls.append(self.target)
 
     def _save(self, update=True):
         super(PointerPull, self)._save()
-        if self._validTarget:
+        # NOTE: the target has no document if reading it failed.
+        if len(self.children) > 0:
             if self.target.index == self.index:
                 print("SELF LOOP FOUND")
-            self.target.save()
-            self.paramDict["children"] = [self.target.doc]
+            self.paramDict["children"] = self.children
 
 
 class IntPull(PrimitivePull):
@@ -480,8 +934,6 @@ class IntPull(PrimitivePull):
     repository = dict()
     _watchers = dict()
     _arrayFinder = re.compile(r"(.*) ((?:\[\d*\])+)")
-    _pointerFinder = re.compile(r"(\(.* \*\)) ")
-    _spaceFixer = re.compile(r" ")
     _typeHandlerCode = gdb.TYPE_CODE_INT
 
     def _find_hidden_type(self):
@@ -495,11 +947,12 @@ class IntPull(PrimitivePull):
                 t = t.array(dim - 1)
             return t
 
-        valString = self.val_string()
-        ptyp = IntPull._pointerFinder.match(valString)
-        if ptyp:
-            typ = IntPull._spaceFixer.sub("", ptyp.group(0)[1:-3])
-            return gdb.lookup_type(typ).pointer()
+        # NOTE: print used to give these away with a "(T *) " prefix.  The
+        # formatted value has no such prefix, so ask the value's type
+        # instead.
+        for typ in (v.dynamic_type, v.type):
+            if typ.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+                return typ
 
         return False
 
@@ -584,20 +1037,101 @@ def serialize_frame_globals(frm=None):
     block = frame.block().global_block
     serialize_block_locals(block)
 
-def serialize_upward(baseBlock = None):
+def serialize_upward(baseBlock = None, walk = None, lazy = False):
+    """
+    Pull every frame's locals, newest frame first, in a single traversal
+    and record the result as a models.Snapshot.
+    Pass a traversal.Traversal as walk to set the budgets.
+
+    In lazy mode only the roots (frame locals and globals) are pulled.
+    Everything below them is left truncated until a client asks for it to
+    be expanded (see Pull.walk.expand).
+    """
+    Pull.sequence += 1
+    Pull.revision = 0
     Pull._updatedNames.clear()
+    Pull.clear_trackers()
+    Pull._history.advance()
+    formatting.ValueFormatter.clear()
+    if walk is None:
+        walk = traversal.Traversal(maxDepth=0 if lazy else None)
+    Pull.walk = walk
+    if Pull.columnarStorage:
+        Pull.columns = columnar.ColumnarWriter(Pull.execution, Pull.sequence)
+    if Pull.recordTimeline:
+        Pull.timelines.begin(Pull.sequence)
 
     if baseBlock is None:
         f = gdb.newest_frame()
 
+    if lazy:
+        serialize_block_locals(f.block().global_block, walk)
+        serialize_block_locals(f.block().static_block, walk)
+
     while f is not None:
-        serialize_block_locals(f.block())
+        serialize_block_locals(f.block(), walk)
         f = f.older()
+    walk.run()
+    previous = Pull.snapshot
+    # NOTE: a walk left unfinished is filled in later on (see scheduler), so
+    # nothing can be called gone until then.
+    if Pull.recordTimeline and walk.done:
+        Pull.timelines.end()
+    Pull.snapshot = models.Snapshot(
+        execution=Pull.execution,
+        sequence=Pull.sequence,
+        time=datetime.datetime.now(),
+        roots=[r.doc for r in walk.roots if r.doc is not None],
+        complete=walk.done)
+    if Pull.columns is not None:
+        Pull.columns.finish()
+        Pull.snapshot.node_count = Pull.columns.count
+        Pull.snapshot.chunk_count = Pull.columns.chunks
+        Pull.snapshot.chunk_starts = Pull.columns.starts
+        Pull.snapshot.root_indices = [
+            r._columnIndex for r in walk.roots if r._columnIndex is not None]
+        Pull.execution.node_count += Pull.columns.count
+        Pull.columns = None
+    # NOTE: goes through the buffer so it can't reach the database ahead of
+    # the nodes it refers to.
+    writebuffer.buffer.add(Pull.snapshot)
+    Pull.execution.snapshot_count += 1
+    Pull.execution.last_sequence = Pull.sequence
+    Pull.execution.end_time = Pull.snapshot.time
+    # NOTE: a small document replaced in place, however many nodes the
+    # execution has.
+    writebuffer.buffer.add(Pull.execution)
+    writebuffer.buffer.flush()
+    if server.clients:
+        server.publish(deltas.diff(
+            previous.roots if previous is not None else [],
+            Pull.snapshot.roots,
+            previous.sequence if previous is not None else None,
+            Pull.sequence),
+            current_snapshot())
+    return walk
+
+def compaction_horizon():
+    """
+    The horizon of a retention.Compactor sweeping the live execution.
 
-def serialize_block_locals(blk = None):
+    Gets everything saved so far to storage, and stops reusing documents of
+    earlier stops other than the ones the latest stop refers to (through
+    deduplication or the known addresses).  Nothing saved before the latest
+    stop and not reachable from a kept snapshot is referred to again, so
+    the compactor may delete it.  Returns the sequence of the latest stop.
+    """
+    writebuffer.settle()
+    Pull._contents.clear()
+    models.Memory.forget(Pull.execution)
+    return Pull.sequence
+
+def serialize_block_locals(blk = None, walk = None):
     # Pull._updatedNames.clear()
     # block = blk if blk is not None else gdb.selected_frame().block()
     block = blk
+    ownWalk = walk is None
+    walk = traversal.Traversal() if ownWalk else walk
     for sym in block:
         if sym.is_constant:
             continue
@@ -609,10 +1143,17 @@ def serialize_block_locals(blk = None):
         # obj.pull()
         if isinstance(obj.object, gdb.Symbol):
             continue
-        obj.save()
+        walk.add_root(obj)
+    if ownWalk:
+        walk.run()
+    return walk
 
-def serialize_frame_locals(frm = None):
+def serialize_frame_locals(frm = None, walk = None):
     Pull._updatedNames.clear()
+    Pull.clear_trackers()
+    Pull._history.advance()
+    formatting.ValueFormatter.clear()
+    walk = walk if walk is not None else traversal.Traversal()
     with frame.Selector(frm) as fs:
         f = fs.frame
         if f.is_valid():
@@ -620,7 +1161,8 @@ def serialize_frame_locals(frm = None):
                 desc = descriptions.MemoryDescription(sym.name)
                 handler = Pull.handler_factory(sym.type)
                 obj = handler(desc)
-                obj.save()
+                walk.add_root(obj)
+    return walk.run()
 
 # def type_name(t, nameDecorators = ""):
 #     if t.code == gdb.TYPE_CODE_PTR:
@@ -631,11 +1173,6 @@ def serialize_frame_locals(frm = None):
 #     else:
 #         return t.name + nameDecorators
 
-def target_type_name(t):
-    if t.code == gdb.TYPE_CODE_PTR or t.code == gdb.TYPE_CODE_ARRAY:
-        return target_type_name(t.target())
-    return t.name
-
 # class StateSerializer(json.JSONEncoder):
 
 #     def default(self, obj):
@@ -679,13 +1216,33 @@ def target_type_name(t):
 # dArray = descriptions.MemoryDescription("b", execution=e)
 # xArray = ArrayPull(dArray)
 
-# NOTE: The read_preference should not be needed.  This is a workaround for a
-# bug in pymongo.  (http://goo.gl/Somoeu)
-connection = mongoengine.connect('memoryoracle',
-                    read_preference=\
-                            pymongo.read_preferences.ReadPreference.PRIMARY)
+storage.connect()
+
+def start_capture():
+    """
+    Start writing what is captured from a background thread (see
+    writebuffer.Pipeline).  Anything still buffered is flushed when the
+    inferior resumes.  Everything is written out when it exits.
 
-db = connection.memoryoracle
+    Clients start over too, as nothing encoded for the last run is any use
+    to this one (see hub.Hub.reset).
+    """
+    if writebuffer.buffer.pipeline is not None:
+        return
+    server.reset()
+    writebuffer.start_pipeline()
+    gdb.events.cont.connect(writebuffer.buffer.flush)
+    gdb.events.exited.connect(stop_capture)
+
+def stop_capture(event=None):
+    """
+    Write out everything captured and stop the writer thread.
+    """
+    if writebuffer.buffer.pipeline is None:
+        return
+    gdb.events.cont.disconnect(writebuffer.buffer.flush)
+    gdb.events.exited.disconnect(stop_capture)
+    writebuffer.stop_pipeline()
 
 class MemoryOracle(object):
 
@@ -695,8 +1252,6 @@ class MemoryOracle(object):
 
     port = 8765
 
-    active = True
-
 
     def __init__(self):
         self._server = None
@@ -704,33 +1259,121 @@ class MemoryOracle(object):
     def start(self):
 
         if not self._server:
-            self._server = websockets.serve(pingpong, MemoryOracle.host, MemoryOracle.port)
+            self._server = websockets.serve(
+                server.serve, MemoryOracle.host, MemoryOracle.port,
+                subprotocols=server.subprotocols())
             asyncio.get_event_loop().run_until_complete(self._server)
 
 
-messages = typed.Typed.objects(execution=Pull.execution)
-i = -1
-
 @asyncio.coroutine
 def send(message):
     yield from asyncio.sleep(1.0)
     return message
 
+index = None
+
+def current_snapshot():
+    """
+    The subscriptions.Index of the latest stop, built the first time it is
+    asked for and shared by every client.
+    """
+    global index
+    if index is None or index.sequence != Pull.sequence or \
+            index.revision != Pull.revision:
+        roots = Pull.snapshot.roots if Pull.snapshot is not None else []
+        index = subscriptions.Index(Pull.sequence, roots, Pull.revision)
+    return index
+
+def publish_filled(filled, docs):
+    """
+    Tell clients about truncated nodes of the latest stop filled in after
+    it was published (see scheduler and Traversal.expand).  filled are the
+    documents filled in, docs every document saved along the way.
+    """
+    if not filled:
+        return
+    Pull.revision += 1
+    if server.clients:
+        ids = set(d.id for d in filled)
+        server.publish(deltas.Delta(
+            Pull.sequence, Pull.sequence,
+            [d for d in docs if d.id not in ids], [], list(filled)),
+            current_snapshot())
+
 @asyncio.coroutine
-def pingpong(websocket, path):
-    global i
-    global messages
-    while MemoryOracle.active and i < len(messages) - 1:
-        if not websocket.open:
-            print("websocket closed")
-            break
-        i += 1
-        yield from websocket.send(messages[i].to_json())
-        greeting = yield from websocket.recv()
+def respond(websocket, message):
+    """
+    Answer a request from a client, if message is one.
+
+    {"expand": "<memory id>"} pulls a truncated node on demand and answers
+    with {"expanded": "<memory id>", "nodes": [...]}.
+
+    {"subgraph": "<memory id>", "depth": n, "fields": [...]} answers with
+    the stored node and everything below it, as
+    {"subgraph": "<memory id>", "nodes": [...]}.
+
+    {"history": <address>, "sequence": n} answers with the raw bytes (in
+    hex, by type name) found at address at stop n, as
+    {"history": <address>, "sequence": n, "values": {...}}, or with
+    {"history": <address>, "error": "..."} if it makes no sense.
+    """
+    try:
+        request = json.loads(message)
+    except (TypeError, ValueError):
+        return
+    if not isinstance(request, dict):
+        return
+    if "expand" in request and Pull.walk is not None:
+        pending = Pull.walk.frontier_pull(request["expand"])
+        docs = Pull.walk.expand(request["expand"], request.get("depth", 1))
+        if pending is not None:
+            traversal.Traversal.show(websocket, pending.name)
+            publish_filled(docs[:1], docs)
+        yield from websocket.send(json.dumps({
+            "expanded": request["expand"],
+            "nodes": [Pull._blobs.view(d) for d in docs]
+        }))
+    if "subgraph" in request:
+        writebuffer.settle()
+        nodes = storage.backend.subgraph(
+            models.Memory._get_collection_name(),
+            bson.ObjectId(request["subgraph"]),
+            request.get("depth"),
+            request.get("fields"))
+        yield from websocket.send(json_util.dumps({
+            "subgraph": request["subgraph"],
+            "nodes": nodes
+        }))
+    if "history" in request:
+        address = request["history"]
+        sequence = request.get("sequence", Pull.sequence)
+        try:
+            if isinstance(address, str):
+                address = int(address, 16)
+            address = int(address)
+            sequence = int(sequence)
+        except (TypeError, ValueError):
+            yield from websocket.send(json.dumps({
+                "history": request["history"],
+                "error": "bad address or sequence"
+            }))
+            return
+        values = Pull.timelines.at(address, sequence)
+        yield from websocket.send(json.dumps({
+            "history": request["history"],
+            "sequence": sequence,
+            "values": {k: v.hex() for k, v in values.items()}
+        }))
+
 
+# NOTE: one hub serves every client, however many connect.
+server = hub.Hub(current_snapshot, Pull._blobs, respond,
+                 traversal.Traversal.forget)
 
 def serialize():
+    start_capture()
     serialize_upward()
-    start_server = websockets.serve(pingpong, '', 8765)
+    start_server = websockets.serve(
+        server.serve, '', 8765, subprotocols=server.subprotocols())
     asyncio.get_event_loop().run_until_complete(start_server)
     asyncio.get_event_loop().run_forever()
@@ -40,6 +40,8 @@ class TypeRegistration(object):
         gdb.TYPE_CODE_INTERNAL_FUNCTION: "DebuggerFunction",
     }
 
+    _layouts = dict()
+
     def __init__(self, handler):
         self.register_handler(handler)
 
@@ -47,6 +49,42 @@ class TypeRegistration(object):
     def lookup(cls, code):
         return cls._typeCodeMap.get(code)
 
+    @staticmethod
+    def _layout_key(typ):
+        """
+        Get a key identifying typ across gdb.Type instances.
+
+        Returns None for anonymous structures and unions, which do not have
+        a name stable enough to share a layout by.
+        """
+        # NOTE: typedefs always have a name, so no need to strip them here.
+        if typ.name is None and typ.code in {
+                gdb.TYPE_CODE_STRUCT,
+                gdb.TYPE_CODE_UNION,
+                }:
+            return None
+        objfile = getattr(typ, "objfile", None)
+        objfileName = objfile.filename if objfile is not None else None
+        return (objfileName, typ.code, str(typ))
+
+    @classmethod
+    def layout(cls, typ):
+        """
+        Get the (cached) TypeLayout for typ.
+        """
+        key = cls._layout_key(typ)
+        if key is None:
+            return TypeLayout(typ)
+        layout = cls._layouts.get(key)
+        if layout is None:
+            layout = TypeLayout(typ)
+            cls._layouts[key] = layout
+        return layout
+
+    @classmethod
+    def clear_layouts(cls, event=None):
+        cls._layouts.clear()
+
     @classmethod
     def register_handler(cls, handler):
 
@@ -67,5 +105,106 @@ class TypeRegistration(object):
     #     return Typed._type_lookup(Typed._typeHandlerCode)
 
 
+class FieldLayout(object):
+    """
+    *Concrete* class describing where a field sits inside its structure.
+
+    offset is None for fields which do not start on a byte boundary of
+    their own (static members and bitfields).
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.name = field.name
+        self.type = field.type
+        self.sizeof = field.type.sizeof
+        self.offset = None
+        if hasattr(field, "bitpos") and field.bitsize == 0 \
+                and field.bitpos % 8 == 0:
+            self.offset = field.bitpos // 8
+        self._layout = None
+
+    @property
+    def layout(self):
+        # NOTE: looked up lazily so self referential structures terminate.
+        if self._layout is None:
+            self._layout = TypeRegistration.layout(self.type)
+        return self._layout
+
+
+class TypeLayout(object):
+    """
+    *Concrete* class caching everything needed to pull an instance of a type.
+
+    Layouts are built once per type per objfile by TypeRegistration.layout
+    and shared by every instance of the type.
+    """
+
+    def __init__(self, typ):
+        self.type = typ
+        self.stripped = typ.strip_typedefs()
+        self.code = self.stripped.code
+        self.handler = TypeRegistration.lookup(self.code)
+        self.sizeof = self.stripped.sizeof
+        self.name = true_type_name(typ)
+        self.target = target_type_name(typ)
+        self.fields = []
+        if self.code in {gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION}:
+            self.fields = [FieldLayout(f) for f in self.stripped.fields()]
+        self._selfContained = None
+
+    # type codes whose values lead somewhere outside of their own bytes
+    _escapingCodes = {
+        gdb.TYPE_CODE_PTR,
+        gdb.TYPE_CODE_REF,
+        gdb.TYPE_CODE_FUNC,
+        gdb.TYPE_CODE_METHODPTR,
+        gdb.TYPE_CODE_MEMBERPTR,
+        getattr(gdb, "TYPE_CODE_RVALUE_REF", gdb.TYPE_CODE_REF),
+    }
+
+    @property
+    def self_contained(self):
+        """
+        True if everything an instance of this type leads to lives in its
+        own bytes, i.e. nothing in it is a pointer, reference or static
+        member.
+        """
+        if self._selfContained is None:
+            if self.code in TypeLayout._escapingCodes:
+                self._selfContained = False
+            elif self.code == gdb.TYPE_CODE_ARRAY:
+                self._selfContained = TypeRegistration.layout(
+                    self.stripped.target()).self_contained
+            else:
+                self._selfContained = all(
+                    f.offset is not None and f.layout.self_contained
+                    for f in self.fields)
+        return self._selfContained
+
+
 def handler_lookup(code):
     return TypeRegistration.lookup(code)
+
+
+def true_type_name(t, nameDecorators = ""):
+    if t.code == gdb.TYPE_CODE_PTR:
+        return true_type_name(t.target(), nameDecorators + "*")
+    elif t.code == gdb.TYPE_CODE_ARRAY:
+        length = str(t.range()[1] - t.range()[0] + 1)
+        return true_type_name(t.target(), nameDecorators + "[" + length + "]")
+    else:
+        if isinstance(t.name, str):
+            return t.name + nameDecorators
+        else:
+            return "<## unknown type ##>"
+
+
+def target_type_name(t):
+    if t.code == gdb.TYPE_CODE_PTR or t.code == gdb.TYPE_CODE_ARRAY:
+        return target_type_name(t.target())
+    return t.name
+
+
+gdb.events.new_objfile.connect(TypeRegistration.clear_layouts)
+gdb.events.clear_objfiles.connect(TypeRegistration.clear_layouts)
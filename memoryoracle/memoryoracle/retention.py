@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to decide which executions and snapshots are kept, and to delete
+the rest from a background thread.
+"""
+
+import datetime
+import threading
+import traceback
+
+import gdb
+
+import models
+import storage
+
+
+class Policy(object):
+    """
+    *Abstract* class to represent a retention policy.
+
+    A policy picks executions and snapshots to drop.  Anything picked by any
+    policy in use is dropped.
+    """
+
+    def executions(self, executions):
+        """
+        The executions to drop, out of executions (oldest first).
+        """
+        return []
+
+    def snapshots(self, snapshots):
+        """
+        The snapshots to drop, out of the snapshots of one execution (oldest
+        first).
+        """
+        return []
+
+
+class KeepLast(Policy):
+    """
+    *Concrete* policy keeping the last count executions.
+    """
+
+    def __init__(self, count):
+        self.count = count
+
+    def executions(self, executions):
+        return executions[:-self.count] if self.count else list(executions)
+
+
+class KeepKeyframes(Policy):
+    """
+    *Concrete* policy keeping every interval'th snapshot of an execution,
+    and the latest one.
+    """
+
+    def __init__(self, interval):
+        if int(interval) < 1:
+            raise ValueError("keyframe interval must be at least 1")
+        self.interval = int(interval)
+
+    def snapshots(self, snapshots):
+        return [s for s in snapshots[:-1] if s.sequence % self.interval]
+
+
+class TTL(Policy):
+    """
+    *Concrete* policy dropping executions and snapshots older than age (a
+    datetime.timedelta).  The latest snapshot of an execution is kept
+    whatever its age.
+    """
+
+    def __init__(self, age):
+        self.age = age
+
+    def _expired(self, time):
+        return time is not None and \
+                time < datetime.datetime.now() - self.age
+
+    def executions(self, executions):
+        return [e for e in executions if self._expired(e.start_time)]
+
+    def snapshots(self, snapshots):
+        return [s for s in snapshots[:-1] if self._expired(s.time)]
+
+
+class Compactor(threading.Thread):
+    """
+    *Concrete* class to apply retention policies every interval seconds.
+
+    Dropped executions are deleted with everything stored for them.  Dropped
+    snapshots are deleted, then the Memory documents of the execution are
+    swept: anything not reachable from a kept snapshot goes.  Since nodes
+    are shared between snapshots (see contentstore), this is what merges
+    the surviving snapshots into one set of documents.
+
+    The execution being captured (live) is never dropped.  Its dropped
+    snapshots are deleted all the same, and it is swept as far as horizon
+    allows: horizon is run on gdb's thread between stops, has the capture
+    stop reusing documents of earlier stops other than through the latest
+    one, and returns that stop's sequence (see pull.compaction_horizon).
+    Documents saved before it are then swept like any others.  Without a
+    horizon the live execution is not swept.
+
+    Whatever the capture itself keeps (the execution's counts, the ids
+    models.Memory knows) is only changed from gdb's thread.  Deletes go out
+    in small batches, so the capture's writes get in between.  Collections
+    are only compacted while nothing is being captured, since compacting
+    blocks writers.
+    """
+
+    interval = 60.0
+
+    # what is stored per execution, besides Memory documents
+    _perExecution = (
+        models.Snapshot,
+        models.SnapshotChunk,
+        models.TimelineEntry,
+        models.CompressionDictionary,
+    )
+
+    def __init__(self, policies, live=None, interval=None, horizon=None):
+        super(Compactor, self).__init__(name="memoryoracle-compactor")
+        self.daemon = True
+        self.policies = list(policies)
+        self.live = live
+        self.horizon = horizon
+        self.interval = interval or Compactor.interval
+        self._stopped = threading.Event()
+        self.executionsDropped = 0
+        self.snapshotsDropped = 0
+        self.swept = 0
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.compact()
+            except Exception:
+                traceback.print_exc()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def _is_live(self, execution):
+        return self.live is not None and execution.id == self.live.id
+
+    def _on_gdb_thread(self, function, wait=False):
+        """
+        Run function on gdb's thread, where the capture runs, so it never
+        runs in the middle of a stop.  With wait, block until it has run and
+        return what it returned (None if it failed or the compactor was
+        stopped meanwhile).
+        """
+        if not wait:
+            gdb.post_event(function)
+            return None
+        done = threading.Event()
+        result = []
+
+        def call():
+            try:
+                result.append(function())
+            finally:
+                done.set()
+
+        gdb.post_event(call)
+        while not done.wait(1.0):
+            if self._stopped.is_set():
+                return None
+        return result[0] if result else None
+
+    def compact(self):
+        backend = storage.connect()
+        executions = sorted(
+            backend.documents(models.Execution),
+            key=lambda e: e.start_time or datetime.datetime.min)
+        dropped = set()
+        for policy in self.policies:
+            dropped.update(e.id for e in policy.executions(executions)
+                           if not self._is_live(e))
+        touched = set()
+        for execution in executions:
+            if execution.id in dropped:
+                touched.update(self.drop_execution(execution))
+            else:
+                touched.update(self.compact_execution(execution))
+        # NOTE: the capture writes to every one of these collections, and
+        # space freed by deletes is reused by later writes anyway.
+        if self.live is not None:
+            return
+        for collection in sorted(touched):
+            backend.compact(collection)
+
+    @staticmethod
+    def _take_off(execution, nodes, snapshots):
+        execution.node_count = max(0, (execution.node_count or 0) - nodes)
+        execution.snapshot_count = max(
+            0, (execution.snapshot_count or 0) - snapshots)
+
+    def _adjust(self, execution, nodes=0, snapshots=0):
+        """
+        Take what was deleted off the counts of execution.
+        """
+        if not nodes and not snapshots:
+            return
+        if self._is_live(execution):
+            # NOTE: the capture changes (and writes out) its own copy at
+            # every stop, so that is the one to change, from its thread.
+            live = self.live
+            self._on_gdb_thread(
+                lambda: Compactor._take_off(live, nodes, snapshots))
+            return
+        Compactor._take_off(execution, nodes, snapshots)
+        storage.connect().write(
+            models.Execution._get_collection_name(),
+            [storage.Op(execution.id, execution.to_mongo(), True)], 1)
+
+    def drop_execution(self, execution):
+        """
+        Delete execution and everything stored for it.  Returns the names
+        of the collections something was deleted from.
+        """
+        backend = storage.connect()
+        touched = set()
+        for cls in (models.Memory,) + Compactor._perExecution:
+            collection = cls._get_collection_name()
+            ids = [son["_id"] for son in backend.scan(
+                collection, {"execution": execution.id}, ["_id"])]
+            if ids and backend.delete(collection, ids):
+                touched.add(collection)
+        collection = models.Execution._get_collection_name()
+        if backend.delete(collection, [execution.id]):
+            touched.add(collection)
+        self._on_gdb_thread(lambda: models.Memory.forget(execution))
+        self.executionsDropped += 1
+        return touched
+
+    def compact_execution(self, execution):
+        """
+        Delete the snapshots of execution the policies drop, and sweep.
+        Returns the names of the collections something was deleted from.
+        """
+        backend = storage.connect()
+        snapshots = sorted(
+            backend.documents(models.Snapshot, execution=execution.id),
+            key=lambda s: s.sequence)
+        dropped = set()
+        for policy in self.policies:
+            dropped.update(s.id for s in policy.snapshots(snapshots))
+        touched = set()
+        if not dropped:
+            return touched
+        chunks = models.SnapshotChunk._get_collection_name()
+        # columnar snapshots count their nodes, which go with their chunks
+        columnarNodes = 0
+        for snapshot in snapshots:
+            if snapshot.id not in dropped:
+                continue
+            ids = [son["_id"] for son in backend.scan(
+                chunks,
+                {"execution": execution.id, "sequence": snapshot.sequence},
+                ["_id"])]
+            if ids and backend.delete(chunks, ids):
+                touched.add(chunks)
+                columnarNodes += snapshot.node_count or 0
+        collection = models.Snapshot._get_collection_name()
+        deleted = backend.delete(collection, dropped)
+        if deleted:
+            touched.add(collection)
+        self.snapshotsDropped += deleted
+        self._adjust(execution, columnarNodes, deleted)
+        before = None
+        if self._is_live(execution):
+            if self.horizon is None:
+                return touched
+            before = self._on_gdb_thread(self.horizon, wait=True)
+            if before is None:
+                return touched
+        if self.sweep(execution, before):
+            touched.add(models.Memory._get_collection_name())
+        return touched
+
+    def sweep(self, execution, before=None):
+        """
+        Delete the Memory documents of execution no snapshot can reach.
+        With before, only those saved at stops before it are.  Returns how
+        many were deleted.
+        """
+        backend = storage.connect()
+        collection = models.Memory._get_collection_name()
+        marked = set()
+        for son in backend.scan(
+                models.Snapshot._get_collection_name(),
+                {"execution": execution.id}, ["roots"]):
+            for root in son.get("roots", ()):
+                if root in marked:
+                    continue
+                marked.update(node["_id"] for node in backend.subgraph(
+                    collection, root, fields=["_id"]))
+        unmarked = [son["_id"] for son in backend.scan(
+            collection, {"execution": execution.id}, ["_id", "snapshot"])
+            if son["_id"] not in marked and
+            (before is None or (son.get("snapshot") or 0) < before)]
+        deleted = backend.delete(collection, unmarked) if unmarked else 0
+        self.swept += deleted
+        self._adjust(execution, nodes=deleted)
+        return deleted
+
+
+def start(policies, live=None, interval=None, horizon=None):
+    """
+    Start compacting in the background under policies.
+    """
+    compactor = Compactor(policies, live, interval, horizon)
+    compactor.start()
+    return compactor
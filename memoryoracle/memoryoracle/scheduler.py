@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to fit the extraction of the debugee's memory into the latency the
+user interface can afford.
+"""
+
+import threading
+import time
+
+import gdb
+
+import pull
+import traversal
+import writebuffer
+
+
+class Scheduler(object):
+    """
+    *Concrete* class to serialize each stop under a time budget.
+
+    requirements.md asks for less than a second of UI latency.  So on a
+    stop, memory is pulled by priority (visible before hidden, shallow
+    before deep, newest frame first) until stopBudget seconds are up, and
+    what was reached is published as a partial snapshot.  The frontier is
+    then filled in the background, sliceBudget seconds at a time, until it
+    is empty or the user resumes the inferior.  What each slice fills in is
+    published to clients right away (see pull.publish_filled).
+
+    gdb's Python API may only be used from gdb's own thread, so the
+    background work is posted to gdb's event loop (gdb.post_event) from a
+    timer thread.  Leaving slicePause seconds between slices keeps the
+    prompt responsive.
+    """
+
+    stopBudget = 0.5
+    sliceBudget = 0.05
+    slicePause = 0.01
+
+    def __init__(self):
+        self.walk = None
+        self.snapshot = None
+        self.resumed = False
+        self.slices = 0
+
+    def attach(self):
+        pull.start_capture()
+        gdb.events.stop.connect(self.stopped)
+        gdb.events.cont.connect(self.continued)
+
+    def detach(self):
+        gdb.events.stop.disconnect(self.stopped)
+        gdb.events.cont.disconnect(self.continued)
+        pull.stop_capture()
+
+    def stopped(self, event=None):
+        self.resumed = False
+        self.slices = 0
+        walk = traversal.Traversal(
+            strategy=traversal.Traversal.PRIORITY,
+            deadline=time.monotonic() + Scheduler.stopBudget)
+        self.walk = pull.serialize_upward(walk=walk)
+        self.snapshot = pull.Pull.snapshot
+        self._schedule(walk)
+
+    def continued(self, event=None):
+        # NOTE: the inferior's memory can't be read while it runs, so
+        # whatever is left on the frontier stays truncated.
+        self.resumed = True
+
+    def _schedule(self, walk):
+        if walk.done:
+            if pull.Pull.recordTimeline:
+                pull.Pull.timelines.end()
+            self.snapshot.complete = True
+            writebuffer.buffer.add(self.snapshot)
+            writebuffer.buffer.add(pull.Pull.execution)
+            writebuffer.buffer.flush()
+            return
+        if not walk.resumable:
+            # NOTE: what was truncated can't be filled in, so the snapshot
+            # stays incomplete.
+            return
+        timer = threading.Timer(
+            Scheduler.slicePause,
+            gdb.post_event,
+            [lambda: self._fill(walk)])
+        timer.daemon = True
+        timer.start()
+
+    def _fill(self, walk):
+        if self.resumed or walk is not self.walk:
+            return
+        walk.resume(deadline=time.monotonic() + Scheduler.sliceBudget)
+        self.slices += 1
+        pull.publish_filled(walk.filled, walk.docs)
+        self._schedule(walk)
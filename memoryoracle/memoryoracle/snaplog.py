@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to write snapshots to an append only log file per execution and to
+read them back through mmap.
+
+The file starts with MAGIC, followed by records.  Each record is
+
+    <payload length: uint32> <kind: uint8> <id: 12 bytes>
+    <collection name length: uint16> <collection name> <payload>
+
+all little endian.  A FOOTER record holds the index: one (id, offset of
+the latest record with that id) entry per id, sorted by id, followed by
+the offset of the first entry, the number of entries and TRAILER.  When a
+log ends in a footer, readers binary search it in place.  Otherwise (the
+writer did not get to close it) they scan the records instead.  Writing
+more records after a footer is fine; the old footer is skipped like any
+other record.
+"""
+
+import mmap
+import os
+import struct
+
+
+MAGIC = b"MOLOG\x00\x00\x01"
+TRAILER = b"MOLOGEND"
+
+DOCUMENT = 1
+TOMBSTONE = 2
+FOOTER = 3
+
+_header = struct.Struct("<IB12sH")
+_entry = struct.Struct("<12sQ")
+_trailer = struct.Struct("<QQ8s")
+
+
+def _record(kind, key, collection, payload):
+    collection = collection.encode("utf-8")
+    return _header.pack(len(payload), kind, key, len(collection)) + \
+            collection + payload
+
+
+def _parse(data, offset):
+    """
+    Return (kind, id, collection, payload, next offset) for the record at
+    offset of data.  payload is a slice of data (zero copy for a
+    memoryview).
+    """
+    length, kind, key, collectionLength = _header.unpack_from(data, offset)
+    start = offset + _header.size
+    collection = bytes(data[start:start + collectionLength]).decode("utf-8")
+    start += collectionLength
+    end = start + length
+    if end > len(data):
+        raise ValueError("Truncated snapshot log record")
+    return kind, bytes(key), collection, data[start:end], end
+
+
+def _scan(data):
+    """
+    Yield (offset, kind, id, collection, payload) for every whole record of
+    data.  A record cut short (by a crash) ends the scan.
+    """
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a snapshot log")
+    offset = len(MAGIC)
+    while offset + _header.size <= len(data):
+        try:
+            kind, key, collection, payload, end = _parse(data, offset)
+        except ValueError:
+            return
+        yield offset, kind, key, collection, payload
+        offset = end
+
+
+class SnapshotLog(object):
+    """
+    *Concrete* class to append records to a snapshot log.
+
+    Appending is a sequential write.  The index is kept in memory and only
+    written out (as a footer) by close().  Records can be read back at any
+    time.  Reads go through an mmap of the log, mapped again (after a
+    flush) whenever a record past its end is asked for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = dict()
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            reader = SnapshotLogReader(path)
+            self._index = reader.index()
+            reader.close()
+            self._file = open(path, "ab")
+        else:
+            self._file = open(path, "ab")
+            self._file.write(MAGIC)
+        self._reader = open(path, "rb")
+        self._map = None
+        self._data = None
+        self.appended = 0
+
+    def __len__(self):
+        return len(self._index)
+
+    def append(self, key, collection, payload, kind=DOCUMENT):
+        """
+        Append a record.  key is a 12 byte id (an ObjectId's binary).
+        Returns the record's offset.
+        """
+        offset = self._file.tell()
+        self._file.write(_record(kind, key, collection, payload))
+        self._index[bytes(key)] = offset
+        self.appended += 1
+        return offset
+
+    def delete(self, key, collection):
+        return self.append(key, collection, b"", TOMBSTONE)
+
+    def flush(self):
+        self._file.flush()
+
+    def _unmap(self):
+        if self._data is None:
+            return
+        try:
+            self._data.release()
+            self._map.close()
+        except BufferError:
+            # NOTE: payloads handed out still use the old mapping.  It goes
+            # away with the last of them.
+            pass
+        self._map = None
+        self._data = None
+
+    def _mapped(self, offset):
+        """
+        The log's data, mapped far enough to hold the record at offset.
+        """
+        # NOTE: only whole records are ever flushed, so a record starting
+        # inside the mapping ends inside it too.
+        if self._data is None or offset >= len(self._data):
+            self.flush()
+            self._unmap()
+            self._map = mmap.mmap(
+                self._reader.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = memoryview(self._map)
+        return self._data
+
+    def get(self, key):
+        """
+        Return (collection, payload) of the latest record with id key, or
+        None if there is none (or it was deleted).  payload is a memoryview
+        of the mapping.
+        """
+        offset = self._index.get(bytes(key))
+        if offset is None:
+            return None
+        kind, _, collection, payload, _ = _parse(self._mapped(offset), offset)
+        if kind == TOMBSTONE:
+            return None
+        return collection, payload
+
+    def keys(self):
+        return list(self._index)
+
+    def records(self, collection=None):
+        """
+        Yield (id, collection, payload) for the latest version of every
+        record, in the order they were written.
+        """
+        for key, offset in sorted(self._index.items(), key=lambda e: e[1]):
+            kind, _, name, payload, _ = _parse(self._mapped(offset), offset)
+            if kind != DOCUMENT:
+                continue
+            if collection is not None and name != collection:
+                continue
+            yield key, name, payload
+
+    def close(self):
+        """
+        Write the footer and close the log.
+        """
+        entries = sorted(self._index.items())
+        offset = self._file.tell()
+        payload = b"".join(_entry.pack(k, o) for k, o in entries)
+        start = offset + _header.size + len("footer")
+        payload += _trailer.pack(start, len(entries), TRAILER)
+        self._file.write(_record(FOOTER, bytes(12), "footer", payload))
+        self._file.close()
+        self._unmap()
+        self._reader.close()
+
+
+class SnapshotLogReader(object):
+    """
+    *Concrete* class to read a snapshot log through mmap.
+
+    Payloads come back as memoryviews of the mapping, so nothing is copied
+    until they are decoded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.path.getsize(path)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) \
+                if size else None
+        self._data = memoryview(self._map) if size else memoryview(b"")
+        self._entries = None
+        self._count = 0
+        self._scanned = None
+        if len(self._data) >= _trailer.size:
+            start, count, magic = _trailer.unpack_from(
+                self._data, len(self._data) - _trailer.size)
+            if magic == TRAILER:
+                self._entries = start
+                self._count = count
+        if self._entries is None:
+            self._scanned = {key: offset for offset, kind, key, _, _
+                             in _scan(self._data) if kind != FOOTER}
+
+    def __len__(self):
+        return self._count if self._scanned is None else len(self._scanned)
+
+    def _entry(self, i):
+        return _entry.unpack_from(
+            self._data, self._entries + i * _entry.size)
+
+    def _find(self, key):
+        if self._scanned is not None:
+            return self._scanned.get(key)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            found, offset = self._entry(middle)
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return offset
+        return None
+
+    def index(self):
+        """
+        The whole index, as a dict of id to record offset.
+        """
+        if self._scanned is not None:
+            return dict(self._scanned)
+        return dict(self._entry(i) for i in range(self._count))
+
+    def keys(self):
+        return list(self.index())
+
+    def get(self, key):
+        """
+        Return (collection, payload) of the latest record with id key, or
+        None if there is none (or it was deleted).
+        """
+        offset = self._find(bytes(key))
+        if offset is None:
+            return None
+        kind, _, collection, payload, _ = _parse(self._data, offset)
+        if kind == TOMBSTONE:
+            return None
+        return collection, payload
+
+    def records(self, collection=None):
+        """
+        Yield (id, collection, payload) for the latest version of every
+        record, in the order they were written.
+        """
+        latest = self.index()
+        for offset, kind, key, name, payload in _scan(self._data):
+            if kind != DOCUMENT or latest.get(key) != offset:
+                continue
+            if collection is not None and name != collection:
+                continue
+            yield key, name, payload
+
+    def close(self):
+        try:
+            self._data.release()
+            if self._map is not None:
+                self._map.close()
+        except BufferError:
+            # NOTE: payloads handed out still use the mapping.  It goes
+            # away with the last of them.
+            pass
+        self._file.close()
@@ -0,0 +1,658 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes which store documents, either in a MongoDB server or in an SQLite
+database inside of the gdb process.
+"""
+
+import atexit
+import collections
+import os
+import sqlite3
+import threading
+
+import bson
+import pymongo
+import pymongo.errors
+import mongoengine
+
+import snaplog
+
+
+# One write waiting in a WriteBuffer.  document is the document's to_mongo()
+# form, replace is True if a document with the same id may already exist
+# (and should be overwritten).
+Op = collections.namedtuple("Op", ["id", "document", "replace"])
+
+
+def _class_matches(cls, son):
+    """
+    True if the stored document son is a cls (or a subclass of it).
+    """
+    name = son.get("_cls")
+    if name is None or not cls._meta.get("allow_inheritance"):
+        return True
+    return name == cls._class_name or \
+            name.startswith(cls._class_name + ".")
+
+
+class Storage(object):
+    """
+    *Abstract* class to represent somewhere documents are stored.
+
+    Collections are named as mongoengine names them
+    (Document._get_collection_name()), and queries are dicts of top level
+    field names to the values they must equal.
+    """
+
+    def write(self, collection, ops, batchSize):
+        """
+        Write the Ops in ops to collection, batchSize at a time.  Returns
+        the number written.
+        """
+        raise NotImplementedError
+
+    def find(self, collection, query, limit=None):
+        """
+        Return the stored documents (as dicts) of collection matching
+        query.
+        """
+        raise NotImplementedError
+
+    def subgraph(self, collection, root, maxDepth=None, fields=None):
+        """
+        Return the document root and every document reachable from it
+        through children, at most maxDepth levels down, in one go.
+
+        Documents come back as dicts, breadth first, each with its distance
+        from root in "depth".  If fields is given, only those fields (and
+        _id, children and depth) are returned.
+        """
+        raise NotImplementedError
+
+    def scan(self, collection, query, fields):
+        """
+        Like find(), but only return fields (and _id) of each document.
+        """
+        keep = set(fields) | {"_id"}
+        return [{k: v for k, v in son.items() if k in keep}
+                for son in self.find(collection, query)]
+
+    def delete(self, collection, ids):
+        """
+        Delete the documents of collection with the given ids.  Returns the
+        number deleted.
+        """
+        raise NotImplementedError
+
+    def compact(self, collection):
+        """
+        Give the space of deleted documents back and rebuild the indexes of
+        collection.
+        """
+        pass
+
+    @staticmethod
+    def _project(son, fields):
+        if fields is None:
+            return son
+        keep = set(fields) | {"_id", "children", "depth"}
+        return {k: v for k, v in son.items() if k in keep}
+
+    def documents(self, cls, limit=None, **query):
+        """
+        Return the stored cls documents matching query, as cls instances.
+        """
+        found = []
+        for son in self.find(cls._get_collection_name(), query):
+            if not _class_matches(cls, son):
+                continue
+            found.append(cls._from_son(son))
+            if limit is not None and len(found) >= limit:
+                break
+        return found
+
+    def close(self):
+        pass
+
+
+class MongoStorage(Storage):
+    """
+    *Concrete* class to store documents in a MongoDB server.
+    """
+
+    def __init__(self, name="memoryoracle", **kwargs):
+        self.name = name
+        # NOTE: The read_preference should not be needed.  This is a
+        # workaround for a bug in pymongo.  (http://goo.gl/Somoeu)
+        kwargs.setdefault(
+            "read_preference",
+            pymongo.read_preferences.ReadPreference.PRIMARY)
+        self.connection = mongoengine.connect(name, **kwargs)
+        self.db = self.connection[name]
+
+    @staticmethod
+    def _operation(op):
+        if op.replace:
+            return pymongo.ReplaceOne(
+                {"_id": op.id}, op.document, upsert=True)
+        return pymongo.InsertOne(op.document)
+
+    def write(self, collection, ops, batchSize):
+        written = 0
+        for start in range(0, len(ops), batchSize):
+            batch = [MongoStorage._operation(op)
+                     for op in ops[start:start + batchSize]]
+            try:
+                self.db[collection].bulk_write(batch, ordered=False)
+                written += len(batch)
+            except pymongo.errors.BulkWriteError as e:
+                print("BULK WRITE ERROR")
+                print(e.details)
+        return written
+
+    def find(self, collection, query, limit=None):
+        return list(self.db[collection].find(query, limit=limit or 0))
+
+    def scan(self, collection, query, fields):
+        return list(self.db[collection].find(
+            query, {field: 1 for field in fields}))
+
+    def delete(self, collection, ids, batchSize=1000):
+        ids = list(ids)
+        deleted = 0
+        for start in range(0, len(ids), batchSize):
+            deleted += self.db[collection].delete_many(
+                {"_id": {"$in": ids[start:start + batchSize]}}).deleted_count
+        return deleted
+
+    def compact(self, collection):
+        try:
+            self.db.command("compact", collection)
+        except pymongo.errors.OperationFailure as e:
+            print("COMPACT FAILED")
+            print(e)
+
+    def subgraph(self, collection, root, maxDepth=None, fields=None):
+        pipeline = [{"$match": {"_id": root}}]
+        if maxDepth is None or maxDepth > 0:
+            lookup = {
+                "from": collection,
+                "startWith": "$children",
+                "connectFromField": "children",
+                "connectToField": "_id",
+                "as": "descendants",
+                "depthField": "depth",
+            }
+            # NOTE: $graphLookup counts the root's children as depth 0.
+            if maxDepth is not None:
+                lookup["maxDepth"] = maxDepth - 1
+            pipeline.append({"$graphLookup": lookup})
+        if fields is not None:
+            projection = {"_id": 1, "children": 1}
+            for field in fields:
+                projection[field] = 1
+                projection["descendants." + field] = 1
+            projection["descendants._id"] = 1
+            projection["descendants.children"] = 1
+            projection["descendants.depth"] = 1
+            pipeline.append({"$project": projection})
+        found = list(self.db[collection].aggregate(pipeline))
+        if not found:
+            return []
+        root = found[0]
+        descendants = root.pop("descendants", [])
+        root["depth"] = 0
+        for son in descendants:
+            son["depth"] += 1
+        descendants.sort(key=lambda son: son["depth"])
+        return [root] + descendants
+
+
+class SQLiteStorage(Storage):
+    """
+    *Concrete* class to store documents in an SQLite database, with no
+    server involved.
+
+    Each collection is a table of BSON encoded documents.  The fields most
+    lookups are made by get a column (and an index) of their own, the rest
+    of a query is checked once the documents are decoded.  The database
+    runs in WAL mode, so readers do not wait on the writer thread.
+
+    children are also kept in an indexed edge table per collection, so a
+    subgraph takes one query per level rather than one per document.
+    """
+
+    # fields copied out of the documents into columns of their own
+    columns = ("_cls", "execution", "sequence", "snapshot", "frame",
+               "address", "content_hash", "name")
+
+    indexes = (
+        ("execution", "snapshot", "frame", "address"),
+        ("execution", "content_hash"),
+        ("execution", "sequence"),
+    )
+
+    # most parameters an SQLite statement is sure to take
+    maxParameters = 500
+
+    def __init__(self, path="memoryoracle.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tables = set()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+    @staticmethod
+    def _column(name):
+        return "cls" if name == "_cls" else name
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, bson.DBRef):
+            value = value.id
+        if isinstance(value, bson.ObjectId):
+            return str(value)
+        return value
+
+    def _table(self, collection):
+        if collection in self._tables:
+            return collection
+        columns = ", ".join(SQLiteStorage._column(c)
+                            for c in SQLiteStorage.columns)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS \"{}\" "
+            "(id TEXT PRIMARY KEY, {}, body BLOB)".format(collection, columns))
+        for index in SQLiteStorage.indexes:
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS \"{}_{}\" ON \"{}\" ({})".format(
+                    collection, "_".join(index), collection, ", ".join(index)))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS \"{0}_children\" "
+            "(parent TEXT, position INTEGER, child TEXT, "
+            "PRIMARY KEY (parent, position))".format(collection))
+        self._tables.add(collection)
+        return collection
+
+    @staticmethod
+    def _edges(ops):
+        return [(SQLiteStorage._value(op.id), position,
+                 SQLiteStorage._value(child))
+                for op in ops
+                for position, child in enumerate(
+                    op.document.get("children", ()))]
+
+    def _row(self, op):
+        document = op.document
+        return [SQLiteStorage._value(op.id)] + \
+               [SQLiteStorage._value(document.get(c))
+                for c in SQLiteStorage.columns] + \
+               [bson.encode(document)]
+
+    def write(self, collection, ops, batchSize):
+        fields = ", ".join(
+            ["id"] + [SQLiteStorage._column(c) for c in SQLiteStorage.columns]
+            + ["body"])
+        marks = ", ".join("?" * (len(SQLiteStorage.columns) + 2))
+        insert = "INSERT OR IGNORE INTO \"{}\" ({}) VALUES ({})"
+        replace = "INSERT OR REPLACE INTO \"{}\" ({}) VALUES ({})"
+        written = 0
+        with self._lock:
+            table = self._table(collection)
+            for start in range(0, len(ops), batchSize):
+                batch = ops[start:start + batchSize]
+                inserts = [op for op in batch if not op.replace]
+                replaces = [op for op in batch if op.replace]
+                with self.connection:
+                    self.connection.executemany(
+                        insert.format(table, fields, marks),
+                        [self._row(op) for op in inserts])
+                    self.connection.executemany(
+                        replace.format(table, fields, marks),
+                        [self._row(op) for op in replaces])
+                    self.connection.executemany(
+                        "DELETE FROM \"{}_children\" WHERE parent = ?"
+                        .format(table),
+                        [(SQLiteStorage._value(op.id),) for op in replaces])
+                    self.connection.executemany(
+                        "INSERT OR IGNORE INTO \"{}_children\" "
+                        "(parent, position, child) VALUES (?, ?, ?)"
+                        .format(table),
+                        SQLiteStorage._edges(batch))
+                written += len(batch)
+        return written
+
+    def find(self, collection, query, limit=None):
+        where = []
+        parameters = []
+        rest = dict()
+        for field, value in query.items():
+            if field == "_id":
+                where.append("id = ?")
+                parameters.append(SQLiteStorage._value(value))
+            elif field in SQLiteStorage.columns:
+                where.append(SQLiteStorage._column(field) + " = ?")
+                parameters.append(SQLiteStorage._value(value))
+            else:
+                rest[field] = value
+        statement = "SELECT body FROM \"{}\"".format(collection)
+        if where:
+            statement += " WHERE " + " AND ".join(where)
+        found = []
+        with self._lock:
+            table = self._table(collection)
+            rows = self.connection.execute(statement, parameters).fetchall()
+        for row in rows:
+            son = bson.decode(row[0])
+            if any(son.get(k) != v for k, v in rest.items()):
+                continue
+            found.append(son)
+            if limit is not None and len(found) >= limit:
+                break
+        return found
+
+    def scan(self, collection, query, fields):
+        fields = [f for f in fields if f != "_id"]
+        if not set(fields) <= set(SQLiteStorage.columns) or \
+                not set(query) <= set(SQLiteStorage.columns):
+            return super(SQLiteStorage, self).scan(collection, query, fields)
+        where = []
+        parameters = []
+        for field, value in query.items():
+            where.append(SQLiteStorage._column(field) + " = ?")
+            parameters.append(SQLiteStorage._value(value))
+        statement = "SELECT {} FROM \"{}\"".format(
+            ", ".join(["id"] + [SQLiteStorage._column(f) for f in fields]),
+            collection)
+        if where:
+            statement += " WHERE " + " AND ".join(where)
+        with self._lock:
+            self._table(collection)
+            rows = self.connection.execute(statement, parameters).fetchall()
+        found = []
+        for row in rows:
+            son = {"_id": bson.ObjectId(row[0])}
+            son.update(zip(fields, row[1:]))
+            found.append(son)
+        return found
+
+    def delete(self, collection, ids):
+        ids = [SQLiteStorage._value(i) for i in ids]
+        deleted = 0
+        # NOTE: one short transaction per chunk, so the writer thread is
+        # never held up for long.
+        for start in range(0, len(ids), SQLiteStorage.maxParameters):
+            chunk = ids[start:start + SQLiteStorage.maxParameters]
+            marks = ", ".join("?" * len(chunk))
+            with self._lock:
+                table = self._table(collection)
+                with self.connection:
+                    deleted += self.connection.execute(
+                        "DELETE FROM \"{}\" WHERE id IN ({})".format(
+                            table, marks), chunk).rowcount
+                    self.connection.execute(
+                        "DELETE FROM \"{}_children\" WHERE parent IN ({})"
+                        .format(table, marks), chunk)
+        return deleted
+
+    def compact(self, collection):
+        with self._lock:
+            table = self._table(collection)
+            self.connection.execute("REINDEX \"{}\"".format(table))
+            self.connection.execute(
+                "REINDEX \"{}_children\"".format(table))
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _select(self, statement, ids):
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), SQLiteStorage.maxParameters):
+            chunk = ids[start:start + SQLiteStorage.maxParameters]
+            rows.extend(self.connection.execute(
+                statement.format(", ".join("?" * len(chunk))),
+                chunk).fetchall())
+        return rows
+
+    def subgraph(self, collection, root, maxDepth=None, fields=None):
+        root = SQLiteStorage._value(root)
+        depths = {root: 0}
+        level = [root]
+        depth = 0
+        with self._lock:
+            table = self._table(collection)
+            while level and (maxDepth is None or depth < maxDepth):
+                depth += 1
+                rows = self._select(
+                    "SELECT child FROM \"" + table + "_children\" "
+                    "WHERE parent IN ({}) ORDER BY parent, position", level)
+                level = []
+                for (child,) in rows:
+                    if child not in depths:
+                        depths[child] = depth
+                        level.append(child)
+            rows = self._select(
+                "SELECT id, body FROM \"" + table + "\" WHERE id IN ({})",
+                depths)
+        found = []
+        for key, body in rows:
+            son = Storage._project(bson.decode(body), fields)
+            son["depth"] = depths[key]
+            found.append(son)
+        found.sort(key=lambda son: son["depth"])
+        return found
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+class LogStorage(Storage):
+    """
+    *Concrete* class to store documents in append only snapshot logs (see
+    snaplog), one per execution, with no database at all.
+
+    Writes are sequential appends of BSON documents.  Logs written by this
+    process are held open for writing.  Any other log is read through a
+    snaplog.SnapshotLogReader, opened once and kept.  Lookups by id go
+    straight to the right log through an index of which log holds which
+    id, built the first time an id has to be found without its execution.
+    Anything else scans the logs involved, so this suits single user
+    sessions and offline tools rather than big queries.
+    """
+
+    def __init__(self, directory="memoryoracle-logs"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._logs = dict()
+        self._readers = dict()
+        # log name by id, once every log has been looked at
+        self._where = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + ".molog")
+
+    def _names(self):
+        return [entry[:-len(".molog")] for entry in os.listdir(self.directory)
+                if entry.endswith(".molog")]
+
+    def _source(self, name):
+        """
+        Where to read log name from (None if there is no such log).
+        """
+        log = self._logs.get(name)
+        if log is not None:
+            return log
+        reader = self._readers.get(name)
+        if reader is None:
+            path = self._path(name)
+            if not os.path.exists(path):
+                return None
+            reader = self._readers[name] = snaplog.SnapshotLogReader(path)
+        return reader
+
+    def _log(self, name):
+        """
+        Log name, open for writing.
+        """
+        log = self._logs.get(name)
+        if log is None:
+            reader = self._readers.pop(name, None)
+            if reader is not None:
+                reader.close()
+            log = self._logs[name] = snaplog.SnapshotLog(self._path(name))
+        return log
+
+    def _index(self):
+        if self._where is None:
+            self._where = dict()
+            for name in self._names():
+                for key in self._source(name).keys():
+                    self._where[key] = name
+        return self._where
+
+    @staticmethod
+    def _log_name(collection, document):
+        # NOTE: an execution goes in its own log.  Documents of no
+        # execution in particular (types and such) share one.
+        if collection == "execution":
+            return str(document["_id"])
+        execution = document.get("execution")
+        return str(execution) if execution is not None else "shared"
+
+    def _names_for(self, collection, query):
+        if collection == "execution" and "_id" in query:
+            return [str(query["_id"])]
+        if query.get("execution") is not None:
+            return [str(SQLiteStorage._value(query["execution"]))]
+        return None
+
+    def _find_name(self, key, names=None):
+        """
+        The name of the log holding key, looking only in names if given.
+        """
+        if names is None:
+            return self._index().get(key.binary)
+        for name in names:
+            source = self._source(name)
+            if source is not None and source.get(key.binary) is not None:
+                return name
+        return None
+
+    def _get(self, key, names=None):
+        name = self._find_name(key, names)
+        return self._source(name).get(key.binary) if name is not None \
+                else None
+
+    def write(self, collection, ops, batchSize):
+        with self._lock:
+            touched = set()
+            for op in ops:
+                name = LogStorage._log_name(collection, op.document)
+                log = self._log(name)
+                log.append(op.id.binary, collection, bson.encode(op.document))
+                if self._where is not None:
+                    self._where[op.id.binary] = name
+                touched.add(log)
+            for log in touched:
+                log.flush()
+        return len(ops)
+
+    def find(self, collection, query, limit=None):
+        found = []
+        with self._lock:
+            names = self._names_for(collection, query)
+            if "_id" in query:
+                candidates = []
+                record = self._get(query["_id"], names)
+                if record is not None and record[0] == collection:
+                    candidates.append(bson.decode(bytes(record[1])))
+            else:
+                sources = [self._source(n)
+                           for n in (names if names is not None
+                                     else self._names())]
+                candidates = (
+                    bson.decode(bytes(payload))
+                    for source in sources if source is not None
+                    for _, _, payload in source.records(collection))
+            for son in candidates:
+                if any(son.get(k) != v for k, v in query.items()):
+                    continue
+                found.append(son)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def subgraph(self, collection, root, maxDepth=None, fields=None):
+        found = []
+        depths = {root: 0}
+        level = [root]
+        depth = 0
+        with self._lock:
+            while level:
+                nextLevel = []
+                for key in level:
+                    record = self._get(key)
+                    if record is None:
+                        continue
+                    son = bson.decode(bytes(record[1]))
+                    if maxDepth is None or depth < maxDepth:
+                        for child in son.get("children", ()):
+                            if child not in depths:
+                                depths[child] = depth + 1
+                                nextLevel.append(child)
+                    son = Storage._project(son, fields)
+                    son["depth"] = depth
+                    found.append(son)
+                level = nextLevel
+                depth += 1
+        return found
+
+    def delete(self, collection, ids):
+        deleted = 0
+        with self._lock:
+            touched = set()
+            for key in ids:
+                name = self._find_name(key)
+                if name is None or self._source(name).get(key.binary) is None:
+                    continue
+                log = self._log(name)
+                log.delete(key.binary, collection)
+                touched.add(log)
+                deleted += 1
+            for log in touched:
+                log.flush()
+        return deleted
+
+    def close(self):
+        with self._lock:
+            for log in self._logs.values():
+                log.close()
+            for reader in self._readers.values():
+                reader.close()
+            self._logs = dict()
+            self._readers = dict()
+
+
+backends = {
+    "mongo": MongoStorage,
+    "sqlite": SQLiteStorage,
+    "log": LogStorage,
+}
+
+# the storage in use, set up by connect()
+backend = None
+
+
+def connect(kind=None, **kwargs):
+    """
+    Set up the storage documents go to (once).  kind is one of backends,
+    by default $MEMORYORACLE_STORAGE or "mongo".
+    """
+    global backend
+    if backend is None:
+        kind = kind or os.environ.get("MEMORYORACLE_STORAGE", "mongo")
+        backend = backends[kind](**kwargs)
+    return backend
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to stream node records to websocket clients in batches, under
+flow control from the client.
+"""
+
+import asyncio
+import collections
+
+import subscriptions
+
+
+class Stream(object):
+    """
+    *Concrete* class to stream a list of nodes down one websocket.
+
+    Nodes go out in batches of at most maxBatchNodes nodes or
+    maxBatchBytes bytes of encoded nodes, as
+
+        {"batch": n, "sequence": s, "start": p, "cursor": c,
+         "done": false, "nodes": [...]}
+
+    where s is the stop the nodes are from, p the position of the first
+    node of the batch and c the position of the next node to send.  A
+    batch starting at 0 replaces whatever the client had.  Messages are
+    encoded in the format agreed on at connect time (see wire.Format), and
+    the first message of a session is the format's schema.  Clients can
+    always send theirs as JSON text.
+
+    Once all the nodes are sent, the deltas of later stops are sent as they
+    come in (see deltas.DeltaFeed).  A client too far behind is sent the
+    whole snapshot over again.  Every batch
+    costs one credit.  A client starts with initialCredit credits and
+    grants more with {"credit": n}, so it is never sent more than it can
+    take.  {"seek": c} moves the cursor.
+
+    {"subscribe": name, "frame": f, "root": r, "type": t,
+     "address": [start, end], "depth": d} (any filter may be left out) and
+    {"unsubscribe": name} narrow what the client is sent to the nodes
+    matching any of its subscriptions (see subscriptions.Subscription), and
+    start the stream over.  They are answered with
+    {"subscribed": [names...], "nodes": count}.
+
+    Any other message is handed to handler(websocket, message).
+    """
+
+    maxBatchNodes = 1000
+    maxBatchBytes = 256 * 1024
+    initialCredit = 4
+
+    def __init__(self, websocket, index, format, handler=None,
+                 snapshot=None, cache=None):
+        """
+        index is the subscriptions.Index of the stop to start from.  format
+        is the wire.Format to send in.  snapshot returns the Index of the
+        latest stop.  cache, if given, holds the nodes already encoded for
+        other clients (see wire.Cache).
+        """
+        self.websocket = websocket
+        self.cache = cache
+        self.format = format
+        self.handler = handler
+        self.snapshot = snapshot
+        self.subscriptions = subscriptions.Subscriptions()
+        # index is the stop the nodes being sent are from.  sequence (and
+        # revision) is the stop the client gets to once the pending deltas
+        # are sent too.
+        self.index = index
+        self.sequence = index.sequence
+        self.revision = index.revision
+        self.nodes = index.nodes
+        self.pending = collections.deque()
+        self.cursor = 0
+        self.credit = Stream.initialCredit
+        self.batches = 0
+        self.stringsSent = 0
+        self.closed = False
+        self._credited = asyncio.Event()
+
+    def grant(self, credit):
+        self.credit += credit
+        self._credited.set()
+
+    def seek(self, cursor):
+        self.cursor = max(0, min(int(cursor), len(self.nodes)))
+        self._credited.set()
+
+    def resync(self, index):
+        """
+        Start over with the nodes of the stop index is for.
+        """
+        self.pending.clear()
+        self.index = index
+        self.sequence = index.sequence
+        self.revision = index.revision
+        self.nodes = self.subscriptions.select(index)
+        self.cursor = 0
+        self._credited.set()
+
+    def subscribe(self, request):
+        """
+        Add or drop a subscription, as asked by request, and start over.
+        """
+        if "subscribe" in request:
+            self.subscriptions.subscribe(
+                request["subscribe"],
+                subscriptions.Subscription.from_request(request))
+        else:
+            self.subscriptions.unsubscribe(request["unsubscribe"])
+        self.resync(self.snapshot() if self.snapshot is not None
+                    else self.index)
+
+    def catch_up(self, feed):
+        """
+        Queue the deltas taking the client to the feed's latest stop.
+        """
+        frames = feed.since(self.sequence, self.format, self.subscriptions,
+                            self.revision)
+        if frames is None or \
+                len(self.pending) + len(frames) > feed.historySize:
+            self.resync(feed.snapshot())
+            return
+        self.pending.extend(frames)
+        self.sequence = feed.sequence
+        self.revision = feed.revision
+        self._credited.set()
+
+    def _encode(self, doc):
+        if self.cache is None:
+            return self.format.node(doc)
+        return self.cache.node(self.format, doc, self.index.sequence)
+
+    def _batch(self):
+        """
+        Encode the next batch, moving the cursor past it.
+        """
+        start = self.cursor
+        encoded = []
+        size = 0
+        while self.cursor < len(self.nodes) and \
+                len(encoded) < Stream.maxBatchNodes:
+            node = self._encode(self.nodes[self.cursor])
+            if encoded and size + len(node) > Stream.maxBatchBytes:
+                break
+            encoded.append(node)
+            size += len(node)
+            self.cursor += 1
+        self.batches += 1
+        return self.format.frame(
+            {"batch": self.batches, "sequence": self.index.sequence,
+             "start": start, "cursor": self.cursor,
+             "done": self.cursor >= len(self.nodes)},
+            nodes=encoded)
+
+    @asyncio.coroutine
+    def _send(self, frame):
+        """
+        Send frame, after any string table entries it needs which the
+        client has not had yet.
+        """
+        if frame.strings > self.stringsSent:
+            # NOTE: moved on before sending, as the table may be reset
+            # (see hub.Hub.reset) while this waits.
+            start, self.stringsSent = self.stringsSent, frame.strings
+            yield from self.websocket.send(
+                self.format.strings(start, frame.strings))
+        yield from self.websocket.send(frame.data)
+
+    @asyncio.coroutine
+    def _receive(self):
+        try:
+            while True:
+                message = yield from self.websocket.recv()
+                if message is None:
+                    return
+                try:
+                    request = self.format.load(message)
+                except (TypeError, ValueError):
+                    request = None
+                if isinstance(request, dict) and "credit" in request:
+                    self.grant(int(request["credit"]))
+                elif isinstance(request, dict) and "seek" in request:
+                    self.seek(request["seek"])
+                elif isinstance(request, dict) and \
+                        ("subscribe" in request or "unsubscribe" in request):
+                    try:
+                        self.subscribe(request)
+                    except (KeyError, TypeError, ValueError) as e:
+                        print("bad subscription: {}".format(e))
+                        continue
+                    yield from self.websocket.send(self.format.frame({
+                        "subscribed": list(self.subscriptions.names()),
+                        "nodes": len(self.nodes)}).data)
+                elif self.handler is not None:
+                    yield from self.handler(self.websocket, message)
+        finally:
+            self.closed = True
+            self._credited.set()
+
+    @asyncio.coroutine
+    def run(self):
+        """
+        Stream the nodes, and keep answering requests (and following seeks)
+        until the client goes away.
+        """
+        receiver = asyncio.ensure_future(self._receive())
+        try:
+            yield from self._send(self.format.schema())
+            while not self.closed and self.websocket.open:
+                waiting = self.cursor < len(self.nodes) or self.pending
+                if self.credit <= 0 or not waiting:
+                    self._credited.clear()
+                    yield from self._credited.wait()
+                    continue
+                self.credit -= 1
+                # NOTE: deltas wait until the snapshot they apply to is
+                # all there.
+                if self.cursor < len(self.nodes):
+                    yield from self._send(self._batch())
+                else:
+                    yield from self._send(self.pending.popleft())
+        finally:
+            receiver.cancel()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to let websocket clients subscribe to just the part of the memory
+graph they display.
+"""
+
+import bisect
+import collections
+
+
+# Where one node sits in a stop: its position in the stop's node list, the
+# name of the root variable it hangs off and how far below that root it is.
+Entry = collections.namedtuple(
+    "Entry", ["position", "frame", "root", "type", "address", "depth"])
+
+
+def parse_address(address):
+    """
+    The address of a node as an int, or None if it has none.
+    """
+    if isinstance(address, int) or address is None:
+        return address
+    try:
+        return int(str(address).split()[0], 0)
+    except (IndexError, ValueError):
+        return None
+
+
+class Index(object):
+    """
+    *Concrete* class to index the nodes of one stop by frame, root
+    variable, type name and address.
+
+    Built once per stop and shared by every client.  It is built again
+    (with the next revision) each time truncated nodes of the stop are
+    filled in.
+    """
+
+    def __init__(self, sequence=None, roots=(), revision=0):
+        self.sequence = sequence
+        self.revision = revision
+        self.nodes = []
+        self._entries = dict()
+        self._byFrame = collections.defaultdict(list)
+        self._byRoot = collections.defaultdict(list)
+        self._byType = collections.defaultdict(list)
+        addresses = []
+        # NOTE: the same order as deltas.nodes, parents first.
+        stack = [(doc, doc, 0) for doc in reversed(list(roots))]
+        while stack:
+            doc, root, depth = stack.pop()
+            if doc is None or doc.id in self._entries:
+                continue
+            entry = Entry(len(self.nodes), doc.frame, root.name,
+                          doc.type, parse_address(doc.address), depth)
+            self.nodes.append(doc)
+            self._entries[doc.id] = entry
+            self._byFrame[entry.frame].append(entry.position)
+            self._byRoot[entry.root].append(entry.position)
+            self._byType[entry.type].append(entry.position)
+            if entry.address is not None:
+                addresses.append((entry.address, entry.position))
+            stack.extend((child, root, depth + 1)
+                         for child in reversed(doc.children))
+        addresses.sort()
+        self._addresses = [a for a, _ in addresses]
+        self._addressPositions = [p for _, p in addresses]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def entry(self, doc):
+        """
+        The Entry of doc, or None if it is not part of this stop.
+        """
+        return self._entries.get(doc.id)
+
+    def _candidates(self, subscription):
+        """
+        The positions matching the indexed parts of subscription, or None
+        if it has none.
+        """
+        candidates = []
+        if subscription.frame is not None:
+            candidates.append(self._byFrame.get(subscription.frame, ()))
+        if subscription.root is not None:
+            candidates.append(self._byRoot.get(subscription.root, ()))
+        if subscription.type is not None:
+            candidates.append(self._byType.get(subscription.type, ()))
+        if subscription.start is not None or subscription.end is not None:
+            low = 0 if subscription.start is None else \
+                bisect.bisect_left(self._addresses, subscription.start)
+            high = len(self._addresses) if subscription.end is None else \
+                bisect.bisect_left(self._addresses, subscription.end)
+            candidates.append(self._addressPositions[low:high])
+        if not candidates:
+            return None
+        # NOTE: only the smallest list is walked, the rest are checked
+        # entry by entry.
+        return min(candidates, key=len)
+
+    def select(self, subscription):
+        """
+        The positions of the nodes matching subscription, in order.
+        """
+        candidates = self._candidates(subscription)
+        if candidates is None:
+            candidates = range(len(self.nodes))
+        return sorted(
+            p for p in candidates
+            if subscription.matches(self._entries[self.nodes[p].id]))
+
+
+class Subscription(object):
+    """
+    *Concrete* class to represent one filter a client subscribed with.
+
+    Every field left as None matches anything.  start and end bound the
+    address (end excluded), depth how far below its root variable a node
+    may be.
+    """
+
+    fields = ("frame", "root", "type", "start", "end", "depth")
+
+    def __init__(self, frame=None, root=None, type=None, start=None,
+                 end=None, depth=None):
+        self.frame = frame
+        self.root = root
+        self.type = type
+        self.start = parse_address(start)
+        self.end = parse_address(end)
+        self.depth = None if depth is None else int(depth)
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Build a Subscription from a client's subscribe message.  A range is
+        given as "address": [start, end].
+        """
+        kwargs = dict((f, request[f]) for f in cls.fields if f in request)
+        if "address" in request:
+            kwargs["start"], kwargs["end"] = request["address"]
+        return cls(**kwargs)
+
+    def matches(self, entry):
+        if entry is None:
+            return False
+        if self.frame is not None and entry.frame != self.frame:
+            return False
+        if self.root is not None and entry.root != self.root:
+            return False
+        if self.type is not None and entry.type != self.type:
+            return False
+        if self.start is not None or self.end is not None:
+            if entry.address is None:
+                return False
+            if self.start is not None and entry.address < self.start:
+                return False
+            if self.end is not None and entry.address >= self.end:
+                return False
+        if self.depth is not None and entry.depth > self.depth:
+            return False
+        return True
+
+
+class Subscriptions(object):
+    """
+    *Concrete* class to hold the named subscriptions of one client.
+
+    A client with none gets everything.  Otherwise it gets every node
+    matching any of them.
+    """
+
+    def __init__(self):
+        self._subscriptions = collections.OrderedDict()
+
+    def __bool__(self):
+        return bool(self._subscriptions)
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def names(self):
+        return self._subscriptions.keys()
+
+    def subscribe(self, name, subscription):
+        self._subscriptions[name] = subscription
+
+    def unsubscribe(self, name):
+        self._subscriptions.pop(name, None)
+
+    def select(self, index):
+        """
+        The nodes of index this client wants, in order.
+        """
+        if not self._subscriptions:
+            return index.nodes
+        positions = set()
+        for subscription in self._subscriptions.values():
+            positions.update(index.select(subscription))
+        return [index.nodes[p] for p in sorted(positions)]
+
+    def wants(self, entry):
+        """
+        Whether the node at entry (see Index.entry) is wanted.
+        """
+        if not self._subscriptions:
+            return True
+        return any(s.matches(entry) for s in self._subscriptions.values())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Run inside gdb, from this directory (see test_pull).
+"""
+
+import struct
+import unittest
+
+try:
+    import gdb
+except ImportError:
+    gdb = None
+
+
+class Doc(object):
+
+    def __init__(self, fields):
+        self.value = None
+        self.blob_dictionary = None
+        self.__dict__.update(fields)
+
+    def to_mongo(self):
+        return {}
+
+
+@unittest.skipIf(gdb is None, "needs gdb's python")
+class FreshTypeTableTest(unittest.TestCase):
+
+    def setUp(self):
+        global blobs
+        import blobs
+        self.stored = blobs.BlobStore.types
+
+    def tearDown(self):
+        blobs.BlobStore.types = self.stored
+
+    def test_names(self):
+        table = blobs.TypeTable()
+        integer = gdb.lookup_type("int")
+        self.assertEqual(table.type("int *"), integer.pointer())
+        self.assertEqual(str(table.type("int [2][3]")),
+                         str(integer.array(2).array(1)))
+        self.assertEqual(str(table.type("const char *")),
+                         str(gdb.lookup_type("char").const().pointer()))
+        self.assertIsNone(table.type("no_such_type_at_all"))
+
+    def test_render_in_another_process(self):
+        typ = gdb.lookup_type("int")
+        store = blobs.BlobStore(None, codec="zlib")
+        doc = Doc(store.pack(struct.pack("<i", 7), typ))
+        self.assertEqual(doc.blob_type, "int")
+        # a new process starts with an empty table
+        blobs.BlobStore.types = blobs.TypeTable()
+        self.assertEqual(blobs.BlobStore(None, codec="zlib").render(doc), "7")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import itertools
+import json
+import unittest
+
+import deltas
+import wire
+
+
+class Node(object):
+
+    _ids = itertools.count()
+
+    def __init__(self, name):
+        self.id = next(Node._ids)
+        self.name = name
+
+
+class Store(object):
+
+    def __init__(self):
+        self.views = 0
+
+    def view(self, node):
+        self.views += 1
+        return {"name": node.name}
+
+
+class Client(object):
+
+    def __init__(self, format):
+        self.format = format
+        self.sequence = 1
+
+    def catch_up(self, feed):
+        self.sequence = feed.sequence
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        self.cache = wire.Cache()
+        self.nodes = [Node("a"), Node("b")]
+
+    def test_shared(self):
+        first = wire.JSONFormat(self.store)
+        second = wire.JSONFormat(self.store)
+        for format in (first, second, first):
+            encoded = [self.cache.node(format, n, 1) for n in self.nodes]
+        self.assertEqual(self.store.views, 2)
+        self.assertEqual(json.loads(encoded[1]), {"name": "b"})
+
+    def test_keeps_latest(self):
+        format = wire.JSONFormat(self.store)
+        for sequence in range(1, 5):
+            self.cache.node(format, self.nodes[0], sequence)
+        self.assertEqual(len(self.cache), wire.Cache.keep)
+        # a stop older than any kept is encoded but not cached
+        self.cache.node(format, self.nodes[0], 1)
+        self.cache.node(format, self.nodes[0], 1)
+        self.assertEqual(self.store.views, 6)
+        self.assertEqual(len(self.cache), wire.Cache.keep)
+
+    def test_deltas_share_nodes(self):
+        feed = deltas.DeltaFeed(lambda: None, self.cache)
+        format = wire.JSONFormat(self.store)
+        feed.subscribe(Client(format))
+        feed.subscribe(Client(wire.JSONFormat(self.store)))
+        feed.publish(deltas.Delta(1, 2, self.nodes, [], []))
+        self.cache.node(format, self.nodes[0], 2)
+        self.assertEqual(self.store.views, 2)
+
+    def test_forget(self):
+        format = wire.JSONFormat(self.store)
+        for node in self.nodes:
+            self.cache.node(format, node, 1)
+        self.cache.forget(1, self.nodes[:1])
+        self.cache.forget(2, self.nodes)
+        self.assertEqual(len(self.cache), 1)
+        self.nodes[0].name = "filled"
+        self.assertEqual(json.loads(self.cache.node(format, self.nodes[0], 1)),
+                         {"name": "filled"})
+
+    def test_reset(self):
+        format = wire.JSONFormat(self.store)
+        self.cache.node(format, self.nodes[0], 1)
+        self.cache.strings.intern("int")
+        self.cache.reset()
+        self.assertEqual((len(self.cache), len(self.cache.strings)), (0, 0))
+        self.assertEqual(self.cache.strings.generation, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import unittest
+
+import contentstore
+
+
+class Node(object):
+
+    def __init__(self, name, value, children=(), frame="main"):
+        self.name = name
+        self.frame = frame
+        self.children = list(children)
+        self.paramDict = {"name": name, "value": value, "frame": frame}
+        self.content_hash = contentstore.content_hash(
+            self.paramDict, self.children)
+
+
+class ContentHashTest(unittest.TestCase):
+
+    def test_where_is_not_hashed(self):
+        fields = {"name": "i", "value": "1"}
+        stored = dict(fields, execution="e", snapshot=3, children=["x"])
+        self.assertEqual(contentstore.content_hash(fields, []),
+                         contentstore.content_hash(stored, []))
+
+    def test_fields(self):
+        self.assertNotEqual(
+            contentstore.content_hash({"value": "1"}, []),
+            contentstore.content_hash({"value": "2"}, []))
+        self.assertNotEqual(
+            contentstore.content_hash({"value": b"\x01"}, []),
+            contentstore.content_hash({"value": "\x01"}, []))
+
+    def test_children(self):
+        same = Node("s", "{...}", [Node("s.x", "1")])
+        self.assertEqual(same.content_hash,
+                         Node("s", "{...}", [Node("s.x", "1")]).content_hash)
+        self.assertNotEqual(same.content_hash,
+                            Node("s", "{...}", [Node("s.x", "2")]).content_hash)
+
+
+class ContentStoreTest(unittest.TestCase):
+
+    def test_find(self):
+        store = contentstore.ContentStore(None)
+        node = Node("i", "1")
+        self.assertIsNone(store.find(node.content_hash))
+        store.add(node)
+        self.assertIs(store.find(Node("i", "1").content_hash), node)
+        self.assertEqual(store.hits, 1)
+        store.clear()
+        self.assertIsNone(store.find(node.content_hash))
+
+
+class ChangedTest(unittest.TestCase):
+
+    def names(self, pairs):
+        return sorted((a.name if a else "", b.name if b else "")
+                      for a, b in pairs)
+
+    def test_unchanged_skipped(self):
+        old = [Node("s", "{1}", [Node("s.x", "1")]), Node("i", "0")]
+        new = [Node("s", "{1}", [Node("s.x", "1")]), Node("i", "0")]
+        self.assertEqual(list(contentstore.changed(old, new)), [])
+
+    def test_changed(self):
+        old = [Node("s", "{1, 2}", [Node("s.x", "1"), Node("s.y", "2")]),
+               Node("i", "0")]
+        new = [Node("s", "{1, 3}", [Node("s.x", "1"), Node("s.y", "3")]),
+               Node("j", "0", frame="f")]
+        self.assertEqual(self.names(contentstore.changed(old, new)), [
+            ("", "j"), ("i", ""), ("s", "s"), ("s.y", "s.y")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import itertools
+import json
+import unittest
+
+import deltas
+import subscriptions
+import wire
+
+
+class Node(object):
+
+    _ids = itertools.count()
+
+    def __init__(self, name, value, children=(), frame="main"):
+        self.id = next(Node._ids)
+        self.name = name
+        self.frame = frame
+        self.type = "int"
+        self.address = None
+        self.value = value
+        self.children = list(children)
+        self.content_hash = json.dumps(
+            [name, value, [c.content_hash for c in self.children]])
+
+
+class Store(object):
+
+    def view(self, node):
+        return {"name": node.name, "value": node.value}
+
+
+class DiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.x = Node("s.x", "1")
+        self.y = Node("s.y", "2")
+        self.s = Node("s", "{1, 2}", [self.x, self.y])
+        self.i = Node("i", "0")
+
+    def test_nodes(self):
+        self.assertEqual(
+            [n.name for n in deltas.nodes([self.s, self.i])],
+            ["s", "s.x", "s.y", "i"])
+
+    def test_unchanged(self):
+        delta = deltas.diff([self.s, self.i], [self.s, self.i], 1, 2)
+        self.assertEqual((delta.added, delta.removed, delta.changed),
+                         ([], [], []))
+
+    def test_changes(self):
+        y = Node("s.y", "3")
+        s = Node("s", "{1, 3}", [self.x, y])
+        p = Node("p", "0x0", [Node("*p", "7")])
+        delta = deltas.diff([self.s, self.i], [s, p], 1, 2)
+        self.assertEqual(sorted(n.name for n in delta.changed), ["s", "s.y"])
+        self.assertEqual([n.name for n in delta.added], ["p", "*p"])
+        self.assertEqual(delta.removed, [["main", "i"]])
+
+
+class Client(object):
+
+    format = wire.JSONFormat(Store())
+
+    def __init__(self, sequence):
+        self.sequence = sequence
+        self.revision = 0
+        self.received = []
+        self.resyncs = 0
+
+    def catch_up(self, feed):
+        frames = feed.since(self.sequence, self.format,
+                            revision=self.revision)
+        if frames is None:
+            self.resyncs += 1
+        else:
+            self.received.extend(json.loads(f.data)["delta"] for f in frames)
+        self.sequence = feed.sequence
+        self.revision = feed.revision
+
+
+class DeltaFeedTest(unittest.TestCase):
+
+    def test_history(self):
+        feed = deltas.DeltaFeed(lambda: (None, []))
+        current = Client(1)
+        feed.subscribe(current)
+        for sequence in range(2, 40):
+            feed.publish(deltas.Delta(sequence - 1, sequence, [], [], []))
+        self.assertEqual(current.received, list(range(2, 40)))
+        self.assertEqual(feed.since(38, Client.format),
+                         [feed.history[-1].encoded["json"][2]])
+        self.assertIsNone(feed.since(1, Client.format))
+        self.assertEqual(feed.since(39, Client.format), [])
+
+    def test_encoded_once(self):
+        feed = deltas.DeltaFeed(lambda: (None, []))
+        feed.subscribe(Client(1))
+        feed.subscribe(Client(1))
+        feed.publish(deltas.Delta(1, 2, [Node("i", "1")], [], []))
+        self.assertEqual(list(feed.history[-1].encoded), ["json"])
+        delta = json.loads(feed.since(1, Client.format)[0].data)
+        self.assertEqual(delta["added"], [{"name": "i", "value": "1"}])
+
+    def test_subscribed(self):
+        feed = deltas.DeltaFeed(lambda: None)
+        client = Client(1)
+        feed.subscribe(client)
+        x = Node("s.x", "5")
+        s = Node("s", "{5}", [x])
+        i = Node("i", "1")
+        feed.publish(deltas.Delta(1, 2, [i], [["main", "p"]], [s, x]),
+                     subscriptions.Index(2, [s, i]))
+        wanted = subscriptions.Subscriptions()
+        wanted.subscribe("s", subscriptions.Subscription(root="s", depth=0))
+        delta = json.loads(feed.since(1, Client.format, wanted)[0].data)
+        self.assertEqual(delta["added"], [])
+        self.assertEqual(delta["changed"], [{"name": "s", "value": "{5}"}])
+        self.assertEqual(delta["removed"], [["main", "p"]])
+
+    def test_filled(self):
+        feed = deltas.DeltaFeed(lambda: None)
+        client = Client(1)
+        feed.subscribe(client)
+        s = Node("s", "{...}")
+        feed.publish(deltas.Delta(1, 2, [s], [], []),
+                     subscriptions.Index(2, [s]))
+        x = Node("s.x", "5")
+        s.value = "{5}"
+        s.children = [x]
+        feed.publish(deltas.Delta(2, 2, [x], [], [s]),
+                     subscriptions.Index(2, [s], revision=1))
+        self.assertEqual(client.received, [2, 2])
+        self.assertEqual((client.sequence, client.revision), (2, 1))
+        self.assertEqual(feed.since(2, Client.format, revision=1), [])
+        fill = json.loads(feed.since(2, Client.format)[0].data)
+        self.assertEqual(fill["revision"], 1)
+        self.assertEqual(fill["changed"], [{"name": "s", "value": "{5}"}])
+        self.assertEqual(fill["added"], [{"name": "s.x", "value": "5"}])
+        self.assertEqual(len(feed.since(1, Client.format)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import unittest
+
+import fingerprints
+
+
+class FingerprintCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = fingerprints.FingerprintCache()
+        self.key = (0x1000, "struct s")
+
+    def test_fingerprint(self):
+        fingerprint = fingerprints.FingerprintCache.fingerprint
+        self.assertEqual(fingerprint(b"\x01\x02"), fingerprint(b"\x01\x02"))
+        self.assertNotEqual(fingerprint(b"\x01\x02"), fingerprint(b"\x01\x03"))
+
+    def test_previous(self):
+        self.cache.record(self.key, b"f", "doc", ["x"], [self.key])
+        self.assertIsNone(self.cache.previous(self.key))
+        self.cache.advance()
+        self.assertEqual(self.cache.previous(self.key),
+                         (b"f", "doc", ("x",), (self.key,)))
+
+    def test_forgotten(self):
+        self.cache.record(self.key, b"f", "doc", [])
+        self.cache.carried = 3
+        self.cache.advance()
+        self.assertEqual(self.cache.carried, 0)
+        self.cache.advance()
+        self.assertIsNone(self.cache.previous(self.key))
+
+
+if __name__ == "__main__":
+    unittest.main()
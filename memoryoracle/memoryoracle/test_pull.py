@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Run inside gdb, from this directory:
+
+    gdb -batch -ex "python import unittest, sys; sys.path.insert(0, '.'); \
+        unittest.main(module='test_pull', argv=['test_pull'], exit=False)"
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+try:
+    import gdb
+except ImportError:
+    gdb = None
+
+
+PROGRAM = """
+struct pair { int first; short second; };
+
+int main(void)
+{
+    int unchanged = 7;
+    struct pair pair = {3, 4};
+    int values[4] = {1, -2, 3, 4};
+    int *bad = (int *) 8;
+    int counter = 0;
+    counter++;
+    counter++;
+    return unchanged + counter + pair.first + values[0] + (bad != 0);
+}
+"""
+
+# the stop the tests start from
+LINE = PROGRAM.splitlines().index("    counter++;") + 1
+
+
+@unittest.skipIf(gdb is None, "needs gdb's python")
+class TwoStopTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        source = os.path.join(cls.directory, "program.c")
+        binary = os.path.join(cls.directory, "program")
+        with open(source, "w") as f:
+            f.write(PROGRAM)
+        subprocess.check_call(["gcc", "-g", "-O0", "-o", binary, source])
+        os.environ.setdefault("MEMORYORACLE_STORAGE", "sqlite")
+        cls.cwd = os.getcwd()
+        os.chdir(cls.directory)
+        global pull
+        import pull
+        gdb.execute("file {}".format(binary), to_string=True)
+        gdb.execute("break {}".format(LINE), to_string=True)
+        gdb.execute("run", to_string=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        gdb.execute("kill", to_string=True)
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.directory)
+
+    def roots(self):
+        return dict((r.name, r) for r in pull.Pull.snapshot.roots)
+
+    def test_unchanged_kept(self):
+        pull.serialize_upward()
+        first = self.roots()
+        gdb.execute("next", to_string=True)
+        pull.serialize_upward()
+        second = self.roots()
+        self.assertIn("unchanged", first)
+        self.assertIn("unchanged", second)
+        self.assertEqual(second["unchanged"].id, first["unchanged"].id)
+        self.assertIn("counter", second)
+
+    def test_carried_in_timeline(self):
+        pull.Pull.incremental = True
+        pull.Pull.recordTimeline = True
+        try:
+            pull.serialize_upward()
+            gdb.execute("next", to_string=True)
+            pull.serialize_upward()
+        finally:
+            pull.Pull.incremental = False
+            pull.Pull.recordTimeline = False
+        self.assertGreater(pull.Pull._history.carried, 0)
+        address = int(gdb.parse_and_eval("&unchanged"))
+        values = pull.Pull.timelines.at(address, pull.Pull.sequence)
+        self.assertIn((7).to_bytes(4, "little"), values.values())
+
+    def test_struct_decoded(self):
+        pull.StructurePull.rawDecode = False
+        try:
+            pull.serialize_upward()
+        finally:
+            pull.StructurePull.rawDecode = True
+        fieldByField = self.roots()["pair"]
+        pull.serialize_upward()
+        decoded = self.roots()["pair"]
+        self.assertEqual([c.name for c in decoded.children],
+                         ["pair.first", "pair.second"])
+        self.assertEqual([c.value for c in decoded.children], ["3", "4"])
+        self.assertEqual(decoded.content_hash, fieldByField.content_hash)
+
+    def test_layout_cached(self):
+        registry = pull.registry.TypeRegistration
+        layout = registry.layout(gdb.parse_and_eval("pair").type)
+        self.assertIs(registry.layout(gdb.lookup_type("struct pair")), layout)
+        self.assertEqual([(f.name, f.offset, f.sizeof) for f in layout.fields],
+                         [("first", 0, 4), ("second", 4, 2)])
+        self.assertTrue(layout.self_contained)
+        registry.clear_layouts()
+        self.assertIsNot(registry.layout(gdb.lookup_type("struct pair")),
+                         layout)
+
+    def test_primitive_array(self):
+        if pull.numpy is None:
+            self.skipTest("needs numpy")
+        pull.serialize_upward()
+        values = self.roots()["values"]
+        self.assertIsInstance(values, pull.models.PrimitiveArray)
+        self.assertEqual(values.children, [])
+        self.assertEqual(values.shape, [4])
+        data = pull.numpy.frombuffer(values.data, values.dtype)
+        self.assertEqual(data.tolist(), [1, -2, 3, 4])
+        self.assertEqual((values.minimum, values.maximum), ("-2", "4"))
+
+    def test_lazy_expand(self):
+        pull.serialize_upward(lazy=True)
+        first, second = self.roots()["pair"].children
+        self.assertTrue(first.truncated)
+        docs = pull.Pull.walk.expand(first.id)
+        self.assertEqual(docs[0].id, first.id)
+        self.assertFalse(first.truncated)
+        self.assertEqual(first.value, "3")
+        self.assertIs(pull.Pull.walk.expand(first.id), docs)
+        self.assertTrue(second.truncated)
+
+    def test_known_ids(self):
+        Memory = pull.models.Memory
+        execution = pull.Pull.execution.id
+        pull.serialize_upward()
+        known = [k for k in Memory._known if k[0] == execution]
+        self.assertTrue(known)
+        self.assertEqual(set(k[1] for k in known), {Memory._knownSnapshot})
+        Memory.forget(pull.Pull.execution)
+        self.assertFalse([k for k in Memory._known if k[0] == execution])
+    def test_execution_counts(self):
+        execution = pull.Pull.execution
+        snapshots, nodes = execution.snapshot_count, execution.node_count
+        pull.serialize_upward()
+        self.assertEqual(execution.snapshot_count, snapshots + 1)
+        self.assertEqual(execution.last_sequence, pull.Pull.sequence)
+        self.assertGreaterEqual(execution.node_count, nodes)
+
+    def test_visible_per_client(self):
+        Traversal = pull.traversal.Traversal
+        Traversal.show("first", "pair")
+        Traversal.show("second", "pair")
+        Traversal.forget("first")
+        self.assertTrue(Traversal.is_visible("pair"))
+        Traversal.forget("second")
+        self.assertFalse(Traversal.is_visible("pair"))
+        self.assertEqual(Traversal.visible, {})
+
+    def test_unreadable_saved(self):
+        pull.serialize_upward()
+        stack = [self.roots()["bad"]]
+        errors = []
+        while stack:
+            doc = stack.pop()
+            if doc.error is not None:
+                errors.append(doc)
+            stack.extend(doc.children)
+        self.assertTrue(errors)
+        self.assertTrue(all(d.value is None and not d.children
+                            for d in errors))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import snaplog
+
+
+def key(i):
+    return i.to_bytes(12, "big")
+
+
+class SnapshotLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "execution.molog")
+        self.log = snaplog.SnapshotLog(self.path)
+        for i in range(100):
+            self.log.append(key(i), "typed", b"document %d" % i)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_while_writing(self):
+        self.assertEqual(self.log.get(key(7)), ("typed", b"document 7"))
+        self.assertIsNone(self.log.get(key(100)))
+
+    def test_read_after_growth(self):
+        self.assertEqual(bytes(self.log.get(key(7))[1]), b"document 7")
+        self.log.append(key(300), "typed", b"appended later")
+        self.assertEqual(bytes(self.log.get(key(300))[1]), b"appended later")
+        self.log.delete(key(0), "typed")
+        self.assertEqual(
+            [k for k, _, _ in self.log.records()][-1:], [key(300)])
+        self.assertEqual(len(list(self.log.records("typed"))), 100)
+
+    def test_latest_version_wins(self):
+        self.log.append(key(3), "typed", b"replaced")
+        self.log.delete(key(4), "typed")
+        self.log.close()
+        reader = snaplog.SnapshotLogReader(self.path)
+        self.assertEqual(bytes(reader.get(key(3))[1]), b"replaced")
+        self.assertIsNone(reader.get(key(4)))
+        self.assertEqual(len(list(reader.records())), 99)
+        reader.close()
+
+    def test_footer_lookup(self):
+        self.log.close()
+        reader = snaplog.SnapshotLogReader(self.path)
+        self.assertEqual(len(reader), 100)
+        for i in (0, 1, 50, 99):
+            collection, payload = reader.get(key(i))
+            self.assertEqual(collection, "typed")
+            self.assertIsInstance(payload, memoryview)
+            self.assertEqual(bytes(payload), b"document %d" % i)
+        self.assertIsNone(reader.get(key(1000)))
+        reader.close()
+
+    def test_scan_without_footer(self):
+        self.log.flush()
+        with open(self.path, "ab") as f:
+            # a record cut short by a crash
+            f.write(b"\x10\x00")
+        reader = snaplog.SnapshotLogReader(self.path)
+        self.assertEqual(len(reader), 100)
+        self.assertEqual(bytes(reader.get(key(42))[1]), b"document 42")
+        reader.close()
+
+    def test_append_after_footer(self):
+        self.log.close()
+        log = snaplog.SnapshotLog(self.path)
+        log.append(key(200), "snapshot", b"later")
+        log.close()
+        reader = snaplog.SnapshotLogReader(self.path)
+        self.assertEqual(len(reader), 101)
+        self.assertEqual(reader.get(key(200))[0], "snapshot")
+        self.assertEqual(
+            [k for k, _, _ in reader.records("snapshot")], [key(200)])
+        reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import bson
+
+import storage
+
+
+class StorageTest(object):
+
+    collection = "memory"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.execution = bson.ObjectId()
+        self.storage = self.open()
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.directory)
+
+    def op(self, name, replace=False, id=None, **fields):
+        document = {"_id": id or bson.ObjectId(), "execution": self.execution,
+                    "name": name}
+        document.update(fields)
+        return storage.Op(document["_id"], document, replace)
+
+    def write(self, *ops):
+        return self.storage.write(self.collection, list(ops), 2)
+
+    def names(self, found):
+        return sorted(son["name"] for son in found)
+
+    def test_round_trip(self):
+        ops = [self.op("a", value="1"), self.op("b", value="2"),
+               self.op("c", value="2", execution=bson.ObjectId())]
+        self.assertEqual(self.write(*ops), 3)
+        found = self.storage.find(self.collection, {"_id": ops[1].id})
+        self.assertEqual(found, [ops[1].document])
+        self.assertEqual(self.names(self.storage.find(
+            self.collection, {"execution": self.execution})), ["a", "b"])
+        self.assertEqual(self.names(self.storage.find(
+            self.collection, {"value": "2"})), ["b", "c"])
+        self.assertEqual(len(self.storage.find(
+            self.collection, {"execution": self.execution}, limit=1)), 1)
+        self.assertEqual(self.storage.find("snapshot", {"_id": ops[0].id}),
+                         [])
+
+    def test_upsert(self):
+        first = self.op("a", value="1")
+        self.write(first)
+        self.write(self.op("a", True, first.id, value="2"))
+        found = self.storage.find(self.collection, {"_id": first.id})
+        self.assertEqual([son["value"] for son in found], ["2"])
+        fresh = self.op("b", True)
+        self.write(fresh)
+        self.assertEqual(
+            len(self.storage.find(self.collection, {"_id": fresh.id})), 1)
+
+    def test_delete(self):
+        ops = [self.op("a"), self.op("b")]
+        self.write(*ops)
+        self.assertEqual(self.storage.delete(
+            self.collection, [ops[0].id, bson.ObjectId()]), 1)
+        self.assertEqual(self.names(self.storage.find(
+            self.collection, {"execution": self.execution})), ["b"])
+
+    def test_scan(self):
+        op = self.op("a", value="1")
+        self.write(op)
+        self.assertEqual(self.storage.scan(
+            self.collection, {"execution": self.execution}, ["name"]),
+            [{"_id": op.id, "name": "a"}])
+
+    def graph(self):
+        """
+        a -> b, c;  c -> b;  b -> d;  d -> a
+        """
+        ids = dict((name, bson.ObjectId()) for name in "abcd")
+        children = {"a": "bc", "b": "d", "c": "b", "d": "a"}
+        self.write(*[self.op(name, id=ids[name], value=name.upper(),
+                             children=[ids[c] for c in children[name]])
+                     for name in "abcd"])
+        return ids
+
+    def depths(self, found):
+        return [(son["name"], son["depth"]) for son in found]
+
+    def test_subgraph(self):
+        ids = self.graph()
+        found = self.storage.subgraph(self.collection, ids["a"])
+        self.assertEqual(sorted(self.depths(found)),
+                         [("a", 0), ("b", 1), ("c", 1), ("d", 2)])
+        self.assertEqual(self.depths(found)[0], ("a", 0))
+        self.assertEqual([son["depth"] for son in found],
+                         sorted(son["depth"] for son in found))
+
+    def test_subgraph_depth(self):
+        ids = self.graph()
+        self.assertEqual(self.depths(self.storage.subgraph(
+            self.collection, ids["a"], 0)), [("a", 0)])
+        self.assertEqual(sorted(self.depths(self.storage.subgraph(
+            self.collection, ids["a"], 1))), [("a", 0), ("b", 1), ("c", 1)])
+        self.assertEqual(sorted(self.depths(self.storage.subgraph(
+            self.collection, ids["d"], 2))), [("a", 1), ("b", 2), ("c", 2),
+                                               ("d", 0)])
+
+    def test_subgraph_fields(self):
+        ids = self.graph()
+        for son in self.storage.subgraph(
+                self.collection, ids["b"], fields=["name"]):
+            self.assertEqual(set(son), {"_id", "name", "children", "depth"})
+        self.assertEqual(
+            self.storage.subgraph(self.collection, bson.ObjectId()), [])
+
+
+class SQLiteStorageTest(StorageTest, unittest.TestCase):
+
+    def open(self):
+        return storage.SQLiteStorage(
+            os.path.join(self.directory, "test.sqlite"))
+
+    def edges(self, parent):
+        return [row[0] for row in self.storage.connection.execute(
+            "SELECT child FROM memory_children WHERE parent = ? "
+            "ORDER BY position", (str(parent),))]
+
+    def test_edges(self):
+        x, y = bson.ObjectId(), bson.ObjectId()
+        s = self.op("s", children=[y, x])
+        self.write(s)
+        self.assertEqual(self.edges(s.id), [str(y), str(x)])
+        self.write(self.op("s", True, s.id, children=[x]))
+        self.assertEqual(self.edges(s.id), [str(x)])
+        self.storage.delete(self.collection, [s.id])
+        self.assertEqual(self.edges(s.id), [])
+
+
+class LogStorageTest(StorageTest, unittest.TestCase):
+
+    def open(self):
+        return storage.LogStorage(os.path.join(self.directory, "logs"))
+
+    def test_reopen(self):
+        ops = [self.op("a"), self.op("b", execution=bson.ObjectId())]
+        self.write(*ops)
+        self.storage.close()
+        self.storage = self.open()
+        for op in ops:
+            self.assertEqual(
+                self.storage.find(self.collection, {"_id": op.id}),
+                [op.document])
+        self.assertEqual(self.names(self.storage.find(
+            self.collection, {"execution": self.execution})), ["a"])
+
+
+class ConnectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.kind = os.environ.pop("MEMORYORACLE_STORAGE", None)
+        self.backend = storage.backend
+        storage.backend = None
+
+    def tearDown(self):
+        if storage.backend is not None:
+            storage.backend.close()
+        storage.backend = self.backend
+        if self.kind is None:
+            os.environ.pop("MEMORYORACLE_STORAGE", None)
+        else:
+            os.environ["MEMORYORACLE_STORAGE"] = self.kind
+        shutil.rmtree(self.directory)
+
+    def test_environment(self):
+        os.environ["MEMORYORACLE_STORAGE"] = "log"
+        backend = storage.connect(directory=self.directory)
+        self.assertIsInstance(backend, storage.LogStorage)
+        self.assertIs(storage.connect(), backend)
+
+    def test_kind(self):
+        os.environ["MEMORYORACLE_STORAGE"] = "log"
+        backend = storage.connect(
+            "sqlite", path=os.path.join(self.directory, "test.sqlite"))
+        self.assertIsInstance(backend, storage.SQLiteStorage)
+
+
+if __name__ == "__main__":
+    unittest.main()
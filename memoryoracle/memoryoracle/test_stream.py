@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import asyncio
+import itertools
+import json
+import unittest
+
+import deltas
+import subscriptions
+import wire
+
+
+class Node(object):
+
+    _ids = itertools.count()
+
+    def __init__(self, name, value):
+        self.id = next(Node._ids)
+        self.name = name
+        self.value = value
+        self.frame = "main"
+        self.type = "int"
+        self.address = None
+        self.children = []
+
+
+class Store(object):
+
+    def view(self, node):
+        return {"name": node.name, "value": node.value}
+
+
+@unittest.skipUnless(hasattr(asyncio, "coroutine"),
+                     "stream uses generator based coroutines")
+class CatchUpTest(unittest.TestCase):
+
+    def setUp(self):
+        global stream
+        import stream
+        self.nodes = [Node("v{}".format(i), str(i)) for i in range(3)]
+        self.index = subscriptions.Index(1, self.nodes)
+        self.client = stream.Stream(
+            None, self.index, wire.JSONFormat(Store()))
+        self.feed = deltas.DeltaFeed(lambda: self.index)
+        self.feed.subscribe(self.client)
+        self.feed.sequence = 1
+
+    def test_batches_keep_their_stop(self):
+        stream.Stream.maxBatchNodes = 2
+        try:
+            first = json.loads(self.client._batch().data)
+            self.feed.publish(deltas.Delta(1, 2, [], [], []))
+            second = json.loads(self.client._batch().data)
+        finally:
+            stream.Stream.maxBatchNodes = 1000
+        self.assertEqual((first["sequence"], second["sequence"]), (1, 1))
+        self.assertTrue(second["done"])
+        self.assertEqual(self.client.sequence, 2)
+        delta = json.loads(self.client.pending[0].data)
+        self.assertEqual((delta["base"], delta["delta"]), (1, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
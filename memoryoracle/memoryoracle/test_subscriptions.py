@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import itertools
+import unittest
+
+import subscriptions
+
+
+class Node(object):
+
+    _ids = itertools.count()
+
+    def __init__(self, name, type, address, children=(), frame="main"):
+        self.id = next(Node._ids)
+        self.name = name
+        self.type = type
+        self.address = address
+        self.frame = frame
+        self.children = list(children)
+
+
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.x = Node("s.x", "int", "0x1000")
+        self.y = Node("s.y", "char *", "0x1008 <s+8>")
+        self.s = Node("s", "struct s", "0x1000", [self.x, self.y])
+        self.i = Node("i", "int", "0x2000")
+        self.j = Node("j", "int", None, frame="f")
+        self.index = subscriptions.Index(3, [self.s, self.i, self.j])
+
+    def names(self, **kwargs):
+        wanted = subscriptions.Subscriptions()
+        wanted.subscribe("a", subscriptions.Subscription(**kwargs))
+        return [n.name for n in wanted.select(self.index)]
+
+    def test_order(self):
+        self.assertEqual([n.name for n in self.index.nodes],
+                         ["s", "s.x", "s.y", "i", "j"])
+        self.assertEqual(self.index.entry(self.y).root, "s")
+        self.assertEqual(self.index.entry(self.y).depth, 1)
+        self.assertEqual(self.index.entry(self.y).address, 0x1008)
+
+    def test_everything(self):
+        self.assertEqual(subscriptions.Subscriptions().select(self.index),
+                         self.index.nodes)
+
+    def test_filters(self):
+        self.assertEqual(self.names(frame="f"), ["j"])
+        self.assertEqual(self.names(type="int"), ["s.x", "i", "j"])
+        self.assertEqual(self.names(root="s", depth=0), ["s"])
+        self.assertEqual(self.names(start="0x1000", end="0x2000"),
+                         ["s", "s.x", "s.y"])
+        self.assertEqual(self.names(start=0x1004), ["s.y", "i"])
+        self.assertEqual(self.names(type="int", frame="main"), ["s.x", "i"])
+
+    def test_union(self):
+        wanted = subscriptions.Subscriptions()
+        wanted.subscribe("i", subscriptions.Subscription(root="i"))
+        wanted.subscribe("x", subscriptions.Subscription.from_request(
+            {"subscribe": "x", "address": [0x1000, 0x1001], "depth": 1,
+             "root": "s"}))
+        self.assertEqual([n.name for n in wanted.select(self.index)],
+                         ["s", "s.x", "i"])
+        self.assertTrue(wanted.wants(self.index.entry(self.i)))
+        self.assertFalse(wanted.wants(self.index.entry(self.j)))
+        wanted.unsubscribe("i")
+        self.assertFalse(wanted.wants(self.index.entry(self.i)))
+
+
+if __name__ == "__main__":
+    unittest.main()
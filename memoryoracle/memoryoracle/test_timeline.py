@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import unittest
+import random
+
+import timeline
+
+
+class DeltaTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        old = bytes(random.getrandbits(8) for _ in range(64))
+        new = bytearray(old)
+        new[3] ^= 0xff
+        new[40:44] = b"abcd"
+        new = bytes(new)
+        encoded = timeline.delta(old, new)
+        self.assertLess(len(encoded), len(new))
+        self.assertEqual(timeline.apply_delta(old, encoded), new)
+
+    def test_unchanged_is_empty(self):
+        self.assertEqual(timeline.delta(b"same", b"same"), b"")
+
+    def test_sizes_must_match(self):
+        with self.assertRaises(ValueError):
+            timeline.delta(b"ab", b"abc")
+
+
+class TimelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.values = dict()
+        self.timeline = timeline.Timeline()
+        value = bytes(8)
+        for sequence in range(1, 200, 2):
+            value = bytearray(value)
+            value[sequence % 8] = sequence % 256
+            value = bytes(value)
+            self.timeline.record(sequence, value)
+            self.values[sequence] = value
+
+    def test_lookup_every_stop(self):
+        self.assertIsNone(self.timeline.at(0))
+        for sequence in range(1, 201):
+            expected = self.values[sequence if sequence % 2 else sequence - 1]
+            self.assertEqual(self.timeline.at(sequence), expected)
+
+    def test_keyframes(self):
+        keyframes = [e for e in self.timeline.entries if e.keyframe]
+        self.assertEqual(
+            len(keyframes),
+            -(-len(self.timeline) // timeline.Timeline.keyframeInterval))
+
+    def test_unchanged_not_recorded(self):
+        self.assertIsNone(self.timeline.record(500, self.values[199]))
+        self.assertEqual(self.timeline.changes(199, 500), [199])
+
+    def test_gone(self):
+        self.timeline.record(300, None)
+        self.assertIsNone(self.timeline.at(300))
+        self.assertEqual(self.timeline.at(299), self.values[199])
+        self.timeline.record(301, b"resized")
+        self.assertEqual(self.timeline.at(400), b"resized")
+
+    def test_reload(self):
+        reloaded = timeline.Timeline(self.timeline.entries)
+        for sequence in (1, 63, 64, 65, 199):
+            self.assertEqual(reloaded.at(sequence), self.timeline.at(sequence))
+
+    def test_out_of_order(self):
+        with self.assertRaises(ValueError):
+            self.timeline.record(5, b"late")
+
+
+class TimelineIndexTest(unittest.TestCase):
+
+    def test_gone_at_end_of_stop(self):
+        stored = []
+        index = timeline.TimelineIndex(
+            sink=lambda key, entry: stored.append((key, entry)))
+        index.begin(1)
+        index.record((0x1000, "int"), b"\x01\x00\x00\x00")
+        index.record((0x1000, "struct s"), b"\x01\x00\x00\x00\x02\x00")
+        index.end()
+        index.begin(2)
+        index.record((0x1000, "int"), b"\x01\x00\x00\x00")
+        index.end()
+        self.assertEqual(
+            index.at(0x1000, 1),
+            {"int": b"\x01\x00\x00\x00", "struct s": b"\x01\x00\x00\x00\x02\x00"})
+        self.assertEqual(index.at(0x1000, 2), {"int": b"\x01\x00\x00\x00"})
+        self.assertEqual(len(stored), 3)
+
+    def test_carried_not_gone(self):
+        index = timeline.TimelineIndex()
+        index.begin(1)
+        index.record((0x1000, "int"), b"\x01\x00\x00\x00")
+        index.record((0x2000, "int"), b"\x02\x00\x00\x00")
+        index.end()
+        index.begin(2)
+        index.carry([(0x1000, "int")])
+        index.end()
+        self.assertEqual(index.at(0x1000, 2), {"int": b"\x01\x00\x00\x00"})
+        self.assertEqual(index.at(0x2000, 2), {})
+        self.assertEqual(len(index.timeline((0x1000, "int"))), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
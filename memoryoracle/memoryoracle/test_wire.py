@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import json
+import threading
+import unittest
+
+import wire
+
+
+class ObjectId(object):
+
+    def __init__(self, n):
+        self.binary = n.to_bytes(12, "big")
+
+
+class Doc(object):
+
+    def __init__(self, n, name, type="int", children=()):
+        self.id = ObjectId(n)
+        self.name = name
+        self.type = type
+        self.children = [c.id for c in children]
+
+    def to_mongo(self):
+        return {"_id": self.id, "_cls": "Memory.Value", "name": self.name,
+                "type": self.type, "children": self.children,
+                "truncated": False}
+
+
+class Store(object):
+
+    def view(self, node):
+        return {"name": node}
+
+    def render(self, doc):
+        return "value of " + doc.name
+
+
+class JSONFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.format = wire.JSONFormat(Store())
+
+    def test_frame(self):
+        nodes = [self.format.node("a"), self.format.node("b")]
+        frame = self.format.frame({"batch": 1}, nodes=nodes, other=[])
+        self.assertEqual(json.loads(frame.data), {
+            "batch": 1, "nodes": [{"name": "a"}, {"name": "b"}],
+            "other": []})
+        self.assertEqual(frame.strings, 0)
+
+    def test_empty_header(self):
+        frame = self.format.frame({}, nodes=[self.format.node("a")])
+        self.assertEqual(json.loads(frame.data), {"nodes": [{"name": "a"}]})
+
+    def test_negotiate(self):
+        self.assertIsInstance(wire.negotiate(None, Store()), wire.JSONFormat)
+        self.assertIsInstance(wire.negotiate("memoryoracle.json", Store()),
+                              wire.JSONFormat)
+        self.assertIn("memoryoracle.json", wire.formats())
+
+
+class StringTableTest(unittest.TestCase):
+
+    def test_intern(self):
+        table = wire.StringTable()
+        self.assertEqual([table.intern(s) for s in ("int", "char", "int")],
+                         [0, 1, 0])
+        self.assertEqual(table.entries(1, 2), ["char"])
+        table.reset()
+        self.assertEqual((len(table), table.generation), (0, 1))
+        self.assertEqual(table.intern("char"), 0)
+
+    def test_threads(self):
+        table = wire.StringTable()
+        names = ["type{}".format(n) for n in range(200)]
+        ids = []
+
+        def intern():
+            ids.append([table.intern(name) for name in names])
+
+        threads = [threading.Thread(target=intern) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(ids, [list(range(len(names)))] * len(threads))
+        self.assertEqual(table.entries(0, None), names)
+
+
+class CBORHeadTest(unittest.TestCase):
+
+    def test_lengths(self):
+        head = wire.CBORFormat(Store())._head
+        self.assertEqual(head(4, 3), b"\x83")
+        self.assertEqual(head(5, 2), b"\xa2")
+        self.assertEqual(head(4, 24), b"\x98\x18")
+        self.assertEqual(head(4, 1000), b"\x99\x03\xe8")
+        self.assertEqual(head(4, 70000), b"\x9a\x00\x01\x11\x70")
+
+
+class BinaryFormatTest(object):
+
+    def setUp(self):
+        self.format = self.formatClass(Store())
+        self.leaf = Doc(1, "leaf", "char *")
+        self.root = Doc(2, "root", "struct node", [self.leaf])
+
+    def field(self, node, name):
+        return node[wire.FIELDS.index(name)]
+
+    def test_node(self):
+        node = self.format._unpack(self.format.node(self.root))
+        self.assertEqual(len(node), len(wire.FIELDS))
+        self.assertEqual(self.field(node, "_id"), self.root.id.binary)
+        self.assertEqual(self.field(node, "name"), "root")
+        self.assertEqual(self.field(node, "value"), "value of root")
+        self.assertEqual(self.field(node, "children"), [self.leaf.id.binary])
+        self.assertIs(self.field(node, "truncated"), False)
+        self.assertIsNone(self.field(node, "address"))
+        strings = self.format.table.entries(0, None)
+        self.assertEqual(strings[self.field(node, "type")], "struct node")
+        self.assertEqual(strings[self.field(node, "_cls")], "Memory.Value")
+
+    def test_frame(self):
+        nodes = [self.format.node(self.root), self.format.node(self.leaf)]
+        frame = self.format.frame({"batch": 1}, nodes=nodes, other=[])
+        message = self.format.load(frame.data)
+        self.assertEqual(message["batch"], 1)
+        self.assertEqual(message["other"], [])
+        self.assertEqual([self.field(n, "name") for n in message["nodes"]],
+                         ["root", "leaf"])
+        self.assertEqual(frame.strings, len(self.format.table))
+
+    def test_many_nodes(self):
+        docs = [Doc(n, "n{}".format(n)) for n in range(300)]
+        frame = self.format.frame(
+            {}, nodes=[self.format.node(d) for d in docs])
+        nodes = self.format.load(frame.data)["nodes"]
+        self.assertEqual([self.field(n, "_id") for n in nodes],
+                         [d.id.binary for d in docs])
+
+    def test_strings(self):
+        node = self.format._unpack(self.format.node(self.leaf))
+        typeId = self.field(node, "type")
+        message = self.format.load(self.format.strings(typeId, typeId + 1))
+        self.assertEqual(message, {"strings": ["char *"], "start": typeId})
+
+    def test_schema(self):
+        message = self.format.load(self.format.schema().data)
+        self.assertEqual(message["schema"]["format"], self.format.name)
+        self.assertEqual(message["schema"]["fields"], list(wire.FIELDS))
+
+    def test_text_requests(self):
+        self.assertEqual(self.format.load('{"expand": "a"}'), {"expand": "a"})
+
+    def test_shared_table(self):
+        table = wire.StringTable()
+        first, second = [
+            wire.negotiate("memoryoracle." + self.format.name, Store(), table)
+            for n in range(2)]
+        self.assertIs(first.table, table)
+        first.node(self.root)
+        node = second._unpack(second.node(self.root))
+        self.assertEqual(self.field(node, "type"), table.intern("struct node"))
+
+
+@unittest.skipIf(wire.msgpack is None, "needs msgpack")
+class MessagePackFormatTest(BinaryFormatTest, unittest.TestCase):
+    formatClass = wire.MessagePackFormat
+
+
+@unittest.skipIf(wire.cbor2 is None, "needs cbor2")
+class CBORFormatTest(BinaryFormatTest, unittest.TestCase):
+    formatClass = wire.CBORFormat
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+
+import unittest
+
+import bson
+
+import storage
+import writebuffer
+
+
+class Doc(object):
+
+    def __init__(self, collection, id=None):
+        self.collection = collection
+        self.id = id
+
+    def to_mongo(self):
+        return {"_id": self.id, "collection": self.collection}
+
+    def _get_collection_name(self):
+        return self.collection
+
+
+class Recorder(storage.Storage):
+
+    def __init__(self):
+        self.writes = []
+        self.failing = False
+
+    def write(self, collection, ops, batchSize):
+        if self.failing:
+            raise RuntimeError("write failed")
+        self.writes.append((collection, list(ops), batchSize))
+        return len(ops)
+
+
+class WriteBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = storage.backend
+        storage.backend = Recorder()
+        self.buffer = writebuffer.WriteBuffer(batchSize=3)
+
+    def tearDown(self):
+        storage.backend = self.backend
+
+    def test_ids(self):
+        new = self.buffer.add(Doc("memory"))
+        old = self.buffer.add(Doc("memory", bson.ObjectId()))
+        self.assertIsInstance(new.id, bson.ObjectId)
+        (collection, ops), = self.buffer.take()
+        self.assertEqual([(op.id, op.replace) for op in ops],
+                         [(new.id, False), (old.id, True)])
+        self.assertEqual(ops[0].document["_id"], new.id)
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_order(self):
+        # nodes go out before the snapshot and execution referring to them
+        self.buffer.add(Doc("memory"))
+        self.buffer.add(Doc("snapshot"))
+        self.buffer.add(Doc("memory"))
+        self.buffer.flush()
+        self.assertEqual([(c, len(ops)) for c, ops, _ in
+                          storage.backend.writes],
+                         [("memory", 2), ("snapshot", 1)])
+
+    def test_batches(self):
+        for i in range(7):
+            self.buffer.add(Doc("memory"))
+        self.assertEqual(len(storage.backend.writes), 2)
+        self.assertEqual(len(self.buffer), 1)
+        self.buffer.flush()
+        self.assertEqual([len(ops) for _, ops, _ in storage.backend.writes],
+                         [3, 3, 1])
+        self.assertEqual(self.buffer.written, 7)
+        self.assertEqual(self.buffer.batches, 3)
+        self.buffer.flush()
+        self.assertEqual(self.buffer.batches, 3)
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = storage.backend
+        storage.backend = Recorder()
+        self.buffer = writebuffer.buffer
+        writebuffer.buffer = writebuffer.WriteBuffer(batchSize=2)
+
+    def tearDown(self):
+        writebuffer.stop_pipeline()
+        writebuffer.buffer = self.buffer
+        storage.backend = self.backend
+
+    def test_written_in_background(self):
+        pipeline = writebuffer.start_pipeline()
+        self.assertIs(writebuffer.start_pipeline(), pipeline)
+        for i in range(3):
+            writebuffer.buffer.add(Doc("memory"))
+        writebuffer.buffer.add(Doc("snapshot"))
+        writebuffer.settle()
+        self.assertEqual([(c, len(ops)) for c, ops, _ in
+                          storage.backend.writes],
+                         [("memory", 2), ("memory", 1), ("snapshot", 1)])
+        counters = pipeline.counters
+        self.assertEqual((counters["enqueued"], counters["written"],
+                          counters["pending"]), (4, 4, 0))
+        writebuffer.stop_pipeline()
+        self.assertIsNone(writebuffer.buffer.pipeline)
+        self.assertFalse(pipeline.is_alive())
+
+    def test_stop_writes_out(self):
+        pipeline = writebuffer.start_pipeline()
+        writebuffer.buffer.add(Doc("memory"))
+        writebuffer.stop_pipeline()
+        self.assertEqual(pipeline.written, 1)
+
+    def test_errors_counted(self):
+        pipeline = writebuffer.start_pipeline()
+        storage.backend.failing = True
+        writebuffer.buffer.add(Doc("memory"))
+        writebuffer.settle()
+        self.assertEqual((pipeline.errors, pipeline.written), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
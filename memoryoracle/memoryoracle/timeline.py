@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to keep the history of the bytes at each address of the debugee,
+stop by stop, so any address can be looked up at any earlier stop.
+"""
+
+import bisect
+import collections
+import struct
+
+
+# One change in a timeline.  data is the whole value for a keyframe and a
+# delta against the previous entry otherwise.  A keyframe with data None
+# marks the object as gone.
+Entry = collections.namedtuple("Entry", ["sequence", "keyframe", "data"])
+
+_run = struct.Struct("<II")
+
+
+def delta(old, new):
+    """
+    Encode the differences between old and new (of the same length) as a
+    list of (offset, length, bytes) runs.
+    """
+    if len(old) != len(new):
+        raise ValueError("delta needs values of the same length")
+    encoded = []
+    i = 0
+    size = len(new)
+    while i < size:
+        if old[i] == new[i]:
+            i += 1
+            continue
+        start = i
+        while i < size and old[i] != new[i]:
+            i += 1
+        encoded.append(_run.pack(start, i - start))
+        encoded.append(new[start:i])
+    return b"".join(encoded)
+
+
+def apply_delta(old, encoded):
+    """
+    Rebuild the value encoded was made from, given the value before it.
+    """
+    value = bytearray(old)
+    i = 0
+    while i < len(encoded):
+        start, length = _run.unpack_from(encoded, i)
+        i += _run.size
+        value[start:start + length] = encoded[i:i + length]
+        i += length
+    return bytes(value)
+
+
+class Timeline(object):
+    """
+    *Concrete* class holding the history of one address.
+
+    Only changes are recorded.  Every keyframeInterval entries (and whenever
+    the size changes) the whole value is kept, everything in between is a
+    delta against the entry before it.  Looking up the value at a stop is a
+    binary search for the last change at or before it, another for the
+    keyframe it builds on, and at most keyframeInterval deltas.
+    """
+
+    keyframeInterval = 32
+
+    def __init__(self, entries=()):
+        self._sequences = []
+        self._entries = []
+        self._keyframes = []
+        self._last = None
+        for entry in entries:
+            self._append(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def entries(self):
+        return list(self._entries)
+
+    @property
+    def last(self):
+        """
+        The latest value (None if the object is gone or was never seen).
+        """
+        return self._last
+
+    def _append(self, entry):
+        if self._sequences and entry.sequence <= self._sequences[-1]:
+            raise ValueError("Timeline entries must be in sequence order")
+        if entry.keyframe:
+            self._keyframes.append(len(self._entries))
+            self._last = entry.data
+        elif not self._entries:
+            raise ValueError("A timeline must start with a keyframe")
+        else:
+            self._last = apply_delta(self._last, entry.data)
+        self._sequences.append(entry.sequence)
+        self._entries.append(entry)
+
+    def record(self, sequence, raw):
+        """
+        Record the value raw (None if gone) at stop sequence.  Returns the
+        new entry, or None if nothing changed.
+        """
+        if raw is not None:
+            raw = bytes(raw)
+        if raw == self._last and (self._entries or raw is None):
+            return None
+        keyframe = raw is None or self._last is None or \
+                len(raw) != len(self._last) or \
+                len(self._entries) - self._keyframes[-1] >= \
+                        Timeline.keyframeInterval
+        data = raw if keyframe else delta(self._last, raw)
+        entry = Entry(sequence, keyframe, data)
+        self._append(entry)
+        return entry
+
+    def at(self, sequence):
+        """
+        The value at stop sequence, or None if there was none.
+        """
+        i = bisect.bisect_right(self._sequences, sequence) - 1
+        if i < 0:
+            return None
+        k = self._keyframes[bisect.bisect_right(self._keyframes, i) - 1]
+        value = self._entries[k].data
+        for entry in self._entries[k + 1:i + 1]:
+            value = apply_delta(value, entry.data)
+        return value
+
+    def changes(self, start=None, end=None):
+        """
+        The stops between start and end (inclusive) at which the value
+        changed.
+        """
+        first = 0 if start is None else \
+                bisect.bisect_left(self._sequences, start)
+        last = len(self._sequences) if end is None else \
+                bisect.bisect_right(self._sequences, end)
+        return self._sequences[first:last]
+
+
+class TimelineIndex(object):
+    """
+    *Concrete* class holding the timelines of every object seen, keyed by
+    (address, type name).
+
+    Call begin() at the start of every stop and end() once it has been
+    recorded; objects neither recorded nor carried in between are marked as
+    gone.  Every new
+    entry is handed to sink(key, entry), if given, to be stored.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.sequence = None
+        self._timelines = dict()
+        self._addresses = collections.defaultdict(set)
+        self._seen = set()
+
+    def __len__(self):
+        return len(self._timelines)
+
+    def begin(self, sequence):
+        self.sequence = sequence
+        self._seen = set()
+
+    def _timeline(self, key):
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            timeline = Timeline()
+            self._timelines[key] = timeline
+            self._addresses[key[0]].add(key)
+        return timeline
+
+    def _record(self, key, raw):
+        entry = self._timeline(key).record(self.sequence, raw)
+        if entry is not None and self.sink is not None:
+            self.sink(key, entry)
+        return entry
+
+    def record(self, key, raw):
+        """
+        Record raw as the value of key at the current stop.
+        """
+        if self.sequence is None:
+            raise ValueError("TimelineIndex.begin must be called first")
+        self._seen.add(key)
+        return self._record(key, raw)
+
+    def carry(self, keys):
+        """
+        Mark keys as seen at the current stop with their values unchanged,
+        for objects carried forward without being read again.
+        """
+        if self.sequence is None:
+            raise ValueError("TimelineIndex.begin must be called first")
+        self._seen.update(keys)
+
+    def end(self):
+        for key, timeline in self._timelines.items():
+            if key not in self._seen and timeline.last is not None:
+                self._record(key, None)
+
+    def load(self, key, entries):
+        """
+        Replace the timeline of key with one made of stored entries.
+        """
+        self._timelines[key] = Timeline(entries)
+        self._addresses[key[0]].add(key)
+
+    def timeline(self, key):
+        return self._timelines.get(key)
+
+    def keys(self, address):
+        """
+        The keys of every object ever seen at address.
+        """
+        return sorted(self._addresses.get(address, ()))
+
+    def at(self, address, sequence):
+        """
+        The values of everything at address at stop sequence, by type
+        name.
+        """
+        found = dict()
+        for key in self.keys(address):
+            value = self._timelines[key].at(sequence)
+            if value is not None:
+                found[key[1]] = value
+        return found
@@ -6,17 +6,12 @@ File containing the abstract Tracked class.
 
 # import gdb
 
-import pymongo
-
 import mongoengine
 
 import execution
+import storage
 
-# NOTE: The read_preference should not be needed.  This is a workaround for a
-# bug in pymongo.  (http://goo.gl/Somoeu)
-mongoengine.connect('memoryoracle',
-                    read_preference=\
-                            pymongo.read_preferences.ReadPreference.PRIMARY)
+storage.connect()
 
 
 class Tracked(mongoengine.Document):
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes which drive the extraction (pull) of the debugee's memory graph.
+"""
+
+import collections
+import heapq
+import itertools
+import time
+import traceback
+
+import gdb
+
+import registry
+import writebuffer
+
+
+# A pull waiting on the worklist (or left on the frontier).  rank is the
+# position of the root it was reached from (frames are added newest first),
+# visible is True if the client is displaying it.
+WorkItem = collections.namedtuple(
+    "WorkItem", ["depth", "rank", "visible", "pull"])
+
+
+class Traversal(object):
+    """
+    *Concrete* class to walk the memory graph with an explicit worklist.
+
+    Pulls are expanded breadth first, depth first or by priority until the
+    worklist runs dry or one of the budgets is spent.  Anything still
+    waiting at that point is saved as a truncated frontier node.  Nodes are
+    saved in reverse discovery order once the walk is done, so every child
+    has its document before its parent needs to refer to it.  The documents
+    go out through writebuffer.buffer in bulk at the end of the walk.
+
+    Unlike the old recursive save(), the length of a pointer chain is
+    bounded only by the budgets, never by the Python recursion limit.
+
+    Nodes deeper than maxDepth are left truncated as well.  A truncated
+    node can be pulled later on with expand(); results are cached for the
+    life of the traversal (i.e. the rest of the stop).  resume() carries on
+    with the whole frontier under fresh budgets.
+    """
+
+    BFS = "bfs"
+    DFS = "dfs"
+    # visible before hidden, then shallow before deep, then newest frame
+    # first
+    PRIORITY = "priority"
+
+    # Defaults for new traversals.  None means unlimited.
+    defaultStrategy = BFS
+    defaultNodeBudget = None
+    defaultByteBudget = None
+    defaultTimeBudget = None
+
+    # names of the nodes each client (by its websocket) currently has open.
+    # Their children are visible, and go first under the PRIORITY strategy.
+    visible = dict()
+
+    def __init__(self, roots=(), strategy=None, nodeBudget=None,
+                 byteBudget=None, deadline=None, maxDepth=None):
+        """
+        deadline is an absolute time.monotonic() value.  If it is not given,
+        defaultTimeBudget seconds from now is used (if set).
+        """
+        self.strategy = strategy or Traversal.defaultStrategy
+        if self.strategy not in {
+                Traversal.BFS, Traversal.DFS, Traversal.PRIORITY}:
+            raise ValueError("Unknown traversal strategy: " + str(strategy))
+        self.nodeBudget = nodeBudget if nodeBudget is not None \
+                else Traversal.defaultNodeBudget
+        self.byteBudget = byteBudget if byteBudget is not None \
+                else Traversal.defaultByteBudget
+        if deadline is None and Traversal.defaultTimeBudget is not None:
+            deadline = time.monotonic() + Traversal.defaultTimeBudget
+        self.deadline = deadline
+        self.maxDepth = maxDepth
+
+        self.nodes = 0
+        self.bytes = 0
+        self.roots = []
+        self.truncated = []
+        # pulls which could not be read
+        self.errors = []
+        # truncated pulls without a document to resume from
+        self.lost = 0
+        self.stored = []
+        # documents of the truncated nodes the last resume() filled in
+        self.filled = []
+        self._worklist = []
+        self._counter = itertools.count()
+        self._order = []
+        self._frontier = dict()
+        self._expansions = dict()
+        for root in roots:
+            self.add_root(root)
+
+    @staticmethod
+    def show(client, name):
+        """
+        Note that client opened the node called name.
+        """
+        Traversal.visible.setdefault(client, set()).add(name)
+
+    @staticmethod
+    def forget(client):
+        """
+        Drop what client had open, once it has gone away.
+        """
+        Traversal.visible.pop(client, None)
+
+    @staticmethod
+    def is_visible(name):
+        # NOTE: clients come and go on the websocket server's thread, so the
+        # sets are copied before they are looked at.
+        return any(name in names
+                   for names in list(Traversal.visible.values()))
+
+    def add_root(self, pull):
+        self._push(WorkItem(0, len(self.roots), True, pull))
+        self.roots.append(pull)
+
+    @property
+    def done(self):
+        """
+        True once nothing is left waiting, on the worklist or the frontier,
+        and nothing was truncated for good.
+        """
+        return not self._worklist and not self._frontier and not self.lost
+
+    @property
+    def resumable(self):
+        """
+        True while resume() has anything left to pull.
+        """
+        return bool(self._worklist or self._frontier)
+
+    @property
+    def exhausted(self):
+        """
+        True once any of the budgets is spent.
+        """
+        if self.nodeBudget is not None and self.nodes >= self.nodeBudget:
+            return True
+        if self.byteBudget is not None and self.bytes >= self.byteBudget:
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return False
+
+    def _push(self, item):
+        seq = next(self._counter)
+        if self.strategy == Traversal.DFS:
+            key = (-seq,)
+        elif self.strategy == Traversal.PRIORITY:
+            key = (not item.visible, item.depth, item.rank, seq)
+        else:
+            key = (seq,)
+        heapq.heappush(self._worklist, (key, seq, item))
+
+    def _pop(self):
+        return heapq.heappop(self._worklist)[2]
+
+    def _too_deep(self, item):
+        return self.maxDepth is not None and item.depth > self.maxDepth
+
+    @staticmethod
+    def _size(pull):
+        if pull.object is None:
+            return 0
+        return registry.TypeRegistration.layout(pull.object.type).sizeof
+
+    def _expand(self, item):
+        pull = item.pull
+        try:
+            pulled = pull.pull()
+        except gdb.error as e:
+            # NOTE: gdb.MemoryError included.  The node is still saved, with
+            # the error, so the client can tell why nothing is below it.
+            traceback.print_exc()
+            pull.fail(e)
+            self.errors.append(pull)
+            self._order.append(pull)
+            return
+        if not pulled:
+            # already pulled at this stop
+            return
+        self.nodes += 1
+        self.bytes += Traversal._size(pull)
+        self._order.append(pull)
+        childrenVisible = Traversal.is_visible(pull.name)
+        for child in pull.child_pulls:
+            self._push(WorkItem(
+                item.depth + 1, item.rank, childrenVisible, child))
+
+    def _truncate(self, item):
+        item.pull.truncate()
+        self.truncated.append(item)
+        self._order.append(item.pull)
+
+    def _store(self):
+        for pull in reversed(self._order):
+            try:
+                pull.store()
+            except Exception:
+                traceback.print_exc()
+        writebuffer.buffer.flush()
+        for item in self.truncated:
+            if item.pull.doc is not None:
+                self._frontier[str(item.pull.doc.id)] = item
+            else:
+                # NOTE: columnar snapshots keep no document per node, so
+                # there is nothing to resume these from.
+                self.lost += 1
+        self.truncated = []
+        self.stored = self._order
+        self._order = []
+
+    def run(self):
+        """
+        Pull everything reachable from the roots (budget permitting) and
+        save it.
+        """
+        while self._worklist:
+            item = self._pop()
+            if self._too_deep(item) or self.exhausted:
+                self._truncate(item)
+            else:
+                self._expand(item)
+        self._store()
+        return self
+
+    @property
+    def docs(self):
+        """
+        The documents saved by the last run, in discovery order.
+        """
+        return [p.doc for p in self.stored if p.doc is not None]
+
+    @property
+    def frontier(self):
+        """
+        The pulls currently left truncated, by document id.
+        """
+        return {k: item.pull for k, item in self._frontier.items()}
+
+    def frontier_pull(self, docId):
+        """
+        The pull left truncated as document docId, or None.
+        """
+        item = self._frontier.get(str(docId))
+        return item.pull if item is not None else None
+
+    def resume(self, deadline=None, nodeBudget=None, byteBudget=None):
+        """
+        Carry on pulling the frontier under fresh budgets.  Truncated
+        documents are filled in place, and whatever is left over ends up
+        back on the frontier.  Nodes beyond maxDepth stay where they are,
+        waiting for expand().
+        """
+        self.deadline = deadline
+        self.nodeBudget = nodeBudget
+        self.byteBudget = byteBudget
+        self.nodes = 0
+        self.bytes = 0
+        self.filled = []
+        for docId, item in list(self._frontier.items()):
+            if self._too_deep(item):
+                continue
+            del self._frontier[docId]
+            self.filled.append(item.pull.doc)
+            item.pull.truncate(False)
+            self._push(item)
+        return self.run()
+
+    def expand(self, docId, depth=1):
+        """
+        Pull the truncated node saved as document docId, and depth levels
+        below it.
+
+        Returns the documents saved along the way (the node's own document
+        first), or an empty list if docId is not on the frontier.
+        """
+        docId = str(docId)
+        if docId in self._expansions:
+            return self._expansions[docId]
+        item = self._frontier.pop(docId, None)
+        if item is None:
+            return []
+        item.pull.truncate(False)
+        sub = Traversal([item.pull], strategy=self.strategy, maxDepth=depth)
+        sub.run()
+        self._frontier.update(sub._frontier)
+        # NOTE: stored is in discovery order, so the node itself is first.
+        docs = sub.docs
+        self._expansions[docId] = docs
+        return docs
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to encode the messages sent to websocket clients, as JSON text or
+in a compact binary form (MessagePack or CBOR).
+
+The binary forms are optional: each is offered to clients only when its
+module (msgpack or cbor2) is installed.  JSON always is.
+"""
+
+import collections
+import json
+import struct
+import threading
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+# An encoded message.  strings is how many entries of the string table a
+# client needs to decode it (see StringTable).
+Frame = collections.namedtuple("Frame", ["data", "strings"])
+
+# fields of a node, in the order binary formats send them
+FIELDS = (
+    "_id", "_cls", "name", "relative_name", "frame", "address", "type",
+    "dynamic_type", "unaliased_type", "value", "range_start", "range_end",
+    "children", "truncated", "content_hash", "error",
+)
+
+# fields whose values (few, and repeated a lot) are sent as string ids
+INTERNED = frozenset(
+    ("_cls", "frame", "type", "dynamic_type", "unaliased_type"))
+
+
+class StringTable(object):
+    """
+    *Concrete* class holding the strings which binary formats send as ids.
+
+    Strings are interned by whichever thread encodes a node (the gdb thread
+    publishing a stop, or the event loop streaming one), so the table is
+    only touched under its lock.  It grows until reset, which starts ids
+    over and bumps generation.
+    """
+
+    def __init__(self):
+        self._strings = []
+        self._ids = dict()
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def intern(self, value):
+        with self._lock:
+            stringId = self._ids.get(value)
+            if stringId is None:
+                stringId = len(self._strings)
+                self._strings.append(value)
+                self._ids[value] = stringId
+            return stringId
+
+    def entries(self, start, end):
+        with self._lock:
+            return self._strings[start:end]
+
+    def reset(self):
+        with self._lock:
+            del self._strings[:]
+            self._ids.clear()
+            self.generation += 1
+
+    def __len__(self):
+        return len(self._strings)
+
+
+class Format(object):
+    """
+    *Abstract* class to represent a way of encoding messages.
+
+    Nodes are encoded once by node() and spliced as they are into any
+    number of messages by frame().
+    """
+
+    name = None
+    binary = False
+
+    def __init__(self, store):
+        """
+        store formats the values of nodes (see blobs.BlobStore).
+        """
+        self.store = store
+
+    def node(self, doc):
+        """
+        Encode one Memory document.
+        """
+        raise NotImplementedError
+
+    def frame(self, header, **nodeLists):
+        """
+        Encode the dict header with the lists of encoded nodes in nodeLists
+        added to it.
+        """
+        raise NotImplementedError
+
+    def load(self, message):
+        """
+        Decode a message from a client.  Text messages are always JSON.
+        """
+        return json.loads(message)
+
+    def schema(self):
+        """
+        The message telling a client how to read the messages to come.
+        """
+        return self.frame({"schema": {"format": self.name}})
+
+    def strings(self, start, end):
+        """
+        The message carrying entries start to end of the string table.
+        """
+        return None
+
+
+class JSONFormat(Format):
+    """
+    *Concrete* format sending every message as JSON text, with every node
+    as an object.
+    """
+
+    name = "json"
+
+    def node(self, doc):
+        return json.dumps(self.store.view(doc))
+
+    def frame(self, header, **nodeLists):
+        text = json.dumps(header)
+        if nodeLists:
+            lists = ", ".join('"{}": [{}]'.format(key, ", ".join(nodes))
+                              for key, nodes in sorted(nodeLists.items()))
+            text = text[:-1] + (", " if header else "") + lists + "}"
+        return Frame(text, 0)
+
+
+class BinaryFormat(Format):
+    """
+    *Abstract* format sending every message as a binary map, with every
+    node as an array of its FIELDS.
+
+    ObjectIds go as their 12 bytes.  The values of INTERNED fields go as
+    ids into a StringTable, shared by every client of a Cache.  The table
+    only grows, so a client is sent the entries it is missing (as
+    {"strings": [...], "start": n}) before a message which uses them.
+    """
+
+    binary = True
+
+    def __init__(self, store, table=None):
+        """
+        table is the StringTable to intern strings in.  Formats sharing a
+        Cache must share its table (see Cache.strings).
+        """
+        super(BinaryFormat, self).__init__(store)
+        self.table = table if table is not None else StringTable()
+
+    def _intern(self, value):
+        if value is None:
+            return None
+        return self.table.intern(value)
+
+    @staticmethod
+    def _plain(value):
+        binary = getattr(value, "binary", None)
+        return value if binary is None else binary
+
+    def _pack(self, obj):
+        raise NotImplementedError
+
+    def _head(self, major, length):
+        """
+        Encode the start of a map (major 5) or array (major 4) of length
+        items.
+        """
+        raise NotImplementedError
+
+    def _unpack(self, data):
+        raise NotImplementedError
+
+    def node(self, doc):
+        son = doc.to_mongo()
+        son["value"] = self.store.render(doc)
+        encoded = []
+        for field in FIELDS:
+            value = son.get(field)
+            if field in INTERNED:
+                encoded.append(self._intern(value))
+            elif field == "children":
+                encoded.append([self._plain(c) for c in value or ()])
+            else:
+                encoded.append(self._plain(value))
+        return self._pack(encoded)
+
+    def frame(self, header, **nodeLists):
+        parts = [self._head(5, len(header) + len(nodeLists))]
+        for key, value in header.items():
+            parts.append(self._pack(key))
+            parts.append(self._pack(value))
+        for key, nodes in sorted(nodeLists.items()):
+            parts.append(self._pack(key))
+            parts.append(self._head(4, len(nodes)))
+            parts.extend(nodes)
+        return Frame(b"".join(parts), len(self.table))
+
+    def load(self, message):
+        if isinstance(message, str):
+            return json.loads(message)
+        return self._unpack(message)
+
+    def schema(self):
+        return self.frame({"schema": {
+            "format": self.name,
+            "fields": list(FIELDS),
+            "interned": sorted(INTERNED),
+        }})
+
+    def strings(self, start, end):
+        return self.frame({
+            "strings": self.table.entries(start, end),
+            "start": start,
+        }).data
+
+
+class MessagePackFormat(BinaryFormat):
+    """
+    *Concrete* binary format using MessagePack.
+    """
+
+    name = "msgpack"
+
+    def _pack(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def _head(self, major, length):
+        packer = msgpack.Packer()
+        if major == 5:
+            return packer.pack_map_header(length)
+        return packer.pack_array_header(length)
+
+    def _unpack(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class CBORFormat(BinaryFormat):
+    """
+    *Concrete* binary format using CBOR.
+    """
+
+    name = "cbor"
+
+    def _pack(self, obj):
+        return cbor2.dumps(obj)
+
+    def _head(self, major, length):
+        major <<= 5
+        if length < 24:
+            return struct.pack(">B", major | length)
+        if length < 0x100:
+            return struct.pack(">BB", major | 24, length)
+        if length < 0x10000:
+            return struct.pack(">BH", major | 25, length)
+        return struct.pack(">BI", major | 26, length)
+
+    def _unpack(self, data):
+        return cbor2.loads(data)
+
+
+class Cache(object):
+    """
+    *Concrete* class to hold the encoded nodes of the latest stops.
+
+    A node is encoded the first time any client needs it, in a given
+    format, and every other client is sent the same bytes.  Only the last
+    keep stops are cached.  Nodes of older stops (wanted by a client which
+    has fallen far behind) are encoded without being kept.
+
+    strings is the StringTable of the binary formats encoding into the
+    cache.  reset drops both, when a new execution starts.
+    """
+
+    keep = 2
+
+    def __init__(self):
+        self._stops = collections.OrderedDict()
+        self.strings = StringTable()
+
+    def _stop(self, sequence):
+        encoded = self._stops.get(sequence)
+        if encoded is not None:
+            return encoded
+        # NOTE: publishing runs on another thread, so the keys are copied
+        # before they are looked at.
+        sequences = list(self._stops)
+        if sequences and sequence is not None and \
+                all(s is not None and s > sequence for s in sequences):
+            return None
+        encoded = self._stops[sequence] = dict()
+        while len(self._stops) > Cache.keep:
+            self._stops.popitem(last=False)
+        return encoded
+
+    def node(self, format, doc, sequence):
+        """
+        doc, from stop sequence, encoded in format.
+        """
+        encoded = self._stop(sequence)
+        if encoded is None:
+            return format.node(doc)
+        nodes = encoded.setdefault(format.name, dict())
+        node = nodes.get(doc.id)
+        if node is None:
+            node = nodes[doc.id] = format.node(doc)
+        return node
+
+    def forget(self, sequence, docs):
+        """
+        Drop what was encoded of docs, from stop sequence.
+        """
+        encoded = self._stops.get(sequence)
+        if encoded is None:
+            return
+        for nodes in encoded.values():
+            for doc in docs:
+                nodes.pop(doc.id, None)
+
+    def reset(self):
+        self._stops.clear()
+        self.strings.reset()
+
+    def __len__(self):
+        return sum(len(nodes) for encoded in self._stops.values()
+                   for nodes in encoded.values())
+
+
+def formats():
+    """
+    The format classes usable here, by websocket subprotocol, preferred
+    first.
+    """
+    available = collections.OrderedDict()
+    if msgpack is not None:
+        available["memoryoracle.msgpack"] = MessagePackFormat
+    if cbor2 is not None:
+        available["memoryoracle.cbor"] = CBORFormat
+    available["memoryoracle.json"] = JSONFormat
+    return available
+
+
+def negotiate(subprotocol, store, table=None):
+    """
+    The format for a client which agreed on subprotocol.  Clients which
+    agreed on none get JSON.  Binary formats intern strings in table.
+    """
+    formatClass = formats().get(subprotocol, JSONFormat)
+    if formatClass.binary:
+        return formatClass(store, table)
+    return formatClass(store)
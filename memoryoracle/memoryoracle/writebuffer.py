@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- encoding UTF-8 -*-
+"""
+Classes to write documents to the database in bulk rather than one round
+trip at a time, and off of gdb's thread.
+"""
+
+import atexit
+import collections
+import queue
+import threading
+import time
+import traceback
+
+import bson
+
+import storage
+
+
+class WriteBuffer(object):
+    """
+    *Concrete* class to collect the documents saved during a stop and write
+    them to storage.backend in bulk, batchSize operations at a time.
+
+    Documents get their ObjectId when they are added rather than when they
+    reach the database.  Parents can therefore refer to children which have
+    not been written yet.
+
+    With a pipeline attached, flush() only hands the batches over to the
+    pipeline's writer thread.
+    """
+
+    batchSize = 1000
+
+    def __init__(self, batchSize=None):
+        self.batchSize = batchSize or WriteBuffer.batchSize
+        self._pending = collections.OrderedDict()
+        self._count = 0
+        self.written = 0
+        self.batches = 0
+        self.pipeline = None
+
+    def __len__(self):
+        return self._count
+
+    def add(self, doc):
+        """
+        Queue doc to be written.  New documents are inserted and documents
+        which already have an id are replaced (or inserted if missing).
+        """
+        replace = doc.id is not None
+        if not replace:
+            doc.id = bson.ObjectId()
+        op = storage.Op(doc.id, doc.to_mongo(), replace)
+        collection = doc._get_collection_name()
+        self._pending.setdefault(collection, (collection, []))[1].append(op)
+        self._count += 1
+        if self._count >= self.batchSize:
+            self.flush()
+        return doc
+
+    def take(self):
+        """
+        Remove and return the pending operations as (collection, ops)
+        pairs.
+        """
+        pending = list(self._pending.values())
+        self._pending = collections.OrderedDict()
+        self._count = 0
+        return pending
+
+    @staticmethod
+    def write(collection, ops, batchSize):
+        """
+        Write ops to collection in batches.  Returns the number written.
+        """
+        return storage.connect().write(collection, ops, batchSize)
+
+    def flush(self, event=None):
+        for collection, ops in self.take():
+            if self.pipeline is not None:
+                self.pipeline.put(collection, ops, self.batchSize)
+            else:
+                self.written += WriteBuffer.write(
+                    collection, ops, self.batchSize)
+            self.batches += 1
+
+
+class Pipeline(threading.Thread):
+    """
+    *Concrete* class to write batches to the database from a thread of its
+    own, so the gdb stop handler only pays for extraction.
+
+    Batches wait in a queue of at most queueSize entries.  When the writer
+    falls that far behind, put() blocks (backpressure) and the time spent
+    blocked is counted.
+    """
+
+    queueSize = 64
+
+    def __init__(self, queueSize=None):
+        super(Pipeline, self).__init__(name="memoryoracle-writer")
+        self.daemon = True
+        self._queue = queue.Queue(maxsize=queueSize or Pipeline.queueSize)
+        self.enqueued = 0
+        self.written = 0
+        self.errors = 0
+        self.maxDepth = 0
+        self.blockedSeconds = 0.0
+
+    def put(self, collection, ops, batchSize):
+        start = time.monotonic()
+        self._queue.put((collection, ops, batchSize))
+        self.blockedSeconds += time.monotonic() - start
+        self.enqueued += len(ops)
+        self.maxDepth = max(self.maxDepth, self._queue.qsize())
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self.written += WriteBuffer.write(*item)
+            except Exception:
+                self.errors += 1
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def drain(self):
+        """
+        Block until everything handed over so far is written.
+        """
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self.join()
+
+    @property
+    def counters(self):
+        return {
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "pending": self.enqueued - self.written,
+            "errors": self.errors,
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.maxDepth,
+            "blocked_seconds": self.blockedSeconds,
+        }
+
+
+buffer = WriteBuffer()
+
+
+def start_pipeline(queueSize=None):
+    """
+    Move buffer's writes onto a background pipeline.  Everything is written
+    out before the interpreter exits, if stop_pipeline() was not called
+    first.
+    """
+    if buffer.pipeline is not None:
+        return buffer.pipeline
+    buffer.pipeline = Pipeline(queueSize)
+    buffer.pipeline.start()
+    atexit.register(stop_pipeline)
+    return buffer.pipeline
+
+
+def settle():
+    """
+    Block until everything buffered so far has reached storage.
+    """
+    buffer.flush()
+    if buffer.pipeline is not None:
+        buffer.pipeline.drain()
+
+
+def stop_pipeline():
+    pipeline = buffer.pipeline
+    if pipeline is None:
+        return
+    buffer.flush()
+    buffer.pipeline = None
+    pipeline.close()